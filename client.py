@@ -1,25 +1,219 @@
+import argparse
+import hashlib
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+
 import requests
 
+from core.synthetic import generate_billing_csv
+
+
+# Gerador de carga para o endpoint de upload. Vários clientes enviam arquivos ao mesmo tempo, cada um com a própria
+#   sessão HTTP (conexão reutilizada), e ao final são exibidas as latências, a taxa de erros e a vazão do servidor.
+#   Funciona contra o `runserver` ou um servidor ASGI local, sem nenhum serviço externo.
+#
+#   python client.py --clients 8 --duration 30 --rows 10000 100000
+
+
+def percentile(values: list, percent: float) -> float:
+    """Função para calcular um percentil (nearest-rank) de uma lista de valores.
+
+    Args:
+        values (list): Valores ordenados.
+        percent (float): Percentil entre 0 e 100.
+
+    Returns:
+        float: Valor do percentil ou 0 se a lista estiver vazia.
+    """
+    if not values:
+        return 0.0
+    rank = max(math.ceil(percent / 100 * len(values)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def prepare_files(directory: str, sizes: list, files_per_size: int, duplicate_ratio: float,
+                  invalid_ratio: float) -> list:
+    """Função para gerar os arquivos enviados durante o teste.
+
+    Cada arquivo tem uma semente diferente, então o conteúdo (e o hash) é único e o servidor não trata o envio como
+    um arquivo repetido. Depois que todos os arquivos forem enviados, os próximos envios repetem os mesmos arquivos.
+
+    Returns:
+        list: Tuplas (caminho, quantidade de linhas, sha256 do arquivo).
+    """
+    files = []
+    for rows in sizes:
+        for index in range(files_per_size):
+            path = os.path.join(directory, f'load-{rows}-{index}.csv')
+            generate_billing_csv(path, rows, duplicate_ratio, invalid_ratio, seed=int(time.time()) * 1000 + index)
+            with open(path, 'rb') as f:
+                digest = hashlib.file_digest(f, 'sha256').hexdigest()
+            files.append((path, rows, digest))
+    return files
+
+
+class LoadTest():
+    """Classe para executar o teste de carga e acumular os resultados de todos os clientes.
+    """
+
+    def __init__(self, url: str, files: list, clients: int, duration: float, max_requests: int = None,
+                 wait: bool = False, timeout: float = 300):
+        self.url = url.rstrip('/') + '/'
+        self.files = files
+        self.clients = clients
+        self.duration = duration
+        self.max_requests = max_requests
+        self.wait = wait
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.latencies = []
+        self.completions = []
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.bytes_sent = 0
+        self.rows_accepted = 0
+        self.rows_processed = 0
+        self.deduplicated = 0
+
+    def next_file(self) -> tuple:
+        with self.lock:
+            if self.max_requests is not None and self.sent >= self.max_requests:
+                return None
+            file = self.files[self.sent % len(self.files)]
+            self.sent += 1
+            return file
+
+    def run(self) -> dict:
+        self.started = time.perf_counter()
+        self.deadline = self.started + self.duration
+        threads = [threading.Thread(target=self.client, daemon=True) for _ in range(self.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.report(time.perf_counter() - self.started)
+
+    def client(self):
+        # Uma sessão por cliente: a conexão TCP é reutilizada entre os envios (keep-alive).
+        with requests.Session() as session:
+            while time.perf_counter() < self.deadline:
+                file = self.next_file()
+                if file is None:
+                    return
+                self.upload(session, *file)
+
+    def upload(self, session: requests.Session, path: str, rows: int, digest: str):
+        et1 = time.perf_counter()
+        try:
+            with open(path, 'rb') as f:
+                # Com o hash no cabeçalho o servidor não lê de novo um arquivo que já recebeu.
+                response = session.post(self.url, files={'file': (os.path.basename(path), f, 'text/csv')},
+                                        headers={'X-Content-SHA256': digest}, timeout=self.timeout)
+        except requests.RequestException as e:
+            with self.lock:
+                self.errors[type(e).__name__] += 1
+            return
+        latency = time.perf_counter() - et1
+        # Um arquivo repetido devolve o job já existente (200 ou 202) e não é processado novamente.
+        queued = response.status_code == 202 and response.json()['message'] == 'file queued for processing'
+        with self.lock:
+            self.latencies.append(latency)
+            self.statuses[response.status_code] += 1
+            self.bytes_sent += os.path.getsize(path)
+            if queued:
+                self.rows_accepted += rows
+            elif response.status_code < 400:
+                self.deduplicated += 1
+        if self.wait and queued:
+            self.wait_job(session, response.json()['data']['file'], et1)
+
+    def wait_job(self, session: requests.Session, file_id: int, started: float):
+        # Acompanha o job até o fim para medir a vazão real do processamento, não apenas do upload.
+        while time.perf_counter() - started < self.timeout:
+            try:
+                data = session.get(f'{self.url}{file_id}/', timeout=self.timeout).json()['data']
+            except (requests.RequestException, ValueError, KeyError) as e:
+                with self.lock:
+                    self.errors[f'status: {type(e).__name__}'] += 1
+                return
+            if data['state'] in ('DO', 'FA'):
+                with self.lock:
+                    self.completions.append(time.perf_counter() - started)
+                    self.rows_processed += data['rows_parsed']
+                    if data['state'] == 'FA':
+                        self.errors['job failed'] += 1
+                return
+            time.sleep(0.2)
+        with self.lock:
+            self.errors['job timeout'] += 1
+
+    def report(self, elapsed: float) -> dict:
+        latencies = sorted(self.latencies)
+        completions = sorted(self.completions)
+        requests_total = len(latencies) + sum(count for name, count in self.errors.items()
+                                              if not name.startswith(('status', 'job')))
+        failed = sum(self.errors.values()) + sum(count for status, count in self.statuses.items() if status >= 400)
+        return {
+            'elapsed_seconds': elapsed,
+            'clients': self.clients,
+            'requests': requests_total,
+            'statuses': dict(self.statuses),
+            'deduplicated': self.deduplicated,
+            'errors': dict(self.errors),
+            'error_rate': failed / requests_total if requests_total else 0.0,
+            'latency_seconds': {'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95),
+                                'p99': percentile(latencies, 99), 'max': latencies[-1] if latencies else 0.0},
+            'requests_per_second': len(latencies) / elapsed,
+            'upload_mb_per_second': self.bytes_sent / elapsed / 1024 / 1024,
+            'accepted_rows_per_second': self.rows_accepted / elapsed,
+            'processing_seconds': {'p50': percentile(completions, 50), 'p95': percentile(completions, 95),
+                                   'p99': percentile(completions, 99)} if self.wait else None,
+            'processed_rows_per_second': self.rows_processed / elapsed if self.wait else None,
+        }
+
+
+def print_report(report: dict):
+    latency = report['latency_seconds']
+    print(f'{report["requests"]} envios em {report["elapsed_seconds"]:.1f}s com {report["clients"]} clientes')
+    print(f'status: {report["statuses"]}  repetidos: {report["deduplicated"]}  erros: {report["errors"]}  taxa de erro: {report["error_rate"]:.2%}')
+    print(f'latência p50 {latency["p50"]:.3f}s  p95 {latency["p95"]:.3f}s  p99 {latency["p99"]:.3f}s  '
+          f'máx {latency["max"]:.3f}s')
+    print(f'{report["requests_per_second"]:.2f} envios/s  {report["upload_mb_per_second"]:.2f} MB/s  '
+          f'{report["accepted_rows_per_second"]:.0f} linhas aceitas/s')
+    if report['processing_seconds'] is not None:
+        processing = report['processing_seconds']
+        print(f'processamento p50 {processing["p50"]:.3f}s  p95 {processing["p95"]:.3f}s  '
+              f'p99 {processing["p99"]:.3f}s  {report["processed_rows_per_second"]:.0f} linhas processadas/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de carga do endpoint de upload de arquivos.')
+    parser.add_argument('--url', default='http://localhost:8000/api/files/', help='URL do endpoint de upload.')
+    parser.add_argument('--clients', type=int, default=4, help='Quantidade de clientes simultâneos.')
+    parser.add_argument('--duration', type=float, default=30, help='Duração do teste em segundos.')
+    parser.add_argument('--requests', type=int, default=None, help='Quantidade máxima de envios. Opcional.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000], help='Linhas de cada tamanho de arquivo.')
+    parser.add_argument('--files-per-size', type=int, default=10, help='Arquivos distintos de cada tamanho.')
+    parser.add_argument('--duplicate-ratio', type=float, default=0.0, help='Proporção de debtIds repetidos.')
+    parser.add_argument('--invalid-ratio', type=float, default=0.0, help='Proporção de linhas inválidas.')
+    parser.add_argument('--wait', action='store_true', help='Acompanha cada job até o fim do processamento.')
+    parser.add_argument('--timeout', type=float, default=300, help='Tempo máximo de cada envio, em segundos.')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='fileapi-load-')
+    try:
+        files = prepare_files(directory, args.rows, args.files_per_size, args.duplicate_ratio, args.invalid_ratio)
+        load_test = LoadTest(args.url, files, args.clients, args.duration, args.requests, args.wait, args.timeout)
+        print_report(load_test.run())
+    finally:
+        shutil.rmtree(directory)
+
 
-def post_fake_data():
-    # servidor local
-    url = 'http://localhost:8000/api/files/'
-    
-    # enviando o arquivo csv para a api
-    response = requests.post(url, files={'file': open('testfiles/input.txt', 'rb')})
-    print(response.text, response.status_code, response.elapsed.total_seconds())
-
-
-def post_data():
-    # servidor local
-    url = 'http://localhost:8000/api/files/'
-    
-    # enviando o arquivo csv para a api
-    response = requests.post(url, files={'file': open('testfiles/input.csv', 'rb')})
-    print(response.text, response.status_code, response.elapsed.total_seconds())
-    
-    
 if __name__ == '__main__':
-    post_data()
-    # post_fake_data()
-    
\ No newline at end of file
+    main()
@@ -1,6 +1,20 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # A escrita dos logs sai das threads do processamento e passa para uma thread própria (ver core/logs.py).
+        if settings.LOGGING_ASYNC:
+            from .logs import start_async_logging
+            start_async_logging(list(settings.LOGGING['loggers']))
+
+        # Conta as conexões abertas por este processo, para acompanhar o efeito do CONN_MAX_AGE e do pool.
+        from django.db.backends.signals import connection_created
+        from .metrics import DB_CONNECTIONS_OPENED
+        connection_created.connect(
+            lambda sender, connection, **kwargs: DB_CONNECTIONS_OPENED.inc(alias=connection.alias),
+            weak=False, dispatch_uid='core.db_connections_opened')
@@ -0,0 +1,104 @@
+import threading
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.postgresql import base
+from psycopg import IsolationLevel
+from psycopg_pool import ConnectionPool, PoolTimeout
+
+from core.metrics import DB_POOL_CONNECTIONS, DB_POOL_TIMEOUTS, DB_POOL_WAIT_SECONDS
+
+
+# Backend do PostgreSQL com um pool de conexões do psycopg 3 por processo. Em vez de abrir uma conexão a cada
+#   requisição (ou a cada job), o Django pega uma conexão do pool e a devolve quando a fecharia. As threads do servidor,
+#   os workers do processamento e o dispatcher compartilham o mesmo pool; cada processo da leitura paralela tem o seu.
+#
+# O pool é configurado pela chave POOL de DATABASES (ver settings.py), com os argumentos do ConnectionPool: min_size,
+#   max_size, timeout, max_idle e max_lifetime. Com o pool, CONN_MAX_AGE deve ser 0 para que a conexão volte ao pool ao
+#   fim de cada requisição.
+_pools = {}
+_lock = threading.Lock()
+
+
+def get_pool(alias: str, conn_params: dict, options: dict) -> ConnectionPool:
+    """Função para obter (ou criar) o pool de conexões de um banco.
+
+    Args:
+        alias (str): Alias do banco em DATABASES.
+        conn_params (dict): Parâmetros de conexão montados pelo backend do Django.
+        options (dict): Argumentos do ConnectionPool.
+
+    Returns:
+        ConnectionPool: Pool do banco neste processo.
+    """
+    with _lock:
+        pool = _pools.get(alias)
+        if pool is None:
+            # O check valida a conexão a cada retirada, substituindo o CONN_HEALTH_CHECKS das conexões persistentes.
+            pool = ConnectionPool(kwargs=conn_params, name=alias, check=ConnectionPool.check_connection, open=True,
+                                  **options)
+            _pools[alias] = pool
+        return pool
+
+
+def close_pools():
+    """Função para fechar os pools deste processo."""
+    with _lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
+def checkout(pool: ConnectionPool, alias: str):
+    """Função para retirar uma conexão do pool, registrando o tempo de espera nas métricas.
+
+    Raises:
+        PoolTimeout: Nenhuma conexão ficou livre dentro do timeout do pool.
+    """
+    et1 = time.perf_counter()
+    try:
+        connection = pool.getconn()
+    except PoolTimeout:
+        DB_POOL_TIMEOUTS.inc(alias=alias)
+        raise
+    finally:
+        DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - et1, alias=alias)
+    record_pool_stats(pool, alias)
+    return connection
+
+
+def record_pool_stats(pool: ConnectionPool, alias: str):
+    stats = pool.get_stats()
+    DB_POOL_CONNECTIONS.set(stats.get('pool_size', 0), alias=alias, state='open')
+    DB_POOL_CONNECTIONS.set(stats.get('pool_available', 0), alias=alias, state='idle')
+    DB_POOL_CONNECTIONS.set(stats.get('requests_waiting', 0), alias=alias, state='waiting')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """Classe do backend do PostgreSQL que usa o pool de conexões do processo.
+    """
+
+    def get_new_connection(self, conn_params):
+        # Mesma configuração do nível de isolamento do backend original, que abre a conexão diretamente.
+        isolation_level = self.settings_dict['OPTIONS'].get('isolation_level')
+        try:
+            self.isolation_level = IsolationLevel(isolation_level if isolation_level is not None
+                                                  else IsolationLevel.READ_COMMITTED)
+        except ValueError:
+            raise ImproperlyConfigured(
+                f'Invalid transaction isolation level {isolation_level} specified. Use one of the '
+                f'psycopg.IsolationLevel values.')
+        self.pool = get_pool(self.alias, conn_params, self.settings_dict.get('POOL') or {})
+        connection = checkout(self.pool, self.alias)
+        if isolation_level is not None:
+            connection.isolation_level = self.isolation_level
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        with self.wrap_database_errors:
+            # O pool desfaz uma transação aberta e descarta conexões quebradas antes de reutilizá-las.
+            self.pool.putconn(self.connection)
+            self.connection = None
+            record_pool_stats(self.pool, self.alias)
@@ -0,0 +1,16 @@
+from django.db.backends.sqlite3 import base
+
+
+# Backend do SQLite que abre as transações com BEGIN IMMEDIATE (o mesmo que a opção transaction_mode do Django 5.1).
+#   Com o BEGIN padrão (DEFERRED) a transação começa só com o lock de leitura e precisa promovê-lo na primeira escrita.
+#   Quando várias conexões fazem isso ao mesmo tempo, como os processos da leitura paralela que consultam os debt_ids
+#   existentes e depois inserem o lote, o SQLite não consegue promover o lock e falha na hora com "database is
+#   locked", sem respeitar o timeout. Com o lock de escrita pego no início, as transações esperam a vez até o timeout.
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """Classe do backend do SQLite com transações de escrita imediata.
+    """
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
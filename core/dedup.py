@@ -0,0 +1,121 @@
+import threading
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+
+from .metrics import ROWS
+from .models import Billing
+
+
+# Etapa de deduplicação antes da inserção via COPY. Reenvios de arquivos e linhas repetidas são comuns; sem essa
+#   etapa cada linha repetida ainda é enviada para a tabela temporária e só é descartada no INSERT ... ON CONFLICT.
+#
+# O cache guarda, por processo, os debt_ids mais recentes que já estão gravados no banco. Os ids só entram no cache
+#   depois do commit da transação que os gravou, então um lote desfeito nunca deixa ids no cache; os ids lidos no
+#   aquecimento entram direto, já que o lote ainda não inseriu nada. Cobranças podem ser apagadas por qualquer processo (ver `discard_upload`) sem que o cache dos outros fique
+#   sabendo, então um id no cache é apenas um indício: os ids encontrados são confirmados no banco com uma única
+#   consulta por lote antes de as linhas serem descartadas. Um id que não está no cache segue o caminho normal, com a
+#   restrição unique de debt_id.
+
+
+class DebtIdCache():
+    """Classe com um cache LRU dos debt_ids já gravados no banco.
+
+    É segura para ser compartilhada entre as threads do processo. Os ids são guardados como inteiros de 128 bits.
+    """
+
+    def __init__(self, size: int = None):
+        self.size = size
+        self.ids = OrderedDict()
+        self.warmed = False
+        self.lock = threading.Lock()
+
+    @property
+    def capacity(self) -> int:
+        return settings.BILLING_DEDUP_CACHE_SIZE if self.size is None else self.size
+
+    def filter(self, rows: list, key: int = 5) -> tuple:
+        """Função para descartar as linhas cujo debt_id já está gravado no banco (segundo o cache) ou se repete
+        dentro do lote.
+
+        Args:
+            rows (list): Linhas do lote.
+            key (int): Posição do debt_id em cada linha.
+
+        Returns:
+            tuple: Linhas que seguem para a inserção e quantidade de linhas descartadas.
+        """
+        if not self.capacity:
+            return rows, 0
+        self.warm()
+        kept = []
+        seen = set()
+        cached = {}
+        with self.lock:
+            ids = self.ids
+            for row in rows:
+                debt_id = _as_int(row[key])
+                if debt_id in seen or debt_id in cached:
+                    continue
+                if debt_id in ids:
+                    cached[debt_id] = row
+                    continue
+                seen.add(debt_id)
+                kept.append(row)
+        if cached:
+            confirmed = {debt_id.int for debt_id in Billing.objects.filter(
+                debt_id__in=[uuid.UUID(int=debt_id) for debt_id in cached]).values_list('debt_id', flat=True)}
+            with self.lock:
+                for debt_id, row in cached.items():
+                    if debt_id in confirmed:
+                        if debt_id in self.ids:
+                            self.ids.move_to_end(debt_id)
+                        continue
+                    # Apagado por outro processo: a linha segue para a inserção e o id volta ao cache no commit.
+                    self.ids.pop(debt_id, None)
+                    seen.add(debt_id)
+                    kept.append(row)
+        dropped = len(rows) - len(kept)
+        if dropped:
+            ROWS.inc(dropped, stage='dedup', result='dropped')
+        # Depois do commit todos os ids do lote estão no banco: os inseridos e os que o banco descartou.
+        transaction.on_commit(lambda: self.add(seen))
+        return kept, dropped
+
+    def add(self, debt_ids):
+        with self.lock:
+            ids = self.ids
+            for debt_id in debt_ids:
+                ids[debt_id] = None
+                ids.move_to_end(debt_id)
+            while len(ids) > self.capacity:
+                ids.popitem(last=False)
+
+    def warm(self):
+        """Função para carregar no cache os debt_ids gravados mais recentemente, uma vez por processo.
+        """
+        if self.warmed:
+            return
+        with self.lock:
+            if self.warmed:
+                return
+            self.warmed = True
+        recent = Billing.objects.order_by('-id').values_list('debt_id', flat=True)[:self.capacity]
+        # Os ids já estão gravados, então entram no cache mesmo que a transação do lote seja desfeita; caso contrário o
+        #   aquecimento seria perdido e não aconteceria de novo no processo.
+        self.add(debt_id.int for debt_id in list(recent)[::-1])
+
+    def clear(self):
+        """Função para esvaziar o cache, por exemplo depois de apagar muitas cobranças no próprio processo.
+        """
+        with self.lock:
+            self.ids.clear()
+
+
+def _as_int(value) -> int:
+    return value.int if isinstance(value, uuid.UUID) else uuid.UUID(str(value)).int
+
+
+DEBT_IDS = DebtIdCache()
@@ -0,0 +1,283 @@
+import asyncio
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import AsyncGenerator, Generator, Iterable
+
+from django.conf import settings
+
+from .metrics import ROWS, ROWS_PER_SECOND, STAGE_SECONDS
+from .models import Billing
+from .utils import CreatePDFBillingClient, SendNotificationBillingClient, batched, log_info
+
+
+class DispatchResult(namedtuple('DispatchResult', ['billing', 'pdf_created', 'notified'])):
+    """Resultado do processamento de uma cobrança pelo dispatcher.
+    """
+
+    @property
+    def status(self) -> str:
+        # Uma linha com o pdf criado e a notificação com erro fica como INVOICE_CREATED e, ao ser reprocessada,
+        #   recebe apenas a notificação. FAILED indica que o próprio pdf falhou.
+        if self.notified:
+            return Billing.Status.NOTIFICATION_SENT
+        return Billing.Status.INVOICE_CREATED if self.pdf_created else Billing.Status.FAILED
+
+
+class RateLimiter():
+    """Classe para limitar a quantidade de chamadas por segundo a um serviço (token bucket).
+
+    É segura para ser compartilhada entre as threads do dispatcher.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Bloqueia a thread atual até que uma chamada seja permitida.
+        """
+        while delay := self._take():
+            time.sleep(delay)
+
+    async def aacquire(self):
+        """Versão assíncrona de `acquire`: aguarda sem bloquear o event loop.
+        """
+        while delay := self._take():
+            await asyncio.sleep(delay)
+
+    def _take(self) -> float:
+        # Consome um token e retorna 0, ou retorna quanto tempo falta para o próximo token.
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+class BillingDispatcher():
+    """Classe para criar os pdfs e enviar as notificações das cobranças em paralelo.
+
+    As instâncias dos clientes são criadas uma única vez e compartilhadas entre as threads. Cada thread processa um
+    lote de cobranças e chama os serviços com as APIs em lote, então o custo fixo de cada chamada é dividido entre as
+    cobranças do lote. A quantidade de lotes em andamento é limitada para que o consumo de memória não dependa do
+    tamanho do arquivo.
+    """
+
+    def __init__(self, max_workers: int = None, pdf_rate_limit: float = None, notification_rate_limit: float = None,
+                 pdf_client: CreatePDFBillingClient = None,
+                 notification_client: SendNotificationBillingClient = None, pdf_batch_size: int = None,
+                 notification_batch_size: int = None):
+        self.max_workers = max_workers or settings.DISPATCH_MAX_WORKERS
+        self.pdf_batch_size = pdf_batch_size or settings.DISPATCH_PDF_BATCH_SIZE
+        self.notification_batch_size = notification_batch_size or settings.DISPATCH_NOTIFICATION_BATCH_SIZE
+        pdf_rate_limit = pdf_rate_limit or settings.DISPATCH_PDF_RATE_LIMIT
+        notification_rate_limit = notification_rate_limit or settings.DISPATCH_NOTIFICATION_RATE_LIMIT
+        self.pdf_client = pdf_client or CreatePDFBillingClient()
+        self.notification_client = notification_client or SendNotificationBillingClient()
+        self.pdf_limiter = RateLimiter(pdf_rate_limit) if pdf_rate_limit else None
+        self.notification_limiter = RateLimiter(notification_rate_limit) if notification_rate_limit else None
+        self.stats = {'rows': 0, 'pdf_created': 0, 'notified': 0, 'failed': 0, 'seconds': 0.0, 'rows_per_second': 0.0}
+
+    def dispatch_batch(self, billings: list) -> list:
+        """Cria os pdfs e envia as notificações de um lote de cobranças respeitando o limite de cada serviço.
+
+        As chamadas usam as APIs em lote dos clientes, com no máximo `pdf_batch_size` e `notification_batch_size`
+        cobranças por chamada. Cobranças que já estão com o pdf criado não geram um novo pdf, e a notificação só é
+        enviada se o pdf existir.
+
+        Args:
+            billings (list): Cobranças a serem processadas.
+
+        Returns:
+            list: DispatchResult de cada cobrança, na mesma ordem do lote.
+        """
+        pdf_created = [getattr(billing, 'status', None) == Billing.Status.INVOICE_CREATED for billing in billings]
+        missing = [index for index, created in enumerate(pdf_created) if not created]
+        for chunk in batched(missing, self.pdf_batch_size):
+            if self.pdf_limiter:
+                self.pdf_limiter.acquire()
+            et1 = time.time()
+            results = self.pdf_client.create_pdf_files([billings[index] for index in chunk])
+            self._record_call('pdf', time.time() - et1, results)
+            for index, created in zip(chunk, results):
+                pdf_created[index] = created
+        notified = [False] * len(billings)
+        ready = [index for index, created in enumerate(pdf_created) if created]
+        for chunk in batched(ready, self.notification_batch_size):
+            if self.notification_limiter:
+                self.notification_limiter.acquire()
+            et1 = time.time()
+            results = self.notification_client.send_notifications([billings[index] for index in chunk])
+            self._record_call('notification', time.time() - et1, results)
+            for index, sent in zip(chunk, results):
+                notified[index] = sent
+        # Um resumo por lote no lugar de uma mensagem por cobrança (ver PROCESSING_LOG_PER_ROW).
+        log_info('Lote de %d cobranças: %d pdfs criados, %d notificações enviadas', len(billings), sum(pdf_created),
+                 sum(notified))
+        return [DispatchResult(*result) for result in zip(billings, pdf_created, notified)]
+
+    def map(self, billings: Iterable) -> Generator:
+        """Processa as cobranças no pool de threads e retorna os resultados na ordem em que terminam.
+
+        Args:
+            billings (Iterable): Cobranças a serem processadas. Pode ser um generator.
+
+        Returns:
+            Generator: generator de DispatchResult.
+        """
+        et1 = time.time()
+        max_pending = self.max_workers * 2
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='dispatch') as executor:
+            pending = set()
+            for batch in batched(billings, max(self.pdf_batch_size, self.notification_batch_size)):
+                pending.add(executor.submit(self.dispatch_batch, batch))
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    yield from self._collect(done)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from self._collect(done)
+        self.stats['seconds'] = time.time() - et1
+        if self.stats['seconds']:
+            self.stats['rows_per_second'] = self.stats['rows'] / self.stats['seconds']
+            ROWS_PER_SECOND.set(self.stats['rows_per_second'], stage='dispatch')
+        log_info('Envio de notificações: %d linhas em %s (%.2f linhas/s)', self.stats['rows'], self.stats['seconds'],
+                 self.stats['rows_per_second'])
+
+    def _record_call(self, stage: str, seconds: float, results: list):
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        succeeded = sum(1 for result in results if result)
+        ROWS.inc(succeeded, stage=stage, result='success')
+        ROWS.inc(len(results) - succeeded, stage=stage, result='failure')
+
+    def _collect(self, futures) -> Generator:
+        for future in futures:
+            for result in future.result():
+                self.stats['rows'] += 1
+                self.stats['pdf_created'] += result.pdf_created
+                self.stats['notified'] += result.notified
+                self.stats['failed'] += not result.notified
+                yield result
+
+    def dispatch(self, billings: Iterable) -> dict:
+        """Processa todas as cobranças e retorna apenas as estatísticas.
+
+        Args:
+            billings (Iterable): Cobranças a serem processadas.
+
+        Returns:
+            dict: Estatísticas do envio, incluindo a vazão em linhas por segundo.
+        """
+        for _ in self.map(billings):
+            pass
+        return self.stats
+
+
+class AsyncBillingDispatcher(BillingDispatcher):
+    """Dispatcher que usa asyncio no lugar do pool de threads.
+
+    Os lotes são processados por tarefas em um único event loop, com no máximo `max_workers` lotes em andamento.
+    Clientes que implementam `acreate_pdf_files` e `asend_notifications` são chamados diretamente no event loop, o
+    que permite muitas chamadas simultâneas sem uma thread para cada; os demais são executados em threads com
+    `asyncio.to_thread`.
+    """
+
+    async def adispatch_batch(self, billings: list) -> list:
+        """Versão assíncrona de `dispatch_batch`.
+
+        Args:
+            billings (list): Cobranças a serem processadas.
+
+        Returns:
+            list: DispatchResult de cada cobrança, na mesma ordem do lote.
+        """
+        pdf_created = [getattr(billing, 'status', None) == Billing.Status.INVOICE_CREATED for billing in billings]
+        missing = [index for index, created in enumerate(pdf_created) if not created]
+        for chunk in batched(missing, self.pdf_batch_size):
+            if self.pdf_limiter:
+                await self.pdf_limiter.aacquire()
+            et1 = time.time()
+            results = await self._call(self.pdf_client, 'create_pdf_files', [billings[index] for index in chunk])
+            self._record_call('pdf', time.time() - et1, results)
+            for index, created in zip(chunk, results):
+                pdf_created[index] = created
+        notified = [False] * len(billings)
+        ready = [index for index, created in enumerate(pdf_created) if created]
+        for chunk in batched(ready, self.notification_batch_size):
+            if self.notification_limiter:
+                await self.notification_limiter.aacquire()
+            et1 = time.time()
+            results = await self._call(self.notification_client, 'send_notifications',
+                                       [billings[index] for index in chunk])
+            self._record_call('notification', time.time() - et1, results)
+            for index, sent in zip(chunk, results):
+                notified[index] = sent
+        log_info('Lote de %d cobranças: %d pdfs criados, %d notificações enviadas', len(billings), sum(pdf_created),
+                 sum(notified))
+        return [DispatchResult(*result) for result in zip(billings, pdf_created, notified)]
+
+    async def amap(self, billings) -> AsyncGenerator:
+        """Processa as cobranças e retorna os resultados na ordem em que terminam.
+
+        Args:
+            billings (Iterable | AsyncIterable): Cobranças a serem processadas.
+
+        Returns:
+            AsyncGenerator: async generator de DispatchResult.
+        """
+        et1 = time.time()
+        size = max(self.pdf_batch_size, self.notification_batch_size)
+        pending = set()
+        async for batch in _abatched(billings, size):
+            pending.add(asyncio.ensure_future(self.adispatch_batch(batch)))
+            if len(pending) >= self.max_workers:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for result in self._collect(done):
+                    yield result
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for result in self._collect(done):
+                yield result
+        self.stats['seconds'] = time.time() - et1
+        if self.stats['seconds']:
+            self.stats['rows_per_second'] = self.stats['rows'] / self.stats['seconds']
+            ROWS_PER_SECOND.set(self.stats['rows_per_second'], stage='dispatch')
+        log_info('Envio de notificações (asyncio): %d linhas em %s (%.2f linhas/s)', self.stats['rows'],
+                 self.stats['seconds'], self.stats['rows_per_second'])
+
+    async def adispatch(self, billings) -> dict:
+        """Processa todas as cobranças e retorna apenas as estatísticas.
+        """
+        async for _ in self.amap(billings):
+            pass
+        return self.stats
+
+    async def _call(self, client, method: str, billings: list) -> list:
+        native = getattr(client, f'a{method}', None)
+        if native is not None:
+            return await native(billings)
+        return await asyncio.to_thread(getattr(client, method), billings)
+
+
+async def _abatched(billings, size: int) -> AsyncGenerator:
+    # Agrupa em lotes tanto iteráveis comuns quanto assíncronos (por exemplo, um QuerySet com `async for`).
+    if not hasattr(billings, '__aiter__'):
+        for batch in batched(billings, size):
+            yield batch
+        return
+    batch = []
+    async for billing in billings:
+        batch.append(billing)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,123 @@
+import csv
+import io
+import json
+import zlib
+from typing import AsyncGenerator, Generator, Iterable
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+from psycopg import sql
+
+from .models import Billing
+
+
+# Exportação das cobranças processadas de um arquivo, com o status, para conciliação. As linhas saem do banco em
+#   blocos (COPY TO no PostgreSQL ou um cursor no servidor via .iterator()), são convertidas e comprimidas bloco a
+#   bloco e enviadas por um StreamingHttpResponse, então a memória usada não depende do tamanho do arquivo.
+
+# Colunas exportadas e os nomes usados no cabeçalho do csv e nas chaves do ndjson. Os nomes são os mesmos do csv
+#   recebido, com o status no final.
+EXPORT_COLUMNS = (
+    ('name', 'name'),
+    ('government_id', 'governmentId'),
+    ('email', 'email'),
+    ('debt_amount', 'debtAmount'),
+    ('debt_due_date', 'debtDueDate'),
+    ('debt_id', 'debtId'),
+    ('status', 'status'),
+)
+EXPORT_FORMATS = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson; charset=utf-8'}
+
+
+def export_billings(file_id: int, export_format: str = 'csv') -> Generator:
+    """Função para gerar o conteúdo da exportação das cobranças de um arquivo, em blocos de bytes.
+
+    No PostgreSQL, com `settings.BILLING_LOADER = 'copy'`, o csv é gerado pelo próprio banco com COPY TO. Nos demais
+    casos as linhas são lidas com um cursor no servidor em blocos de `settings.BILLING_BATCH_SIZE`.
+
+    Args:
+        file_id (int): Id do arquivo.
+        export_format (str): 'csv' ou 'ndjson'.
+
+    Returns:
+        Generator: generator com os blocos de bytes do arquivo exportado.
+    """
+    if export_format == 'csv' and settings.BILLING_LOADER == 'copy' and connection.vendor == 'postgresql':
+        return copy_billings_csv(file_id)
+    rows = Billing.objects.filter(file_id=file_id).order_by('id').values_list(
+        *(column for column, _ in EXPORT_COLUMNS)).iterator(chunk_size=settings.BILLING_BATCH_SIZE)
+    encode = encode_csv if export_format == 'csv' else encode_ndjson
+    return encode(rows, settings.BILLING_BATCH_SIZE)
+
+
+def encode_csv(rows: Iterable, chunk_rows: int) -> Generator:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(name for _, name in EXPORT_COLUMNS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % chunk_rows == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def encode_ndjson(rows: Iterable, chunk_rows: int) -> Generator:
+    names = [name for _, name in EXPORT_COLUMNS]
+    lines = []
+    for row in rows:
+        # default=str converte Decimal, date e UUID para texto, como no csv.
+        lines.append(json.dumps(dict(zip(names, row)), default=str))
+        if len(lines) >= chunk_rows:
+            yield ('\n'.join(lines) + '\n').encode()
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode()
+
+
+def copy_billings_csv(file_id: int) -> Generator:
+    """Função para gerar o csv das cobranças de um arquivo com COPY ... TO STDOUT do PostgreSQL (psycopg 3).
+
+    O banco formata as linhas e o psycopg entrega os dados em blocos, sem criar um objeto Python por linha.
+    """
+    columns = sql.SQL(', ').join(sql.SQL('{} AS {}').format(sql.Identifier(column), sql.Identifier(name))
+                                 for column, name in EXPORT_COLUMNS)
+    query = sql.SQL('COPY (SELECT {} FROM {} WHERE file_id = {} ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER)')
+    query = query.format(columns, sql.Identifier(Billing._meta.db_table), sql.Literal(file_id))
+    with connection.cursor() as cursor:
+        with cursor.cursor.copy(query) as copy:
+            for data in copy:
+                yield bytes(data)
+
+
+def gzip_chunks(chunks: Iterable, level: int = 6) -> Generator:
+    """Função para comprimir em gzip uma sequência de blocos de bytes à medida que eles são gerados.
+
+    Args:
+        chunks (Iterable): Blocos de bytes.
+        level (int): Nível de compressão, de 1 a 9.
+
+    Returns:
+        Generator: generator com os blocos do arquivo gzip.
+    """
+    # wbits=31 gera o cabeçalho e o rodapé do formato gzip.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def aiterate(chunks: Iterable) -> AsyncGenerator:
+    """Função para entregar um generator síncrono a um servidor ASGI, um bloco por vez.
+
+    O StreamingHttpResponse do Django 4.2 consome um iterador síncrono inteiro antes de enviá-lo em ASGI. Aqui cada
+    bloco é lido em uma thread via sync_to_async, sempre a mesma da requisição, onde está o cursor aberto no banco.
+    """
+    chunks = iter(chunks)
+    done = object()
+    while (chunk := await sync_to_async(next)(chunks, done)) is not done:
+        yield chunk
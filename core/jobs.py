@@ -0,0 +1,187 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .metrics import JOBS, JOBS_IN_FLIGHT
+from .models import ProcessingJob
+from .parallel import process_csv_content_parallel
+from .processing import reconcile_ingestion_counts, send_notification_and_create_pdf
+from .utils import log_error, log_info
+
+
+# O banco de dados é a única fila do sistema. O pool local é apenas um atalho para começar o processamento assim que
+#   o upload termina; um job que ficar QUEUED (por exemplo, se o processo reiniciar) é recuperado pelo comando
+#   `process_jobs`, que lê os jobs pendentes diretamente do banco.
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Função para obter o pool de workers local, criado sob demanda.
+
+    Returns:
+        ThreadPoolExecutor: Pool com `settings.FILE_PROCESSING_WORKERS` threads.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.FILE_PROCESSING_WORKERS,
+                                           thread_name_prefix='file-processing')
+        return _executor
+
+
+def enqueue_job(job: ProcessingJob):
+    """Função para agendar o processamento de um job.
+
+    Com `settings.FILE_PROCESSING_EAGER` o job é executado imediatamente na thread atual (útil para testes).
+
+    Args:
+        job (ProcessingJob): Job a ser processado.
+    """
+    if settings.FILE_PROCESSING_EAGER:
+        run_job(job.id)
+        return
+    # O job só fica visível para o worker depois do commit da transação que o criou.
+    transaction.on_commit(lambda: get_executor().submit(_run_in_worker, job.id))
+
+
+def claim_job(job_id: int) -> bool:
+    """Função para reivindicar um job da fila.
+
+    O UPDATE condicional é atômico no banco, então apenas um worker consegue mover o job de QUEUED para RUNNING.
+
+    Args:
+        job_id (int): ID do job.
+
+    Returns:
+        bool: True se o job foi reivindicado por este worker.
+    """
+    claimed = ProcessingJob.objects.filter(id=job_id, state=ProcessingJob.State.QUEUED).update(
+        state=ProcessingJob.State.RUNNING, started_at=timezone.now(), updated_at=timezone.now())
+    return claimed == 1
+
+
+def run_job(job_id: int) -> ProcessingJob:
+    """Função para executar as etapas de processamento de um job.
+
+    Args:
+        job_id (int): ID do job.
+
+    Returns:
+        ProcessingJob: Job processado ou None se outro worker já o reivindicou.
+    """
+    if not claim_job(job_id):
+        return None
+    job = ProcessingJob.objects.select_related('file').get(id=job_id)
+    JOBS_IN_FLIGHT.inc()
+    try:
+        # Um job retomado que já terminou a leitura vai direto para as notificações.
+        if job.stage != ProcessingJob.Stage.NOTIFICATION:
+            job.stage = ProcessingJob.Stage.INGESTION
+            job.save(update_fields=['stage', 'updated_at'])
+            process_csv_content_parallel(job.file.file.path, job.file_id, job=job)
+            # Um upload do mesmo arquivo pode ter inserido parte das linhas enquanto o job lia o csv.
+            reconcile_ingestion_counts(job)
+            job.stage = ProcessingJob.Stage.NOTIFICATION
+            job.save(update_fields=['stage', 'updated_at'])
+        send_notification_and_create_pdf(job.file_id, job=job)
+        job.state = ProcessingJob.State.DONE
+    except Exception as e:
+        log_error('Erro ao processar o job %d: %s', job.id, e)
+        job.state = ProcessingJob.State.FAILED
+        job.error = str(e)
+    finally:
+        JOBS_IN_FLIGHT.dec()
+    JOBS.inc(state=ProcessingJob.State(job.state).label.lower())
+    job.finished_at = timezone.now()
+    job.save(update_fields=['state', 'error', 'finished_at', 'updated_at'])
+    log_info('Job %d finalizado com estado %s', job.id, job.state)
+    return job
+
+
+def requeue_job(job_id: int, stale_after: int = None) -> bool:
+    """Função para devolver à fila um job que falhou ou que parou no meio do processamento.
+
+    Um job RUNNING só é considerado parado se não tiver progresso há mais de `stale_after` segundos, para não
+    competir com um worker que ainda está processando o arquivo. O processamento é retomado do checkpoint.
+
+    Args:
+        job_id (int): ID do job.
+        stale_after (int): Segundos sem progresso. Por padrão usa `settings.FILE_PROCESSING_STALE_SECONDS`.
+
+    Returns:
+        bool: True se o job voltou para a fila.
+    """
+    return _stale_jobs(stale_after).filter(id=job_id).update(
+        state=ProcessingJob.State.QUEUED, error='', finished_at=None, updated_at=timezone.now()) == 1
+
+
+def requeue_stale_jobs(stale_after: int = None) -> list:
+    """Função para devolver à fila todos os jobs que falharam ou pararam no meio do processamento.
+
+    Args:
+        stale_after (int): Segundos sem progresso. Por padrão usa `settings.FILE_PROCESSING_STALE_SECONDS`.
+
+    Returns:
+        list: IDs dos jobs que voltaram para a fila.
+    """
+    return [job_id for job_id in _stale_jobs(stale_after).values_list('id', flat=True)
+            if requeue_job(job_id, stale_after)]
+
+
+def _stale_jobs(stale_after: int = None):
+    stale_after = settings.FILE_PROCESSING_STALE_SECONDS if stale_after is None else stale_after
+    limit = timezone.now() - timedelta(seconds=stale_after)
+    # Jobs de arquivos sem caminho são os provisórios de um upload que não terminou (por exemplo, o processo morreu no
+    #   meio do upload). Não há arquivo para reprocessar, então eles nunca voltam para a fila.
+    return ProcessingJob.objects.filter(
+        Q(state=ProcessingJob.State.FAILED) | Q(state=ProcessingJob.State.RUNNING, updated_at__lt=limit)).exclude(
+        file__file='')
+
+
+def run_queued_jobs(limit: int = None) -> int:
+    """Função para processar os jobs que estão na fila do banco.
+
+    Args:
+        limit (int): Quantidade máxima de jobs a processar. Opcional.
+
+    Returns:
+        int: Quantidade de jobs processados por este worker.
+    """
+    processed = 0
+    queued = ProcessingJob.objects.filter(state=ProcessingJob.State.QUEUED).order_by('created_at')
+    for job_id in queued.values_list('id', flat=True)[:limit]:
+        if run_job(job_id) is not None:
+            processed += 1
+    return processed
+
+
+def _run_in_worker(job_id: int):
+    """Executa um job em uma thread do pool, liberando ao final a conexão com o banco se ela expirou ou quebrou.
+
+    A thread mantém a conexão entre um job e outro (CONN_MAX_AGE); com o pool de conexões ela volta para o pool.
+    """
+    close_old_connections()
+    try:
+        run_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def poll_jobs(interval: float, limit: int = None):
+    """Função para processar a fila do banco continuamente.
+
+    Args:
+        interval (float): Tempo em segundos entre as consultas quando não há jobs pendentes.
+        limit (int): Quantidade máxima de jobs por consulta. Opcional.
+    """
+    while True:
+        close_old_connections()
+        if not run_queued_jobs(limit):
+            time.sleep(interval)
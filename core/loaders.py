@@ -0,0 +1,110 @@
+import uuid
+from datetime import date
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .dedup import DEBT_IDS
+from .models import Billing
+from .summaries import add_billings
+
+
+# Ordem das colunas das linhas recebidas pelos loaders. As linhas são tuplas simples para que o caminho via COPY não
+#   precise criar um objeto do ORM para cada cobrança.
+BILLING_COLUMNS = ('name', 'government_id', 'email', 'debt_amount', 'debt_due_date', 'debt_id')
+
+
+def load_billings(rows: list, file_id: int) -> tuple:
+    """Função para inserir um lote de cobranças no banco.
+
+    No PostgreSQL, com `settings.BILLING_LOADER = 'copy'`, as linhas são enviadas via COPY para uma tabela
+    temporária e depois mescladas em core_billing. Nos demais casos (SQLite, testes) é usado o bulk_create do ORM.
+    Em ambos, os totais das linhas inseridas são somados ao resumo do arquivo na mesma transação. No COPY, antes
+    disso, as linhas repetidas no lote ou com um debt_id que o cache do processo indica estar gravado (confirmado no
+    banco) são descartadas sem passar pela tabela temporária (ver core/dedup.py).
+
+    Args:
+        rows (list): Lista de tuplas na ordem de BILLING_COLUMNS.
+        file_id (int): Id do arquivo das cobranças.
+
+    Returns:
+        tuple: Quantidade de linhas inseridas e quantidade de linhas ignoradas por debt_id duplicado.
+    """
+    if not rows:
+        return 0, 0
+    if settings.BILLING_LOADER == 'copy' and connection.vendor == 'postgresql':
+        # O bulk_create já consulta os debt_ids existentes antes de inserir, então o cache só é usado no COPY, onde
+        #   uma consulta pelos ids do cache custa bem menos do que enviar e mesclar as linhas repetidas.
+        rows, dropped = DEBT_IDS.filter(rows)
+        if not rows:
+            return 0, dropped
+        inserted, skipped = copy_billings(rows, file_id)
+        return inserted, skipped + dropped
+    return bulk_create_billings(rows, file_id)
+
+
+def bulk_create_billings(rows: list, file_id: int) -> tuple:
+    """Função para inserir um lote de cobranças com o bulk_create do ORM.
+
+    Os debt_ids que já existem no banco (ou que se repetem dentro do lote) são descartados antes da inserção para que
+    seja possível contar as duplicadas. O ignore_conflicts continua protegendo contra inserções concorrentes.
+
+    Args:
+        rows (list): Lista de tuplas na ordem de BILLING_COLUMNS.
+        file_id (int): Id do arquivo das cobranças.
+
+    Returns:
+        tuple: Quantidade de linhas inseridas e quantidade de linhas ignoradas.
+    """
+    debt_ids = [uuid.UUID(str(row[5])) for row in rows]
+    seen = set(Billing.objects.filter(debt_id__in=debt_ids).values_list('debt_id', flat=True))
+    bills = []
+    for row, debt_id in zip(rows, debt_ids):
+        if debt_id in seen:
+            continue
+        seen.add(debt_id)
+        bills.append(Billing(file_id=file_id, **dict(zip(BILLING_COLUMNS, row))))
+    with transaction.atomic():
+        Billing.objects.bulk_create(bills, ignore_conflicts=True)
+        if bills:
+            due_dates = [date.fromisoformat(str(bill.debt_due_date)) for bill in bills]
+            add_billings(file_id, len(bills), sum(Decimal(str(bill.debt_amount)) for bill in bills),
+                         min(due_dates), max(due_dates))
+    return len(bills), len(rows) - len(bills)
+
+
+def copy_billings(rows: list, file_id: int) -> tuple:
+    """Função para inserir um lote de cobranças via COPY do PostgreSQL (psycopg 3).
+
+    As linhas vão para uma tabela temporária da conexão e são mescladas em core_billing com
+    ON CONFLICT (debt_id) DO NOTHING. O RETURNING do INSERT devolve apenas as linhas realmente inseridas, que são
+    agregadas na mesma consulta para o resumo do arquivo.
+
+    Args:
+        rows (list): Lista de tuplas na ordem de BILLING_COLUMNS.
+        file_id (int): Id do arquivo das cobranças.
+
+    Returns:
+        tuple: Quantidade de linhas inseridas e quantidade de linhas ignoradas.
+    """
+    table = Billing._meta.db_table
+    columns = ', '.join(BILLING_COLUMNS)
+    with transaction.atomic(), connection.cursor() as cursor:
+        # A tabela temporária vive enquanto a conexão existir e é esvaziada a cada commit.
+        cursor.execute(f'CREATE TEMP TABLE IF NOT EXISTS {table}_staging ('
+                       'name varchar(255), government_id varchar(50), email varchar(254), '
+                       'debt_amount numeric(10, 2), debt_due_date date, debt_id uuid) ON COMMIT DELETE ROWS')
+        # O lote pode estar dentro de uma transação maior (savepoint), então a tabela é limpa explicitamente.
+        cursor.execute(f'TRUNCATE {table}_staging')
+        with cursor.cursor.copy(f'COPY {table}_staging ({columns}) FROM STDIN') as copy:
+            for row in rows:
+                copy.write_row(row)
+        cursor.execute(f'WITH inserted AS (INSERT INTO {table} (file_id, status, created_at, updated_at, {columns}) '
+                       f'SELECT %s, %s, now(), now(), {columns} FROM {table}_staging '
+                       'ON CONFLICT (debt_id) DO NOTHING RETURNING debt_amount, debt_due_date) '
+                       'SELECT count(*), coalesce(sum(debt_amount), 0), min(debt_due_date), max(debt_due_date) '
+                       'FROM inserted', [file_id, Billing.Status.PENDING])
+        inserted, amount, first_due_date, last_due_date = cursor.fetchone()
+        add_billings(file_id, inserted, amount, first_due_date, last_due_date)
+    return inserted, len(rows) - inserted
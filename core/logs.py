@@ -0,0 +1,53 @@
+import atexit
+import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+
+# Os handlers configurados no settings.py (FileHandler) escrevem no disco de forma síncrona. Com o log assíncrono cada
+#   logger passa a ter apenas um QueueHandler, que coloca o registro em uma fila em memória, e a thread de um
+#   QueueListener faz a escrita com os handlers originais.
+_listeners = {}
+_lock = threading.Lock()
+
+
+def start_async_logging(logger_names: list) -> dict:
+    """Função para trocar os handlers dos loggers informados por um QueueHandler.
+
+    Cada logger ganha a própria fila e o próprio QueueListener, então os registros continuam indo apenas para os
+    handlers (e níveis) configurados para ele. Chamadas repetidas não alteram loggers já convertidos.
+
+    Args:
+        logger_names (list): Nomes dos loggers que devem escrever de forma assíncrona.
+
+    Returns:
+        dict: QueueListener de cada logger convertido.
+    """
+    with _lock:
+        for name in logger_names:
+            logger = logging.getLogger(name)
+            if name in _listeners or not logger.handlers:
+                continue
+            records = queue.SimpleQueue()
+            listener = QueueListener(records, *logger.handlers, respect_handler_level=True)
+            logger.handlers = [QueueHandler(records)]
+            listener.start()
+            _listeners[name] = listener
+        # unregister evita registrar a mesma função mais de uma vez.
+        atexit.unregister(stop_async_logging)
+        if _listeners:
+            atexit.register(stop_async_logging)
+        return dict(_listeners)
+
+
+def stop_async_logging():
+    """Função para parar os listeners, escrevendo antes os registros que ainda estão nas filas.
+
+    Os handlers originais voltam para os loggers.
+    """
+    with _lock:
+        for name, listener in _listeners.items():
+            listener.stop()
+            logging.getLogger(name).handlers = list(listener.handlers)
+        _listeners.clear()
@@ -0,0 +1,186 @@
+import gzip
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+import zstandard
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.dedup import DEBT_IDS
+from core.dispatch import BillingDispatcher
+from core.models import Billing, File, ProcessingJob
+from core.parallel import process_csv_content_parallel
+from core.parsers import ParseReport, read_billing_rows
+from core.processing import send_notification_and_create_pdf
+from core.synthetic import generate_billing_csv
+from core.utils import SimulatedBillingClient
+
+
+STAGES = ('parse', 'insert', 'dispatch', 'full')
+# Extensão dos arquivos gerados para cada compressão medida.
+COMPRESSIONS = {'none': '.csv', 'gzip': '.csv.gz', 'zstd': '.csv.zst'}
+
+
+def peak_rss_kb() -> dict:
+    """Função para obter o pico de memória (RSS) do processo e dos processos filhos já finalizados, em KB.
+
+    O pico é o do processo inteiro até o momento, então cada etapa mostra o maior valor visto até o fim dela.
+    """
+    return {'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss}
+
+
+class Command(BaseCommand):
+    help = ('Gera arquivos csv sintéticos e mede a vazão, a latência e o pico de memória de cada etapa do '
+            'processamento. As cobranças são gravadas no banco configurado e removidas ao final.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10000],
+                            help='Quantidade de linhas de cada arquivo, por exemplo: 10000 1000000 10000000.')
+        parser.add_argument('--duplicate-ratio', type=float, default=0.01, help='Proporção de debtIds repetidos.')
+        parser.add_argument('--invalid-ratio', type=float, default=0.01, help='Proporção de linhas inválidas.')
+        parser.add_argument('--seed', type=int, default=0, help='Semente do gerador de arquivos.')
+        parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES),
+                            help='Etapas medidas. "full" executa o processamento completo de um job.')
+        parser.add_argument('--compression', nargs='+', choices=COMPRESSIONS, default=['none'],
+                            help='Formatos medidos para cada arquivo: csv sem compressão, .csv.gz e/ou .csv.zst.')
+        parser.add_argument('--workers', type=int, default=None, help='Processos da leitura paralela.')
+        parser.add_argument('--batch-size', type=int, default=None, help='Linhas por lote de inserção.')
+        parser.add_argument('--call-latency', type=float, default=0.0,
+                            help='Latência simulada de cada chamada aos serviços de pdf e notificação, em segundos.')
+        parser.add_argument('--item-cost', type=float, default=0.0,
+                            help='Custo simulado de cada cobrança em uma chamada aos serviços, em segundos.')
+        parser.add_argument('--target-seconds', type=float, default=60.0,
+                            help='Tempo máximo esperado para o processamento completo de um arquivo.')
+        parser.add_argument('--output', default=None, help='Arquivo JSON com os resultados. Por padrão a saída padrão.')
+        parser.add_argument('--keep-files', action='store_true', help='Mantém os arquivos csv gerados.')
+
+    def handle(self, *args, **options):
+        self.options = options
+        directory = tempfile.mkdtemp(prefix='fileapi-benchmark-')
+        results = {
+            'started_at': timezone.now().isoformat(),
+            'database': settings.DATABASES['default']['ENGINE'],
+            'settings': {'workers': options['workers'] or settings.BILLING_PARSE_WORKERS,
+                         'batch_size': options['batch_size'] or settings.BILLING_BATCH_SIZE,
+                         'dispatch_workers': settings.DISPATCH_MAX_WORKERS,
+                         'call_latency': options['call_latency'], 'item_cost': options['item_cost']},
+            'files': [],
+        }
+        try:
+            for rows in options['rows']:
+                results['files'] += self.benchmark_file(directory, rows)
+        finally:
+            if not options['keep_files']:
+                shutil.rmtree(directory)
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Resultados gravados em {options["output"]}.'))
+        else:
+            self.stdout.write(output)
+
+    def benchmark_file(self, directory: str, rows: int) -> list:
+        options = self.options
+        path = os.path.join(directory, f'billings-{rows}.csv')
+        et1 = time.perf_counter()
+        generated = generate_billing_csv(path, rows, options['duplicate_ratio'], options['invalid_ratio'],
+                                         options['seed'])
+        generated['seconds'] = time.perf_counter() - et1
+        self.stderr.write(f'{rows} linhas geradas em {generated["seconds"]:.2f}s ({generated["bytes"]} bytes)')
+        results = []
+        for compression in options['compression']:
+            compressed = self.compress_file(path, compression)
+            self.stderr.write(f'{rows} linhas, {compression}: {compressed["bytes"]} bytes')
+            results.append(self.benchmark_stages(compressed.pop('path'), rows, generated, compressed))
+        return results
+
+    def compress_file(self, path: str, compression: str) -> dict:
+        """Função para gerar a versão comprimida do arquivo, em stream, e medir o tamanho e o tempo de compressão.
+        """
+        target = path[:-len('.csv')] + COMPRESSIONS[compression]
+        et1 = time.perf_counter()
+        if compression == 'gzip':
+            with open(path, 'rb') as source, gzip.open(target, 'wb') as f:
+                shutil.copyfileobj(source, f)
+        elif compression == 'zstd':
+            with open(path, 'rb') as source, open(target, 'wb') as f:
+                zstandard.ZstdCompressor().copy_stream(source, f)
+        return {'path': target, 'compression': compression, 'bytes': os.path.getsize(target),
+                'seconds': time.perf_counter() - et1}
+
+    def benchmark_stages(self, path: str, rows: int, generated: dict, compressed: dict) -> dict:
+        options = self.options
+        result = {'rows': rows, 'generated': generated, 'input': compressed, 'stages': {}}
+        label = f'{rows} linhas ({compressed["compression"]})'
+        file = None
+        for stage in STAGES:
+            if stage not in options['stages']:
+                continue
+            # As etapas de inserção e completa gravam as mesmas cobranças, então cada uma começa com o banco limpo.
+            if stage in ('insert', 'full') and file is not None:
+                self.delete_file(file)
+                file = None
+            if stage in ('insert', 'dispatch', 'full') and file is None:
+                file = File.objects.create(file=f'benchmark/{os.path.basename(path)}')
+            if stage == 'dispatch' and not Billing.objects.filter(file=file).exists():
+                process_csv_content_parallel(path, file.id, options['workers'], options['batch_size'])
+            et1 = time.perf_counter()
+            details = getattr(self, f'run_{stage}')(path, file)
+            seconds = time.perf_counter() - et1
+            result['stages'][stage] = {'seconds': seconds, 'rows_per_second': rows / seconds if seconds else 0.0,
+                                       'peak_rss_kb': peak_rss_kb(), **details}
+            if stage == 'full':
+                result['stages'][stage]['within_target'] = seconds <= options['target_seconds']
+            self.stderr.write(f'{label}, etapa {stage}: {seconds:.2f}s ({rows / seconds:.0f} linhas/s)')
+        if file is not None:
+            self.delete_file(file)
+        return result
+
+    def run_parse(self, path: str, file: File) -> dict:
+        report = ParseReport()
+        valid = sum(1 for _ in read_billing_rows(path, report))
+        return {'valid': valid, 'rejected': report.rejected}
+
+    def run_insert(self, path: str, file: File) -> dict:
+        stats = process_csv_content_parallel(path, file.id, self.options['workers'], self.options['batch_size'])
+        return self.ingestion_details(stats)
+
+    def run_dispatch(self, path: str, file: File) -> dict:
+        stats = send_notification_and_create_pdf(file.id, dispatcher=self.dispatcher())
+        return {key: stats[key] for key in ('pdf_created', 'notified', 'failed')}
+
+    def run_full(self, path: str, file: File) -> dict:
+        # Mesmas etapas de core.jobs.run_job, com o arquivo gerado fora do MEDIA_ROOT.
+        job = ProcessingJob.objects.create(file=file, state=ProcessingJob.State.RUNNING,
+                                           stage=ProcessingJob.Stage.INGESTION, started_at=timezone.now())
+        stats = process_csv_content_parallel(path, file.id, self.options['workers'], self.options['batch_size'],
+                                             job=job)
+        dispatch = send_notification_and_create_pdf(file.id, job=job, dispatcher=self.dispatcher())
+        job.state = ProcessingJob.State.DONE
+        job.finished_at = timezone.now()
+        job.save(update_fields=['state', 'finished_at', 'updated_at'])
+        return {**self.ingestion_details(stats), 'notified': dispatch['notified'],
+                'notify_seconds': dispatch['seconds']}
+
+    def dispatcher(self) -> BillingDispatcher:
+        client = SimulatedBillingClient(self.options['call_latency'], self.options['item_cost'])
+        return BillingDispatcher(pdf_client=client, notification_client=client)
+
+    def ingestion_details(self, stats: dict) -> dict:
+        batches = stats['batches'] or 1
+        return {'inserted': stats['inserted'], 'skipped': stats['skipped'], 'rejected': stats['rejected'],
+                'batches': stats['batches'], 'parse_seconds': stats['parse_seconds'],
+                'insert_seconds': stats['insert_seconds'],
+                'insert_seconds_per_batch': stats['insert_seconds'] / batches}
+
+    def delete_file(self, file: File):
+        Billing.objects.filter(file=file).delete()
+        file.delete()
+        DEBT_IDS.clear()
@@ -0,0 +1,64 @@
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.models import Billing, File, FileSummary
+from core.processing import DISPATCH_FIELDS
+from core.queries import filter_billings
+
+
+def hot_queries(file_id: int) -> dict:
+    """Função para montar as consultas mais frequentes do processamento e da api de leitura de um arquivo.
+
+    Args:
+        file_id (int): ID do arquivo usado nos filtros.
+
+    Returns:
+        dict: QuerySets indexados por uma descrição curta.
+    """
+    billings = Billing.objects.filter(file_id=file_id)
+    return {
+        # Uma página do envio, como feita por `iter_keyset_pages`.
+        'cobranças pendentes do arquivo (envio)': billings.filter(
+            status__in=[Billing.Status.PENDING, Billing.Status.INVOICE_CREATED], id__gt=0).values_list(
+            *DISPATCH_FIELDS).order_by('id')[:settings.BILLING_BATCH_SIZE],
+        'cobranças com falha do arquivo (reenvio)': billings.filter(status=Billing.Status.FAILED),
+        'arquivos com cobranças com falha': Billing.objects.filter(
+            status=Billing.Status.FAILED).values_list('file_id', flat=True).distinct().order_by('file_id'),
+        'cobranças notificadas do arquivo (progresso)': billings.filter(
+            status=Billing.Status.NOTIFICATION_SENT).values('id'),
+        'cobranças pendentes vencidas': Billing.objects.filter(
+            status=Billing.Status.PENDING, debt_due_date__lte=date.today()),
+        # Uma página da api de leitura, como feita por `BillingCursorPagination`, e o resumo do arquivo.
+        'página de cobranças do arquivo (api)': filter_billings(file_id).filter(id__gt=0).order_by(
+            'id')[:settings.BILLING_PAGE_SIZE + 1],
+        'resumo do arquivo (api)': FileSummary.objects.filter(file_id=file_id),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Mostra o plano de execução (EXPLAIN) das consultas mais frequentes do processamento.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', type=int, default=None,
+                            help='ID do arquivo usado nos filtros. Por padrão o último arquivo enviado.')
+        parser.add_argument('--analyze', action='store_true',
+                            help='Executa as consultas (EXPLAIN ANALYZE). Apenas no PostgreSQL.')
+
+    def handle(self, *args, **options):
+        file_id = options['file']
+        if file_id is None:
+            file_id = File.objects.order_by('-id').values_list('id', flat=True).first()
+        if file_id is None:
+            raise CommandError('Nenhum arquivo encontrado. Informe o arquivo com --file.')
+        explain_options = {}
+        if options['analyze']:
+            if connection.vendor != 'postgresql':
+                raise CommandError('--analyze só está disponível no PostgreSQL.')
+            explain_options = {'analyze': True, 'buffers': True}
+        for description, queryset in hot_queries(file_id).items():
+            self.stdout.write(self.style.MIGRATE_HEADING(description))
+            self.stdout.write(queryset.explain(**explain_options))
+            self.stdout.write('')
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from core.jobs import poll_jobs, run_queued_jobs
+
+
+class Command(BaseCommand):
+    help = 'Processa os arquivos que estão na fila de processamento do banco de dados.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Continua consultando a fila por novos jobs.')
+        parser.add_argument('--interval', type=float, default=1.0, help='Intervalo entre consultas, em segundos.')
+        parser.add_argument('--limit', type=int, default=None, help='Quantidade máxima de jobs por consulta.')
+
+    def handle(self, *args, **options):
+        if options['loop']:
+            poll_jobs(options['interval'], options['limit'])
+            return
+        processed = run_queued_jobs(options['limit'])
+        self.stdout.write(self.style.SUCCESS(f'{processed} job(s) processado(s).'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from core.models import File
+from core.summaries import rebuild_file_summary
+
+
+class Command(BaseCommand):
+    help = ('Recalcula o resumo (FileSummary) dos arquivos a partir das cobranças. Usado para preencher o resumo de '
+            'arquivos processados antes da tabela existir.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', type=int, nargs='+', default=None,
+                            help='IDs dos arquivos. Por padrão todos os arquivos.')
+        parser.add_argument('--missing', action='store_true', help='Apenas arquivos que ainda não têm resumo.')
+
+    def handle(self, *args, **options):
+        files = File.objects.order_by('id')
+        if options['file']:
+            files = files.filter(id__in=options['file'])
+        if options['missing']:
+            files = files.filter(summary__isnull=True)
+        rebuilt = 0
+        for file_id in files.values_list('id', flat=True).iterator():
+            summary = rebuild_file_summary(file_id)
+            rebuilt += 1
+            self.stdout.write(f'Arquivo {file_id}: {summary.count} cobrança(s), total {summary.debt_amount}.')
+        self.stdout.write(self.style.SUCCESS(f'{rebuilt} resumo(s) recalculado(s).'))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from core.jobs import requeue_job, requeue_stale_jobs, run_job
+from core.models import ProcessingJob
+
+
+class Command(BaseCommand):
+    help = 'Retoma, a partir do checkpoint, o processamento de arquivos que falharam ou foram interrompidos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', type=int, default=None, help='ID do arquivo. Por padrão todos os arquivos.')
+        parser.add_argument('--stale-seconds', type=int, default=None,
+                            help='Segundos sem progresso para considerar um job em execução como interrompido.')
+
+    def handle(self, *args, **options):
+        if options['file'] is not None:
+            job = ProcessingJob.objects.filter(file_id=options['file']).first()
+            job_ids = [job.id] if job and requeue_job(job.id, options['stale_seconds']) else []
+        else:
+            job_ids = requeue_stale_jobs(options['stale_seconds'])
+        for job_id in job_ids:
+            job = run_job(job_id)
+            if job is not None:
+                self.stdout.write(f'Arquivo {job.file_id}: {job.get_state_display()}')
+        self.stdout.write(self.style.SUCCESS(f'{len(job_ids)} job(s) retomado(s).'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Billing
+from core.processing import RETRY_STATUSES, retry_failed_billings
+
+
+class Command(BaseCommand):
+    help = 'Reenvia os pdfs e notificações apenas das cobranças que falharam.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', type=int, default=None, help='ID do arquivo. Por padrão todos os arquivos.')
+
+    def handle(self, *args, **options):
+        failed = Billing.objects.filter(status__in=RETRY_STATUSES)
+        if options['file'] is not None:
+            failed = failed.filter(file_id=options['file'])
+        for file_id in failed.values_list('file_id', flat=True).distinct().order_by('file_id'):
+            stats = retry_failed_billings(file_id)
+            self.stdout.write(f'Arquivo {file_id}: {stats["notified"]} notificada(s), {stats["failed"]} com falha.')
+        self.stdout.write(self.style.SUCCESS('Reenvio finalizado.'))
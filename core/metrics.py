@@ -0,0 +1,175 @@
+import bisect
+import threading
+
+
+# Métricas do processamento mantidas em memória e expostas no formato texto do Prometheus em /api/metrics/, sem
+#   depender de um coletor externo. Os valores são do processo atual: os processos da leitura paralela devolvem as
+#   próprias contagens para o processo principal, que as registra (ver core/parallel.py).
+
+# Limites (em segundos) dos buckets dos histogramas de latência.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Metric():
+    """Classe base das métricas. Cada combinação de labels tem o próprio valor.
+    """
+
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'Metric {self.name} expects labels {self.labelnames}.')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def format_labels(self, key: tuple, extra: dict = None) -> str:
+        pairs = list(zip(self.labelnames, key)) + list((extra or {}).items())
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def samples(self) -> list:
+        with self.lock:
+            return [f'{self.name}{self.format_labels(key)} {_format_value(value)}'
+                    for key, value in sorted(self.values.items())]
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        return '\n'.join(lines + self.samples())
+
+
+class Counter(Metric):
+    """Contador que só aumenta.
+    """
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        if amount < 0:
+            raise ValueError('Counters can only be incremented.')
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Valor que pode aumentar ou diminuir.
+    """
+
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """Histograma com buckets cumulativos, soma e quantidade de observações.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self) -> list:
+        lines = []
+        with self.lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else _format_value(bound)
+                    lines.append(f'{self.name}_bucket{self.format_labels(key, {"le": le})} {cumulative}')
+                lines.append(f'{self.name}_sum{self.format_labels(key)} {_format_value(total)}')
+                lines.append(f'{self.name}_count{self.format_labels(key)} {cumulative}')
+        return lines
+
+
+class Registry():
+    """Classe para agrupar as métricas e gerar o texto exposto no endpoint.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+def record_ingestion(valid: int, inserted: int, skipped: int, rejected: int = 0):
+    """Função para registrar as contagens de um lote (ou de uma faixa do arquivo) nas métricas de linhas.
+
+    Args:
+        valid (int): Linhas válidas lidas.
+        inserted (int): Linhas inseridas no banco.
+        skipped (int): Linhas ignoradas por debt_id duplicado.
+        rejected (int): Linhas rejeitadas pelo parser.
+    """
+    ROWS.inc(valid, stage='parse', result='valid')
+    ROWS.inc(rejected, stage='parse', result='rejected')
+    ROWS.inc(inserted, stage='insert', result='inserted')
+    ROWS.inc(skipped, stage='insert', result='skipped')
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+
+UPLOADS = REGISTRY.register(Counter(
+    'fileapi_uploads_total', 'Uploads recebidos pelo endpoint de arquivos.', ('status',)))
+ROWS = REGISTRY.register(Counter(
+    'fileapi_rows_total', 'Linhas processadas por etapa e resultado.', ('stage', 'result')))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'fileapi_stage_seconds', 'Latência de cada etapa: upload por requisição, parse e insert por lote, pdf e '
+    'notification por chamada ao serviço.', ('stage',)))
+ROWS_PER_SECOND = REGISTRY.register(Gauge(
+    'fileapi_stage_rows_per_second', 'Vazão da última execução de cada etapa, em linhas por segundo.', ('stage',)))
+JOBS = REGISTRY.register(Counter(
+    'fileapi_jobs_total', 'Jobs de processamento finalizados por estado.', ('state',)))
+JOBS_IN_FLIGHT = REGISTRY.register(Gauge(
+    'fileapi_jobs_in_flight', 'Jobs de processamento em execução neste processo.'))
+DB_CONNECTIONS_OPENED = REGISTRY.register(Counter(
+    'fileapi_db_connections_opened_total', 'Conexões com o banco abertas (ou retiradas do pool) por este processo.',
+    ('alias',)))
+DB_POOL_WAIT_SECONDS = REGISTRY.register(Histogram(
+    'fileapi_db_pool_wait_seconds', 'Tempo de espera por uma conexão livre do pool.', ('alias',),
+    buckets=(0.0001, 0.0005) + DEFAULT_BUCKETS))
+DB_POOL_TIMEOUTS = REGISTRY.register(Counter(
+    'fileapi_db_pool_timeouts_total', 'Retiradas do pool que excederam o timeout.', ('alias',)))
+DB_POOL_CONNECTIONS = REGISTRY.register(Gauge(
+    'fileapi_db_pool_connections', 'Conexões do pool: abertas, livres e requisições esperando por uma conexão.',
+    ('alias', 'state')))
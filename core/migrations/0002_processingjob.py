@@ -0,0 +1,38 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('state', models.CharField(choices=[('QU', 'QUEUED'), ('RU', 'RUNNING'), ('DO', 'DONE'), ('FA', 'FAILED')], db_index=True, default='QU', max_length=2)),
+                ('stage', models.CharField(blank=True, choices=[('IN', 'INGESTION'), ('NO', 'NOTIFICATION')], max_length=2)),
+                ('rows_parsed', models.PositiveBigIntegerField(default=0)),
+                ('rows_inserted', models.PositiveBigIntegerField(default=0)),
+                ('rows_notified', models.PositiveBigIntegerField(default=0)),
+                ('parse_seconds', models.FloatField(default=0)),
+                ('insert_seconds', models.FloatField(default=0)),
+                ('notify_seconds', models.FloatField(default=0)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='job', to='core.file')),
+            ],
+            options={
+                'verbose_name': 'Processing Job',
+                'verbose_name_plural': 'Processing Jobs',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_processingjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='billing',
+            name='status',
+            field=models.CharField(choices=[('PE', 'PENDING'), ('IC', 'INVOICE CREATED'), ('NS', 'NOTIFICATION SENT'), ('FA', 'FAILED')], default='PE', max_length=2),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_billing_failed_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingjob',
+            name='error_report',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='processingjob',
+            name='rows_rejected',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_processingjob_error_report'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingjob',
+            name='checkpoint_line',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='processingjob',
+            name='checkpoint_offset',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
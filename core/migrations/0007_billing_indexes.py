@@ -0,0 +1,32 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_file_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='billing',
+            index=models.Index(fields=['file', 'status'], name='billing_file_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='billing',
+            index=models.Index(condition=models.Q(('status__in', ['PE', 'IC'])), fields=['file', 'id'], name='billing_file_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='billing',
+            index=models.Index(fields=['status', 'debt_due_date'], name='billing_status_due_date_idx'),
+        ),
+        # O índice simples de file_id só é removido depois que os índices compostos existem.
+        migrations.AlterField(
+            model_name='billing',
+            name='file',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, to='core.file'),
+        ),
+    ]
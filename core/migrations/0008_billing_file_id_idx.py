@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_billing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='billing',
+            index=models.Index(fields=['file', 'id'], name='billing_file_id_idx'),
+        ),
+    ]
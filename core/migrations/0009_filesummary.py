@@ -0,0 +1,39 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_billing_file_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('count', models.PositiveBigIntegerField(default=0)),
+                ('debt_amount', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('first_due_date', models.DateField(blank=True, null=True)),
+                ('last_due_date', models.DateField(blank=True, null=True)),
+                ('pending_count', models.PositiveBigIntegerField(default=0)),
+                ('pending_amount', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('invoice_created_count', models.PositiveBigIntegerField(default=0)),
+                ('invoice_created_amount', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('notification_sent_count', models.PositiveBigIntegerField(default=0)),
+                ('notification_sent_amount', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('failed_count', models.PositiveBigIntegerField(default=0)),
+                ('failed_amount', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='core.file')),
+            ],
+            options={
+                'verbose_name': 'File Summary',
+                'verbose_name_plural': 'File Summaries',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_filesummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingjob',
+            name='rows_duplicated',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
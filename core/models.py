@@ -10,6 +10,9 @@ class File(BaseModel):
     # O validator garante que apenas arquivos csv sejam aceitos. Isso evita que erros no método de leitura sejam
     #   causados por arquivos com extensões diferentes.
     file = models.FileField(upload_to=get_unique_file_path, validators=[validate_file_extension])
+    # Hash sha256 do conteúdo, calculado durante o upload. Um arquivo idêntico a outro já enviado não é processado
+    #   novamente.
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
     
     # Não é necessário ter o modelo em sí, porém podemos escolher essa abordagem para se ter um registro
     #   de todos os arquivos enviados.
@@ -30,8 +33,12 @@ class Billing(BaseModel):
         PENDING = 'PE', 'PENDING' 
         INVOICE_CREATED =  'IC', 'INVOICE CREATED'
         NOTIFICATION_SENT =  'NS', 'NOTIFICATION SENT'
+        # A criação do pdf ou o envio da notificação falhou. Essas linhas são reprocessadas pelo comando
+        #   `retry_failed_billings`.
+        FAILED = 'FA', 'FAILED'
     
-    file = models.ForeignKey(File, on_delete=models.DO_NOTHING)
+    # O índice da chave estrangeira é coberto pelos índices compostos abaixo, que começam por file_id.
+    file = models.ForeignKey(File, on_delete=models.DO_NOTHING, db_index=False)
     name = models.CharField(max_length=255)
     government_id = models.CharField(max_length=50)
     email = models.EmailField()
@@ -46,6 +53,97 @@ class Billing(BaseModel):
     class Meta:
         verbose_name = 'Billing'
         verbose_name_plural = 'Billings'
+        # Os índices seguem as consultas do processamento. O índice parcial cobre apenas as linhas que ainda precisam
+        #   ser enviadas, já na ordem de leitura, então continua pequeno mesmo com dezenas de milhões de cobranças já
+        #   notificadas. O índice (file, id) atende a paginação por cursor da api de leitura, que percorre as cobranças
+        #   de um arquivo em ordem de id sem ordenar o arquivo inteiro a cada página. O comando `explain_queries`
+        #   mostra o plano de cada consulta.
+        indexes = [
+            models.Index(fields=['file', 'status'], name='billing_file_status_idx'),
+            models.Index(fields=['file', 'id'], name='billing_file_id_idx'),
+            models.Index(fields=['file', 'id'], name='billing_file_pending_idx',
+                         condition=models.Q(status__in=['PE', 'IC'])),
+            models.Index(fields=['status', 'debt_due_date'], name='billing_status_due_date_idx'),
+        ]
 
     def __str__(self):
-        return self.status
\ No newline at end of file
+        return self.status
+
+
+class FileSummary(BaseModel):
+    """Modelo com os totais das cobranças de um arquivo.
+
+    Os totais são atualizados a cada lote inserido e a cada lote de status gravado pelo envio (ver core/summaries.py),
+    então consultas de painel e conciliação leem uma única linha em vez de percorrer as cobranças do arquivo. O
+    comando `rebuild_file_summaries` recalcula os totais a partir das cobranças.
+    """
+
+    file = models.OneToOneField(File, on_delete=models.CASCADE, related_name='summary')
+    count = models.PositiveBigIntegerField(default=0)
+    debt_amount = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    first_due_date = models.DateField(null=True, blank=True)
+    last_due_date = models.DateField(null=True, blank=True)
+    # Quantidade e valor das cobranças em cada Billing.Status.
+    pending_count = models.PositiveBigIntegerField(default=0)
+    pending_amount = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    invoice_created_count = models.PositiveBigIntegerField(default=0)
+    invoice_created_amount = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    notification_sent_count = models.PositiveBigIntegerField(default=0)
+    notification_sent_amount = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    failed_count = models.PositiveBigIntegerField(default=0)
+    failed_amount = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = 'File Summary'
+        verbose_name_plural = 'File Summaries'
+
+    def __str__(self):
+        return str(self.count)
+
+
+class ProcessingJob(BaseModel):
+    """Modelo para acompanhar o processamento de um arquivo em segundo plano.
+    """
+    
+    # O próprio banco de dados funciona como fila. Um job QUEUED é reivindicado por um worker com um UPDATE
+    #   condicional para RUNNING, então dois workers nunca processam o mesmo arquivo.
+    class State(models.TextChoices):
+        QUEUED = 'QU', 'QUEUED'
+        RUNNING = 'RU', 'RUNNING'
+        DONE = 'DO', 'DONE'
+        FAILED = 'FA', 'FAILED'
+
+    class Stage(models.TextChoices):
+        INGESTION = 'IN', 'INGESTION'
+        NOTIFICATION = 'NO', 'NOTIFICATION'
+
+    file = models.OneToOneField(File, on_delete=models.CASCADE, related_name='job')
+    state = models.CharField(max_length=2, choices=State.choices, default=State.QUEUED, db_index=True)
+    stage = models.CharField(max_length=2, choices=Stage.choices, blank=True)
+    rows_parsed = models.PositiveBigIntegerField(default=0)
+    rows_inserted = models.PositiveBigIntegerField(default=0)
+    rows_notified = models.PositiveBigIntegerField(default=0)
+    # Linhas inválidas não interrompem o processamento. Elas são contadas e as primeiras ficam registradas no
+    #   relatório de erros com o número da linha no arquivo.
+    rows_rejected = models.PositiveBigIntegerField(default=0)
+    # Linhas válidas descartadas por debt_id repetido, no próprio arquivo ou já gravado por outro arquivo.
+    rows_duplicated = models.PositiveBigIntegerField(default=0)
+    error_report = models.JSONField(default=list, blank=True)
+    # Byte e linha logo após o último registro de um lote já gravado. Se o processamento for interrompido, ele é
+    #   retomado a partir daqui sem ler ou inserir novamente as linhas anteriores.
+    checkpoint_offset = models.PositiveBigIntegerField(default=0)
+    checkpoint_line = models.PositiveBigIntegerField(default=0)
+    # Tempo gasto em cada etapa, em segundos.
+    parse_seconds = models.FloatField(default=0)
+    insert_seconds = models.FloatField(default=0)
+    notify_seconds = models.FloatField(default=0)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        verbose_name = 'Processing Job'
+        verbose_name_plural = 'Processing Jobs'
+
+    def __str__(self):
+        return self.state
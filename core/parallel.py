@@ -0,0 +1,137 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import connections
+
+from .metrics import record_ingestion
+from .models import ProcessingJob
+from .parsers import ParseReport, parse_billing_records
+from .processing import ingest_rows, new_ingestion_stats, process_csv_content, save_ingestion_progress
+from .readers import MappedCSVFile, compression_of
+from .utils import log_info
+from .workers import setup_worker
+
+
+# Tamanho dos blocos lidos ao procurar os limites de cada faixa do arquivo.
+SCAN_BLOCK_SIZE = 1024 * 1024
+
+
+def split_csv_file(path: str, parts: int) -> tuple:
+    """Função para dividir um arquivo csv em faixas de bytes que começam e terminam em limites de registro.
+
+    Uma quebra de linha só é um limite de registro quando a quantidade de aspas antes dela é par; caso contrário ela
+    está dentro de um campo entre aspas. O arquivo é percorrido uma vez contando aspas e quebras de linha em blocos,
+    o que é bem mais barato do que fazer o parse.
+
+    Args:
+        path (str): Caminho do arquivo csv.
+        parts (int): Quantidade desejada de faixas.
+
+    Returns:
+        tuple: Cabeçalho do arquivo e lista de tuplas (início, fim, linhas antes do início) de cada faixa.
+    """
+    size = os.path.getsize(path)
+    # O primeiro alvo (0) encontra o fim do cabeçalho.
+    targets = [size * part // parts for part in range(parts)]
+    boundaries = []
+    quotes = lines = position = 0
+    with open(path, 'rb') as f:
+        while targets and (block := f.read(SCAN_BLOCK_SIZE)):
+            end = position + len(block)
+            index = max(targets[0] - position, 0)
+            while targets and targets[0] < end:
+                index = block.find(b'\n', max(index, targets[0] - position))
+                if index == -1:
+                    break
+                if (quotes + block.count(b'"', 0, index)) % 2 == 0:
+                    boundaries.append((position + index + 1, lines + block.count(b'\n', 0, index) + 1))
+                    while targets and targets[0] <= position + index:
+                        targets.pop(0)
+                index += 1
+            quotes += block.count(b'"')
+            lines += block.count(b'\n')
+            position = end
+    with MappedCSVFile(path) as reader:
+        header = next(reader.records(0, boundaries[0][0] if boundaries else size), (0, None))[1]
+    if header is None:
+        raise ValueError('Empty csv file.')
+    boundaries.append((size, None))
+    ranges = []
+    for (start, first_line), (finish, _) in zip(boundaries, boundaries[1:]):
+        if finish > start:
+            ranges.append((start, finish, first_line))
+    return header, ranges
+
+
+def ingest_range(path: str, header: list, start: int, end: int, first_line: int, file_id: int,
+                 batch_size: int = None) -> dict:
+    """Função executada por cada processo para validar e inserir uma faixa do arquivo.
+
+    Args:
+        path (str): Caminho do arquivo csv.
+        header (list): Cabeçalho do arquivo.
+        start (int): Byte inicial da faixa.
+        end (int): Byte final da faixa (exclusivo).
+        first_line (int): Quantidade de linhas do arquivo antes da faixa, para os números de linha do relatório.
+        file_id (int): Id do arquivo para registro.
+        batch_size (int): Quantidade de linhas por lote.
+
+    Returns:
+        dict: Estatísticas da inserção da faixa.
+    """
+    report = ParseReport()
+    with MappedCSVFile(path) as reader:
+        rows = parse_billing_records(reader.records(start, end, first_line), report, header=header)
+        return ingest_rows(rows, file_id, report, batch_size)
+
+
+def process_csv_content_parallel(file, file_id: int, workers: int = None, batch_size: int = None,
+                                 job: ProcessingJob = None) -> dict:
+    """Função para processar um arquivo csv em paralelo, uma faixa de bytes por processo.
+
+    Cada processo faz o parse, a validação e a inserção da sua faixa em lotes. Com um único worker, um arquivo
+    pequeno demais para ser dividido, um arquivo comprimido (que só pode ser lido do início) ou um job sendo retomado
+    de um checkpoint, o processamento é o mesmo de `process_csv_content`.
+
+    Args:
+        file (str): Caminho do arquivo csv.
+        file_id (int): Id do arquivo para registro.
+        workers (int): Quantidade de processos. Por padrão usa `settings.BILLING_PARSE_WORKERS`.
+        batch_size (int): Quantidade de linhas por lote. Por padrão usa `settings.BILLING_BATCH_SIZE`.
+        job (ProcessingJob): Job que recebe o progresso a cada faixa concluída. Opcional.
+
+    Returns:
+        dict: Estatísticas somadas de todas as faixas.
+    """
+    workers = workers or settings.BILLING_PARSE_WORKERS
+    if workers <= 1 or compression_of(file) or (job is not None and job.checkpoint_offset):
+        return process_csv_content(file, file_id, batch_size, job)
+    header, ranges = split_csv_file(file, workers)
+    if len(ranges) <= 1:
+        return process_csv_content(file, file_id, batch_size, job)
+    stats = new_ingestion_stats()
+    # Cada processo abre a própria conexão com o banco. O setup_worker é o initializer porque os processos são
+    #   criados com spawn e precisam carregar os apps antes de importar esta função.
+    database_name = connections['default'].settings_dict['NAME']
+    connections.close_all()
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=setup_worker,
+                             initargs=(database_name,)) as executor:
+        futures = [executor.submit(ingest_range, file, header, start, end, first_line, file_id, batch_size)
+                   for start, end, first_line in ranges]
+        for future in as_completed(futures):
+            result = future.result()
+            # As métricas dos processos filhos não chegam a este processo, então as contagens da faixa são
+            #   registradas aqui.
+            record_ingestion(result['rows'] - result['rejected'], result['inserted'], result['skipped'],
+                             result['rejected'])
+            for key in ('rows', 'inserted', 'skipped', 'rejected', 'batches', 'parse_seconds', 'insert_seconds'):
+                stats[key] += result[key]
+            stats['errors'] = sorted(stats['errors'] + result['errors'],
+                                     key=lambda error: error['line'])[:settings.BILLING_MAX_REPORTED_ERRORS]
+            save_ingestion_progress(job, stats)
+    log_info('Processamento paralelo do arquivo (%d faixas, %d processos): %d linhas, %d inseridas, %d rejeitadas',
+             len(ranges), workers, stats['rows'], stats['inserted'], stats['rejected'])
+    return stats
@@ -0,0 +1,223 @@
+import csv
+import time
+import uuid
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from operator import itemgetter
+from typing import Generator, Iterable
+
+from django.conf import settings
+
+from .loaders import BILLING_COLUMNS
+from .metrics import ROWS
+from .readers import open_csv_file
+
+
+# Colunas do arquivo csv e o campo correspondente do modelo Billing, na ordem de BILLING_COLUMNS.
+CSV_COLUMNS = {
+    'name': 'name',
+    'government_id': 'governmentId',
+    'email': 'email',
+    'debt_amount': 'debtAmount',
+    'debt_due_date': 'debtDueDate',
+    'debt_id': 'debtId',
+}
+
+# Limites dos campos do modelo Billing. Uma linha fora deles seria rejeitada pelo banco e derrubaria o lote inteiro.
+MAX_DEBT_AMOUNT = Decimal('100000000')
+MAX_LENGTHS = {'name': 255, 'government_id': 50, 'email': 254}
+
+
+RowError = namedtuple('RowError', ['line', 'message'])
+
+
+def parse_decimal(value: str) -> Decimal:
+    """Função para converter o valor da dívida, respeitando max_digits=10 e decimal_places=2.
+
+    Args:
+        value (str): Valor a ser convertido.
+
+    Returns:
+        Decimal: Valor convertido.
+    """
+    try:
+        amount = Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f'invalid debtAmount {value!r}')
+    if not amount.is_finite() or amount.as_tuple().exponent < -2 or abs(amount) >= MAX_DEBT_AMOUNT:
+        raise ValueError(f'invalid debtAmount {value!r}')
+    return amount
+
+
+def parse_date(value: str) -> date:
+    """Função para converter a data de vencimento no formato AAAA-MM-DD.
+
+    Args:
+        value (str): Data a ser convertida.
+
+    Returns:
+        date: Data convertida.
+    """
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'invalid debtDueDate {value!r}')
+
+
+def parse_uuid(value: str) -> uuid.UUID:
+    """Função para converter o debtId.
+
+    Args:
+        value (str): UUID a ser convertido.
+
+    Returns:
+        uuid.UUID: UUID convertido.
+    """
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        raise ValueError(f'invalid debtId {value!r}')
+
+
+class BillingRowParser():
+    """Classe para validar e converter as linhas do csv de cobranças.
+
+    A posição de cada coluna é descoberta uma única vez a partir do cabeçalho, e cada linha é uma lista simples de
+    strings (csv.reader), sem o custo de montar um dicionário por linha.
+    """
+
+    def __init__(self, header: list):
+        positions = {column.strip(): index for index, column in enumerate(header)}
+        missing = [column for column in CSV_COLUMNS.values() if column not in positions]
+        if missing:
+            raise ValueError(f'Missing columns in csv header: {", ".join(missing)}')
+        self.indexes = [positions[CSV_COLUMNS[field]] for field in BILLING_COLUMNS]
+        self.width = max(self.indexes) + 1
+        self.getter = itemgetter(*self.indexes)
+
+    def parse(self, fields: list) -> tuple:
+        """Função para converter uma linha do csv em uma tupla na ordem de BILLING_COLUMNS.
+
+        Args:
+            fields (list): Campos da linha.
+
+        Raises:
+            ValueError: Caso algum campo seja inválido.
+
+        Returns:
+            tuple: Linha convertida.
+        """
+        if len(fields) < self.width:
+            raise ValueError(f'expected {self.width} columns, got {len(fields)}')
+        name, government_id, email, debt_amount, debt_due_date, debt_id = self.getter(fields)
+        if not name or len(name) > MAX_LENGTHS['name']:
+            raise ValueError('invalid name')
+        if not government_id or len(government_id) > MAX_LENGTHS['government_id']:
+            raise ValueError('invalid governmentId')
+        if '@' not in email or len(email) > MAX_LENGTHS['email']:
+            raise ValueError(f'invalid email {email!r}')
+        return (name, government_id, email, parse_decimal(debt_amount), parse_date(debt_due_date),
+                parse_uuid(debt_id))
+
+
+class ParseReport():
+    """Classe para acumular o resultado da leitura de um arquivo: linhas lidas, rejeitadas e a vazão.
+
+    Apenas os primeiros `settings.BILLING_MAX_REPORTED_ERRORS` erros são guardados, mas todos são contados.
+    """
+
+    def __init__(self, max_errors: int = None):
+        self.max_errors = settings.BILLING_MAX_REPORTED_ERRORS if max_errors is None else max_errors
+        self.rows = 0
+        self.rejected = 0
+        self.errors = []
+        self.started = time.time()
+        self.finished = None
+
+    def restore(self, rows: int, rejected: int, errors: list):
+        """Restaura os contadores de uma leitura anterior do mesmo arquivo, ao retomar o processamento.
+        """
+        self.rows = rows
+        self.rejected = rejected
+        self.errors = [RowError(**error) for error in errors][:self.max_errors]
+
+    def reject(self, line: int, message: str):
+        self.rejected += 1
+        ROWS.inc(stage='parse', result='rejected')
+        if len(self.errors) < self.max_errors:
+            self.errors.append(RowError(line, message))
+
+    @property
+    def seconds(self) -> float:
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def rows_per_second(self) -> float:
+        seconds = self.seconds
+        return self.rows / seconds if seconds else 0.0
+
+    def as_list(self) -> list:
+        return [error._asdict() for error in self.errors]
+
+
+def parse_billing_records(records: Iterable, report: ParseReport, header: list = None) -> Generator:
+    """Função para validar os registros de um csv, ignorando as linhas inválidas.
+
+    Sem o `header`, o primeiro registro é usado como cabeçalho.
+
+    Args:
+        records (Iterable): Iterável de tuplas (número da linha, lista de campos).
+        report (ParseReport): Relatório que recebe as linhas lidas e rejeitadas.
+        header (list): Cabeçalho do arquivo, quando os registros começam no meio do arquivo. Opcional.
+
+    Returns:
+        Generator: generator de tuplas na ordem de BILLING_COLUMNS.
+    """
+    records = iter(records)
+    if header is None:
+        first = next(records, None)
+        if first is None:
+            raise ValueError('Empty csv file.')
+        header = first[1]
+    parser = BillingRowParser(header)
+    for line, fields in records:
+        if not fields:
+            continue
+        report.rows += 1
+        try:
+            yield parser.parse(fields)
+        except ValueError as e:
+            report.reject(line, str(e))
+    report.finished = time.time()
+
+
+def iter_csv_records(stream, first_line: int = 0) -> Generator:
+    """Função para ler os registros de um stream de texto csv junto com o número da linha.
+
+    Args:
+        stream (TextIO): Stream aberto com newline=''.
+        first_line (int): Quantidade de linhas do arquivo antes do início do stream. Opcional.
+
+    Returns:
+        Generator: generator de tuplas (número da linha, lista de campos).
+    """
+    reader = csv.reader(stream)
+    for fields in reader:
+        yield first_line + reader.line_num, fields
+
+
+def read_billing_rows(file, report: ParseReport) -> Generator:
+    """Função para ler e validar as cobranças de um arquivo csv.
+
+    O arquivo é lido via mmap ou, se estiver comprimido, descomprimido como stream (ver core/readers.py).
+
+    Args:
+        file (str): Caminho do arquivo csv (.csv, .csv.gz ou .csv.zst).
+        report (ParseReport): Relatório que recebe as linhas lidas e rejeitadas.
+
+    Returns:
+        Generator: generator de tuplas na ordem de BILLING_COLUMNS.
+    """
+    with open_csv_file(file) as reader:
+        yield from parse_billing_records(reader.records(), report)
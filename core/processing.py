@@ -0,0 +1,385 @@
+import time
+from typing import AsyncGenerator, Generator
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
+
+from .dispatch import AsyncBillingDispatcher, BillingDispatcher
+from .loaders import load_billings
+from .metrics import ROWS_PER_SECOND, STAGE_SECONDS, record_ingestion
+from .models import Billing, FileSummary, ProcessingJob
+from .parsers import ParseReport, parse_billing_records
+from .summaries import move_billings
+from .readers import MappedCSVFile, open_csv_file
+from .utils import batched, log_info
+
+
+# As etapas do processamento ficam separadas das views para que possam ser executadas tanto dentro da requisição
+#   quanto pelos workers em segundo plano (ver core/jobs.py).
+
+# Colunas lidas no envio: as usadas pelos clientes de pdf e notificação, o id para gravar o status, o status para
+#   não recriar pdfs já criados e o arquivo para atualizar o resumo (FileSummary).
+DISPATCH_FIELDS = ('id', 'file_id', 'status', 'debt_id', 'name', 'email', 'debt_amount', 'debt_due_date')
+# Status das cobranças que falharam no envio: sem pdf (FAILED) ou com o pdf criado e sem notificação (INVOICE_CREATED).
+RETRY_STATUSES = (Billing.Status.FAILED, Billing.Status.INVOICE_CREATED)
+# Novas tentativas de gravar um lote quando o SQLite continua bloqueado por outra conexão depois do timeout, com a
+#   espera crescendo a cada tentativa.
+LOCKED_RETRIES = 3
+LOCKED_RETRY_SECONDS = 0.5
+
+
+def process_csv_content(file, file_id: int, batch_size: int = None, job: ProcessingJob = None) -> dict:
+    """Função para processar o conteúdo de um arquivo csv.
+
+    O arquivo é lido como um stream e inserido no banco em lotes de `batch_size` linhas. Cada lote é gravado em
+    uma transação própria, então o consumo de memória fica limitado ao tamanho do lote e não ao tamanho do arquivo.
+    Linhas inválidas são rejeitadas individualmente e registradas no relatório de erros, sem interromper o arquivo.
+    Se o job já tiver um checkpoint, a leitura continua a partir dele. Arquivos .csv.gz e .csv.zst são descomprimidos
+    durante a leitura.
+
+    Args:
+        file (File): Arquivo csv a ser processado.
+        file_id (int): Id do arquivo para registro.
+        batch_size (int): Quantidade de linhas por lote. Por padrão usa `settings.BILLING_BATCH_SIZE`.
+        job (ProcessingJob): Job que recebe o progresso a cada lote. Opcional.
+
+    Returns:
+        dict: Estatísticas do processamento (linhas lidas, inseridas, duplicadas e rejeitadas, lotes, tempos totais
+            de leitura e inserção e o relatório de erros).
+    """
+    report = ParseReport()
+    with open_csv_file(file) as reader:
+        records, header, stats = reader.records(), None, None
+        if job is not None and job.checkpoint_offset:
+            # Retoma a partir do último lote gravado. As linhas anteriores não são lidas nem inseridas de novo.
+            header = next(records, (0, None))[1]
+            records = reader.records(job.checkpoint_offset, first_line=job.checkpoint_line)
+            report.restore(job.rows_parsed, job.rows_rejected, job.error_report)
+            stats = _stats_from_job(job)
+            log_info('Retomando o arquivo %d a partir da linha %d', file_id, job.checkpoint_line)
+        rows = parse_billing_records(records, report, header=header)
+        stats = ingest_rows(rows, file_id, report, batch_size, job, reader, stats)
+    ROWS_PER_SECOND.set(report.rows_per_second, stage='parse')
+    log_info('Processamento do arquivo: %s (%.2f linhas/s, %d rejeitadas)', stats['parse_seconds'],
+             report.rows_per_second, report.rejected)
+    log_info('Inserção no banco: %s', stats['insert_seconds'])
+    return stats
+
+
+def ingest_rows(rows, file_id: int, report: ParseReport, batch_size: int = None, job: ProcessingJob = None,
+                reader: MappedCSVFile = None, stats: dict = None) -> dict:
+    """Função para inserir no banco, em lotes, as linhas já validadas de um arquivo.
+
+    Quando o `reader` é informado, a posição do último registro de cada lote é gravada no job na mesma transação
+    do lote, servindo como checkpoint para retomar o processamento.
+
+    Args:
+        rows (Iterable): Linhas na ordem de BILLING_COLUMNS. Normalmente um generator do parser.
+        file_id (int): Id do arquivo para registro.
+        report (ParseReport): Relatório do parser que está produzindo as linhas.
+        batch_size (int): Quantidade de linhas por lote. Por padrão usa `settings.BILLING_BATCH_SIZE`.
+        job (ProcessingJob): Job que recebe o progresso a cada lote. Opcional.
+        reader (MappedCSVFile): Leitor que está produzindo os registros. Opcional.
+        stats (dict): Estatísticas iniciais, quando o processamento está sendo retomado. Opcional.
+
+    Returns:
+        dict: Estatísticas da inserção.
+    """
+    batch_size = batch_size or settings.BILLING_BATCH_SIZE
+    stats = stats or new_ingestion_stats()
+    et1 = time.time()
+    for batch in batched(rows, batch_size):
+        load_batch(batch, file_id, stats, report, job, reader, parse_seconds=time.time() - et1)
+        et1 = time.time()
+    stats['parse_seconds'] += time.time() - et1
+    _update_from_report(stats, report)
+    save_ingestion_progress(job, stats, reader)
+    return stats
+
+
+def new_ingestion_stats() -> dict:
+    """Função para criar o dicionário de estatísticas da inserção.
+
+    Returns:
+        dict: Estatísticas zeradas.
+    """
+    return {'rows': 0, 'inserted': 0, 'skipped': 0, 'rejected': 0, 'batches': 0, 'parse_seconds': 0.0,
+            'insert_seconds': 0.0, 'errors': []}
+
+
+def load_batch(batch: list, file_id: int, stats: dict, report: ParseReport, job: ProcessingJob = None,
+               reader: MappedCSVFile = None, parse_seconds: float = 0.0):
+    """Função para inserir um lote e gravar o progresso do job na mesma transação.
+
+    Args:
+        batch (list): Linhas na ordem de BILLING_COLUMNS.
+        file_id (int): Id do arquivo para registro.
+        stats (dict): Estatísticas acumuladas, atualizadas com o resultado do lote.
+        report (ParseReport): Relatório do parser que produziu as linhas.
+        job (ProcessingJob): Job que recebe o progresso. Opcional.
+        reader (MappedCSVFile): Leitor cuja posição vira o checkpoint do job. Opcional.
+        parse_seconds (float): Tempo gasto lendo o lote.
+    """
+    et2 = time.time()
+    for attempt in range(LOCKED_RETRIES + 1):
+        previous = dict(stats)
+        try:
+            with transaction.atomic():
+                inserted, skipped = load_billings(batch, file_id)
+                et3 = time.time()
+                stats['inserted'] += inserted
+                stats['skipped'] += skipped
+                stats['batches'] += 1
+                stats['parse_seconds'] += parse_seconds
+                stats['insert_seconds'] += et3 - et2
+                _update_from_report(stats, report)
+                save_ingestion_progress(job, stats, reader)
+            break
+        except OperationalError as e:
+            # O lote e o checkpoint foram desfeitos juntos, então as estatísticas voltam ao estado anterior.
+            stats.clear()
+            stats.update(previous)
+            if attempt == LOCKED_RETRIES or not _is_locked(e):
+                raise
+            log_info('Banco bloqueado ao gravar o lote %d do arquivo %d, tentando novamente', stats['batches'] + 1,
+                     file_id)
+            time.sleep(LOCKED_RETRY_SECONDS * (attempt + 1))
+    record_ingestion(len(batch), inserted, skipped)
+    STAGE_SECONDS.observe(parse_seconds, stage='parse')
+    STAGE_SECONDS.observe(et3 - et2, stage='insert')
+    if et3 > et2:
+        ROWS_PER_SECOND.set(len(batch) / (et3 - et2), stage='insert')
+    log_info('Lote %d (%d linhas, %d inseridas, %d duplicadas): processamento %s, inserção %s', stats['batches'],
+             len(batch), inserted, skipped, parse_seconds, et3 - et2)
+
+
+def _is_locked(error: OperationalError) -> bool:
+    return connection.vendor == 'sqlite' and 'locked' in str(error)
+
+
+def _update_from_report(stats: dict, report: ParseReport):
+    stats['rows'] = report.rows
+    stats['rejected'] = report.rejected
+    stats['errors'] = report.as_list()
+
+
+def reconcile_ingestion_counts(job: ProcessingJob):
+    """Função para recalcular as linhas inseridas e duplicadas de um job a partir das cobranças gravadas no arquivo.
+
+    Necessária quando cobranças de outro upload do mesmo arquivo são movidas para ele (ver `discard_upload`): o job
+    contou essas linhas como duplicadas, embora elas façam parte do arquivo.
+
+    Args:
+        job (ProcessingJob): Job a ser atualizado.
+    """
+    job.rows_inserted = Billing.objects.filter(file_id=job.file_id).count()
+    job.rows_duplicated = max(job.rows_parsed - job.rows_rejected - job.rows_inserted, 0)
+    job.save(update_fields=['rows_inserted', 'rows_duplicated', 'updated_at'])
+
+
+def _stats_from_job(job: ProcessingJob) -> dict:
+    return {'rows': job.rows_parsed, 'inserted': job.rows_inserted, 'skipped': job.rows_duplicated,
+            'rejected': job.rows_rejected,
+            'batches': 0, 'parse_seconds': job.parse_seconds, 'insert_seconds': job.insert_seconds,
+            'errors': job.error_report}
+
+
+def save_ingestion_progress(job: ProcessingJob, stats: dict, reader: MappedCSVFile = None):
+    """Função para gravar no job o progresso da leitura e inserção.
+
+    Args:
+        job (ProcessingJob): Job a ser atualizado. Se for None nada é feito.
+        stats (dict): Estatísticas acumuladas da inserção.
+        reader (MappedCSVFile): Leitor do arquivo, cuja posição atual vira o checkpoint do job. Opcional.
+    """
+    if job is None:
+        return
+    job.rows_parsed = stats['rows']
+    job.rows_inserted = stats['inserted']
+    job.rows_rejected = stats['rejected']
+    job.rows_duplicated = stats['skipped']
+    job.error_report = stats['errors']
+    job.parse_seconds = stats['parse_seconds']
+    job.insert_seconds = stats['insert_seconds']
+    update_fields = ['rows_parsed', 'rows_inserted', 'rows_rejected', 'rows_duplicated', 'error_report',
+                     'parse_seconds', 'insert_seconds', 'updated_at']
+    if reader is not None:
+        job.checkpoint_offset = reader.offset
+        job.checkpoint_line = reader.line
+        update_fields += ['checkpoint_offset', 'checkpoint_line']
+    job.save(update_fields=update_fields)
+
+
+def send_notification_and_create_pdf(file_id: int, job: ProcessingJob = None,
+                                     dispatcher: BillingDispatcher = None) -> dict:
+    """Função para enviar uma notificação e criar um arquivo pdf com os dados da cobrança.
+
+    Apenas as cobranças que ainda não foram notificadas são enviadas. O envio é feito em paralelo pelo
+    `BillingDispatcher`, com concorrência e limite de chamadas configuráveis.
+
+    Args:
+        file_id (int): ID do arquivo criado.
+        job (ProcessingJob): Job que recebe o progresso das notificações. Opcional.
+        dispatcher (BillingDispatcher): Dispatcher a ser utilizado. Por padrão usa a configuração do settings.
+
+    Returns:
+        dict: Estatísticas do envio, incluindo a vazão em linhas por segundo.
+    """
+    objs = Billing.objects.filter(file_id=file_id,
+                                  status__in=[Billing.Status.PENDING, Billing.Status.INVOICE_CREATED])
+    return dispatch_billings(objs, job, dispatcher)
+
+
+def retry_failed_billings(file_id: int, dispatcher: BillingDispatcher = None) -> dict:
+    """Função para reprocessar apenas as cobranças de um arquivo que falharam no envio.
+
+    Cobranças com o pdf já criado (INVOICE_CREATED) recebem apenas a notificação.
+
+    Args:
+        file_id (int): ID do arquivo.
+        dispatcher (BillingDispatcher): Dispatcher a ser utilizado. Por padrão usa a configuração do settings.
+
+    Returns:
+        dict: Estatísticas do reenvio.
+    """
+    stats = dispatch_billings(Billing.objects.filter(file_id=file_id, status__in=RETRY_STATUSES),
+                              dispatcher=dispatcher)
+    notified = FileSummary.objects.filter(file_id=file_id).values_list('notification_sent_count', flat=True).first()
+    if notified is None:
+        notified = Billing.objects.filter(file_id=file_id, status=Billing.Status.NOTIFICATION_SENT).count()
+    ProcessingJob.objects.filter(file_id=file_id).update(rows_notified=notified)
+    return stats
+
+
+def dispatch_billings(objs, job: ProcessingJob = None, dispatcher: BillingDispatcher = None) -> dict:
+    """Função para criar os pdfs e enviar as notificações de um conjunto de cobranças.
+
+    As cobranças são lidas em páginas pela chave primária, apenas com as colunas de DISPATCH_FIELDS, então a memória
+    usada não depende do tamanho do arquivo. O resultado de cada linha é acumulado e o status é gravado em lotes,
+    com um UPDATE ... WHERE id IN por status, em vez de salvar cada cobrança individualmente.
+
+    Args:
+        objs (QuerySet): Cobranças a serem processadas.
+        job (ProcessingJob): Job que recebe o progresso das notificações. Opcional.
+        dispatcher (BillingDispatcher): Dispatcher a ser utilizado. Por padrão usa a configuração do settings.
+
+    Returns:
+        dict: Estatísticas do envio.
+    """
+    dispatcher = dispatcher or new_dispatcher()
+    if isinstance(dispatcher, AsyncBillingDispatcher):
+        return async_to_sync(adispatch_billings)(objs, job, dispatcher)
+    rows = iter_keyset_pages(objs.values_list(*DISPATCH_FIELDS, named=True), settings.BILLING_BATCH_SIZE)
+    for results in batched(dispatcher.map(rows), settings.BILLING_BATCH_SIZE):
+        _save_dispatch_results(results, job, dispatcher.stats)
+    if job is not None:
+        _save_notification_progress(job, dispatcher.stats)
+    return dispatcher.stats
+
+
+async def adispatch_billings(objs, job: ProcessingJob = None, dispatcher: AsyncBillingDispatcher = None) -> dict:
+    """Versão assíncrona de `dispatch_billings`, com as chamadas aos serviços feitas em um event loop.
+
+    As páginas de cobranças são lidas com o ORM assíncrono e os status são gravados em lotes, em uma thread.
+
+    Args:
+        objs (QuerySet): Cobranças a serem processadas.
+        job (ProcessingJob): Job que recebe o progresso das notificações. Opcional.
+        dispatcher (AsyncBillingDispatcher): Dispatcher a ser utilizado. Opcional.
+
+    Returns:
+        dict: Estatísticas do envio.
+    """
+    dispatcher = dispatcher or AsyncBillingDispatcher()
+    rows = aiter_keyset_pages(objs.values_list(*DISPATCH_FIELDS, named=True), settings.BILLING_BATCH_SIZE)
+    results = []
+    async for result in dispatcher.amap(rows):
+        results.append(result)
+        if len(results) >= settings.BILLING_BATCH_SIZE:
+            await sync_to_async(_save_dispatch_results)(results, job, dispatcher.stats)
+            results = []
+    await sync_to_async(_save_dispatch_results)(results, job, dispatcher.stats)
+    return dispatcher.stats
+
+
+def new_dispatcher() -> BillingDispatcher:
+    """Função para criar o dispatcher configurado em `settings.DISPATCH_BACKEND` ('threads' ou 'asyncio').
+    """
+    if settings.DISPATCH_BACKEND == 'asyncio':
+        return AsyncBillingDispatcher()
+    return BillingDispatcher()
+
+
+def iter_keyset_pages(queryset, page_size: int) -> Generator:
+    """Função para percorrer um queryset em páginas ordenadas pela chave primária (keyset pagination).
+
+    Cada página é uma consulta `id > último id visto ... LIMIT page_size`, que usa o índice e tem o mesmo custo no
+    começo e no fim da tabela, ao contrário de OFFSET. Como a página seguinte só é consultada depois que a anterior
+    foi consumida, linhas que mudam de status durante o envio não são puladas nem repetidas.
+
+    Args:
+        queryset (QuerySet): QuerySet a ser percorrido. Os itens precisam ter o atributo `id`.
+        page_size (int): Quantidade de linhas por consulta.
+
+    Returns:
+        Generator: generator com os itens de todas as páginas.
+    """
+    queryset = queryset.order_by('id')
+    last_id = None
+    while True:
+        page = list((queryset if last_id is None else queryset.filter(id__gt=last_id))[:page_size])
+        yield from page
+        if len(page) < page_size:
+            return
+        last_id = page[-1].id
+
+
+async def aiter_keyset_pages(queryset, page_size: int) -> AsyncGenerator:
+    """Versão assíncrona de `iter_keyset_pages`, usando o ORM assíncrono.
+    """
+    queryset = queryset.order_by('id')
+    last_id = None
+    while True:
+        page = [row async for row in (queryset if last_id is None else queryset.filter(id__gt=last_id))[:page_size]]
+        for row in page:
+            yield row
+        if len(page) < page_size:
+            return
+        last_id = page[-1].id
+
+
+def _save_dispatch_results(results: list, job: ProcessingJob, stats: dict):
+    if results:
+        update_billing_status(results)
+    if job is not None:
+        _save_notification_progress(job, stats)
+
+
+def update_billing_status(results: list):
+    """Função para gravar o status de um lote de cobranças processadas.
+
+    As mudanças de status são aplicadas também ao resumo de cada arquivo, na mesma transação.
+
+    Args:
+        results (list): Lista de DispatchResult.
+    """
+    ids_by_status = {}
+    changes = {}
+    for result in results:
+        ids_by_status.setdefault(result.status, []).append(result.billing.id)
+        key = (result.billing.file_id, result.billing.status, result.status)
+        count, amount = changes.get(key, (0, 0))
+        changes[key] = (count + 1, amount + result.billing.debt_amount)
+    now = timezone.now()
+    with transaction.atomic():
+        for status, ids in ids_by_status.items():
+            Billing.objects.filter(id__in=ids).update(status=status, updated_at=now)
+        move_billings(changes)
+
+
+def _save_notification_progress(job: ProcessingJob, stats: dict):
+    job.rows_notified = stats['notified']
+    job.notify_seconds = stats['seconds']
+    job.save(update_fields=['rows_notified', 'notify_seconds', 'updated_at'])
@@ -0,0 +1,53 @@
+from .models import Billing, File, FileSummary
+from .summaries import rebuild_file_summary
+
+
+# Consultas de leitura da api. As cobranças são lidas com .values() (dicionários, sem instanciar os modelos) e o
+#   resumo de cada arquivo vem da tabela FileSummary, mantida pelo processamento.
+
+# Colunas devolvidas pela api de cobranças.
+BILLING_FIELDS = ('id', 'file_id', 'name', 'government_id', 'email', 'debt_amount', 'debt_due_date', 'debt_id',
+                  'status')
+
+
+def filter_billings(file_id: int = None, status: str = None, due_date_from=None, due_date_to=None):
+    """Função para montar a consulta de cobranças com os filtros da api.
+
+    Args:
+        file_id (int): Id do arquivo. Opcional.
+        status (str): Status das cobranças. Opcional.
+        due_date_from (date): Vencimento mínimo, inclusivo. Opcional.
+        due_date_to (date): Vencimento máximo, inclusivo. Opcional.
+
+    Returns:
+        QuerySet: Cobranças filtradas, como dicionários com as colunas de BILLING_FIELDS.
+    """
+    queryset = Billing.objects.all()
+    if file_id is not None:
+        queryset = queryset.filter(file_id=file_id)
+    if status:
+        queryset = queryset.filter(status=status)
+    if due_date_from is not None:
+        queryset = queryset.filter(debt_due_date__gte=due_date_from)
+    if due_date_to is not None:
+        queryset = queryset.filter(debt_due_date__lte=due_date_to)
+    return queryset.values(*BILLING_FIELDS)
+
+
+def billing_summary(file_id: int) -> FileSummary:
+    """Função para obter o resumo das cobranças de um arquivo: quantidade e valor total, no total e por status.
+
+    O resumo é mantido pelo processamento a cada lote, então a consulta lê uma única linha. Arquivos processados antes
+    da tabela existir, ainda sem resumo, têm os totais calculados a partir das cobranças (sem gravar; o comando
+    `rebuild_file_summaries` preenche a tabela).
+
+    Args:
+        file_id (int): Id do arquivo.
+
+    Returns:
+        FileSummary: Resumo do arquivo ou None se o arquivo não existir.
+    """
+    summary = FileSummary.objects.filter(file_id=file_id).first()
+    if summary is None and File.objects.filter(id=file_id).exists():
+        summary = rebuild_file_summary(file_id, save=False)
+    return summary
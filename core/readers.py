@@ -0,0 +1,418 @@
+import csv
+import gzip
+import mmap
+import os
+import zlib
+from array import array
+from typing import Generator
+
+import zstandard
+
+
+UTF8_BOM = b'\xef\xbb\xbf'
+# Tamanho máximo do bloco dividido de uma só vez no caminho rápido da leitura.
+READ_BLOCK_SIZE = 1024 * 1024
+# Extensões aceitas e a compressão de cada uma. Arquivos comprimidos são descomprimidos como stream, sem gravar o
+#   csv descomprimido em disco.
+CSV_EXTENSIONS = {'.csv': None, '.csv.gz': 'gzip', '.csv.zst': 'zstd'}
+
+
+def csv_extension(name: str) -> str:
+    """Função para obter a extensão de csv (possivelmente dupla, como .csv.gz) de um nome de arquivo.
+
+    Args:
+        name (str): Nome ou caminho do arquivo.
+
+    Returns:
+        str: Extensão encontrada em CSV_EXTENSIONS ou None se o arquivo não for um csv aceito.
+    """
+    for extension in CSV_EXTENSIONS:
+        if name.endswith(extension):
+            return extension
+    return None
+
+
+def compression_of(name: str) -> str:
+    """Função para obter a compressão de um arquivo csv pelo nome: 'gzip', 'zstd' ou None para csv sem compressão.
+    """
+    return CSV_EXTENSIONS.get(csv_extension(name))
+
+
+def open_csv_file(path: str):
+    """Função para abrir um arquivo csv para leitura dos registros, descomprimindo-o se necessário.
+
+    Args:
+        path (str): Caminho do arquivo.
+
+    Returns:
+        MappedCSVFile | CompressedCSVFile: Leitor do arquivo.
+    """
+    compression = compression_of(path)
+    return CompressedCSVFile(path, compression) if compression else MappedCSVFile(path)
+
+
+def open_csv_stream(path: str):
+    """Função para abrir um arquivo csv como um stream binário do conteúdo descomprimido.
+
+    Args:
+        path (str): Caminho do arquivo.
+
+    Returns:
+        BinaryIO: Stream com os bytes do csv.
+    """
+    compression = compression_of(path)
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    if compression == 'zstd':
+        # Arquivos gerados em stream podem ter vários frames.
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True)
+    return open(path, 'rb')
+
+
+def record_boundary(data: bytes) -> int:
+    """Função para encontrar a última quebra de linha de `data` que encerra um registro.
+
+    Uma quebra de linha só encerra um registro quando a quantidade de aspas antes dela é par. `data` deve começar
+    no início de um registro.
+
+    Returns:
+        int: Posição da quebra de linha ou -1 se não houver nenhum registro completo.
+    """
+    end = data.rfind(b'\n')
+    while end != -1 and data.count(b'"', 0, end) % 2:
+        end = data.rfind(b'\n', 0, end)
+    return end
+
+
+class MappedCSVFile():
+    """Classe para ler um arquivo csv mapeado em memória (mmap).
+
+    Os limites de cada registro são encontrados direto no buffer de bytes, sem passar pela camada de texto do Python.
+    Trechos sem aspas são divididos em blocos; blocos que contêm aspas passam inteiros por um único csv.reader.
+    Os atributos `offset` e `line` indicam o byte e a linha logo após o último registro entregue, o que permite
+    retomar ou dividir a leitura a partir de qualquer registro.
+    """
+
+    def __init__(self, path: str):
+        self.f = open(path, 'rb')
+        self.size = os.fstat(self.f.fileno()).st_size
+        # Não é possível mapear um arquivo vazio.
+        self.buffer = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        self.offset = 0
+        self.line = 0
+        self.bom = True
+
+    @classmethod
+    def from_buffer(cls, buffer: bytes, bom: bool = False) -> 'MappedCSVFile':
+        """Função para ler os registros de um buffer em memória, como um trecho de um arquivo descomprimido.
+
+        Args:
+            buffer (bytes): Registros completos.
+            bom (bool): Se o buffer é o início do arquivo, onde pode haver um BOM de UTF-8.
+        """
+        reader = cls.__new__(cls)
+        reader.f = None
+        reader.size = len(buffer)
+        reader.buffer = buffer
+        reader.offset = 0
+        reader.line = 0
+        reader.bom = bom
+        return reader
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        if self.f is not None:
+            self.f.close()
+
+    def record_end(self, start: int) -> tuple:
+        """Função para encontrar o fim do registro que começa em `start`.
+
+        Uma quebra de linha só encerra o registro se a quantidade de aspas desde o início do registro for par.
+
+        Args:
+            start (int): Byte inicial do registro.
+
+        Returns:
+            tuple: Posição da quebra de linha que encerra o registro (ou o tamanho do arquivo) e se o registro
+                contém aspas.
+        """
+        buffer, size = self.buffer, self.size
+        end = buffer.find(b'\n', start)
+        if end == -1:
+            end = size
+        if buffer.find(b'"', start, end) == -1:
+            return end, False
+        quotes, position = 0, start
+        while True:
+            quote = buffer.find(b'"', position, end)
+            while quote != -1:
+                quotes += 1
+                quote = buffer.find(b'"', quote + 1, end)
+            if quotes % 2 == 0 or end >= size:
+                return end, True
+            position = end
+            end = buffer.find(b'\n', end + 1)
+            if end == -1:
+                end = size
+
+    def records(self, start: int = None, end: int = None, first_line: int = None) -> Generator:
+        """Função para ler os registros do arquivo junto com o número da linha.
+
+        Args:
+            start (int): Byte inicial, que deve ser o início de um registro. Por padrão continua de `offset`.
+            end (int): Byte final (exclusivo). Por padrão o fim do arquivo.
+            first_line (int): Quantidade de linhas antes de `start`. Por padrão continua de `line`.
+
+        Returns:
+            Generator: generator de tuplas (número da linha, lista de campos).
+        """
+        buffer = self.buffer
+        position = self.offset if start is None else start
+        line = self.line if first_line is None else first_line
+        end = self.size if end is None else min(end, self.size)
+        if position == 0 and self.bom and buffer[:len(UTF8_BOM)] == UTF8_BOM:
+            position = len(UTF8_BOM)
+        while position < end:
+            # Caminho rápido: um bloco de registros sem aspas é dividido por quebra de linha de uma só vez.
+            block_end = buffer.rfind(b'\n', position, min(position + READ_BLOCK_SIZE, end))
+            if block_end != -1:
+                quote = buffer.find(b'"', position, block_end)
+                if quote != -1:
+                    block_end = buffer.rfind(b'\n', position, quote)
+            if block_end != -1:
+                for raw in buffer[position:block_end].split(b'\n'):
+                    position += len(raw) + 1
+                    line += 1
+                    if raw.endswith(b'\r'):
+                        raw = raw[:-1]
+                    # Decodificar o registro inteiro em uma única chamada é mais barato do que cada campo.
+                    text = raw.decode('utf-8')
+                    self.offset, self.line = position, line
+                    yield line, text.split(',') if text else []
+                continue
+            # Registros com aspas: os registros a partir daqui, até perto de READ_BLOCK_SIZE, passam por um único
+            #   csv.reader.
+            yield from self._quoted_records(position, self.quoted_block_end(position, end), line)
+            position, line = self.offset, self.line
+
+    def quoted_block_end(self, start: int, end: int) -> int:
+        """Função para encontrar o fim de um bloco de registros a partir de `start`, com cerca de READ_BLOCK_SIZE
+        bytes e que termina em um limite de registro.
+
+        Args:
+            start (int): Byte inicial, que deve ser o início de um registro.
+            end (int): Byte final (exclusivo) da leitura.
+
+        Returns:
+            int: Posição da quebra de linha que encerra o último registro do bloco (ou o fim da leitura).
+        """
+        buffer = self.buffer
+        # O fim da leitura é sempre um limite de registro, sem a quebra de linha final.
+        last = end - 1 if buffer[end - 1:end] == b'\n' else end
+        if start + READ_BLOCK_SIZE >= end:
+            return last
+        block_end = buffer.rfind(b'\n', start, start + READ_BLOCK_SIZE)
+        if block_end == -1:
+            return min(self.record_end(start)[0], last)
+        # Uma quebra de linha com quantidade ímpar de aspas antes dela está dentro de um campo: o bloco avança até
+        #   o fim desse registro. O mmap não tem count, então as aspas são contadas em uma cópia do trecho.
+        quotes = buffer[start:block_end].count(b'"')
+        while quotes % 2:
+            next_end = buffer.find(b'\n', block_end + 1, end)
+            if next_end == -1:
+                return last
+            quotes += buffer[block_end:next_end].count(b'"')
+            block_end = next_end
+        return block_end
+
+    def _quoted_records(self, start: int, stop: int, line: int) -> Generator:
+        # O csv.reader pede uma linha por vez e devolve o registro assim que ele termina, então a posição e a linha
+        #   depois de cada registro são as da última linha entregue a ele.
+        state = [start, line]
+
+        def lines():
+            for raw in self.buffer[start:stop].split(b'\n'):
+                state[0] += len(raw) + 1
+                state[1] += 1
+                yield raw.decode('utf-8') + '\n'
+
+        for fields in csv.reader(lines()):
+            self.offset, self.line = min(state[0], self.size), state[1]
+            yield state[1], fields
+
+    def index(self, start: int = 0) -> array:
+        """Função para montar o índice com o byte inicial de cada registro a partir de `start`.
+
+        Args:
+            start (int): Byte inicial, que deve ser o início de um registro.
+
+        Returns:
+            array: Array compacto ('Q') com a posição de cada registro.
+        """
+        offsets = array('Q')
+        position = start
+        while position < self.size:
+            offsets.append(position)
+            position = self.record_end(position)[0] + 1
+        return offsets
+
+
+class CSVChunkSplitter():
+    """Classe para separar registros completos de um csv que chega em pedaços (por exemplo, durante o upload).
+
+    Os bytes depois do último registro completo ficam guardados até o próximo pedaço. Assim como no mmap, uma quebra
+    de linha só encerra um registro quando a quantidade de aspas antes dela é par.
+    """
+
+    def __init__(self):
+        self.pending = b''
+        self.started = False
+
+    def feed(self, chunk: bytes) -> str:
+        """Função para receber um pedaço do arquivo.
+
+        Args:
+            chunk (bytes): Pedaço recebido.
+
+        Returns:
+            str: Texto dos registros completos disponíveis (pode ser vazio).
+        """
+        data = self.pending + chunk
+        if not self.started and len(data) >= len(UTF8_BOM):
+            self.started = True
+            if data.startswith(UTF8_BOM):
+                data = data[len(UTF8_BOM):]
+        end = record_boundary(data)
+        self.pending = data[end + 1:]
+        return data[:end + 1].decode('utf-8')
+
+    def close(self) -> str:
+        """Função para obter o último registro, quando o arquivo não termina com quebra de linha.
+
+        Returns:
+            str: Texto restante.
+        """
+        data, self.pending = self.pending, b''
+        return data.decode('utf-8')
+
+
+class CompressedCSVFile():
+    """Classe para ler os registros de um arquivo csv comprimido (gzip ou zstd), descomprimindo-o como stream.
+
+    O conteúdo é descomprimido em blocos de READ_BLOCK_SIZE, cortados no último registro completo, e cada bloco é
+    lido como um buffer do MappedCSVFile, então o parse é o mesmo dos arquivos sem compressão e a memória usada não
+    depende do tamanho do arquivo. Os atributos `offset` e `line` têm o mesmo significado do MappedCSVFile, com o
+    offset contado no conteúdo descomprimido. Como não é possível ir direto para um offset, retomar a leitura
+    descomprime (e descarta) o conteúdo anterior, sem fazer o parse dele.
+    """
+
+    def __init__(self, path: str, compression: str):
+        self.path = path
+        self.compression = compression
+        self.stream = None
+        self.offset = 0
+        self.line = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    def records(self, start: int = None, end: int = None, first_line: int = None) -> Generator:
+        """Função para ler os registros do arquivo junto com o número da linha.
+
+        Args:
+            start (int): Byte inicial do conteúdo descomprimido, que deve ser o início de um registro. Por padrão
+                continua de `offset`.
+            end (int): Byte final (exclusivo). Por padrão o fim do arquivo.
+            first_line (int): Quantidade de linhas antes de `start`. Por padrão continua de `line`.
+
+        Returns:
+            Generator: generator de tuplas (número da linha, lista de campos).
+        """
+        base = self.offset if start is None else start
+        line = self.line if first_line is None else first_line
+        # Cada leitura começa um novo stream. O anterior pode ter sido abandonado no meio (como na leitura do cabeçalho
+        #   antes de retomar um job).
+        self.close()
+        self.stream = stream = open_csv_stream(self.path)
+        skip = base
+        while skip > 0:
+            skipped = len(stream.read(min(skip, READ_BLOCK_SIZE)))
+            if not skipped:
+                return
+            skip -= skipped
+        pending = b''
+        while True:
+            data = stream.read(READ_BLOCK_SIZE)
+            if data:
+                data = pending + data
+                boundary = record_boundary(data)
+                if boundary == -1:
+                    # Um registro maior do que o bloco: continua lendo até ele terminar.
+                    pending = data
+                    continue
+                window, pending = data[:boundary + 1], data[boundary + 1:]
+            else:
+                window, pending = pending, b''
+                if not window:
+                    return
+            reader = MappedCSVFile.from_buffer(window, bom=base == 0)
+            for number, fields in reader.records(0, first_line=line):
+                self.offset, self.line = base + reader.offset, reader.line
+                yield number, fields
+                if end is not None and self.offset >= end:
+                    return
+            base += len(window)
+            line = reader.line
+
+
+class ChunkDecompressor():
+    """Classe para descomprimir um arquivo que chega em pedaços (por exemplo, durante o upload).
+
+    Aceita arquivos com vários membros gzip ou frames zstd concatenados, como os gerados em stream.
+    """
+
+    def __init__(self, compression: str):
+        self.compression = compression
+        self.decompressor = self.new_decompressor()
+        # Indica se o último membro (ou frame) recebido terminou, o que não acontece com um arquivo truncado.
+        self.complete = True
+
+    def new_decompressor(self):
+        if self.compression == 'gzip':
+            # wbits=31 lê o cabeçalho e o rodapé do formato gzip.
+            return zlib.decompressobj(31)
+        return zstandard.ZstdDecompressor().decompressobj()
+
+    def decompress(self, chunk: bytes) -> bytes:
+        """Função para descomprimir um pedaço recebido.
+
+        Args:
+            chunk (bytes): Pedaço comprimido.
+
+        Returns:
+            bytes: Conteúdo descomprimido disponível (pode ser vazio).
+        """
+        data = []
+        while chunk:
+            data.append(self.decompressor.decompress(chunk))
+            self.complete = self.decompressor.eof
+            if not self.complete:
+                break
+            chunk = self.decompressor.unused_data
+            self.decompressor = self.new_decompressor()
+        return b''.join(data)
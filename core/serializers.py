@@ -1,5 +1,8 @@
-from .models import File
-from rest_framework.serializers import Serializer, FileField, ModelSerializer
+from .models import Billing, File, FileSummary, ProcessingJob
+from .summaries import STATUS_FIELDS
+from rest_framework.serializers import (CharField, ChoiceField, DateField, DecimalField, EmailField, FileField,
+                                        IntegerField, ModelSerializer, Serializer, SerializerMethodField, UUIDField,
+                                        ValidationError)
 
 
 class FileSerializer(ModelSerializer):
@@ -13,7 +16,59 @@ class FileSerializer(ModelSerializer):
 
 class BillingSerializer(Serializer):
     """Definição da apresentação do modelo Billing na api.
+
+    As cobranças são lidas com .values(), então o serializer recebe dicionários com as colunas de
+    `core.queries.BILLING_FIELDS` em vez de instâncias do modelo.
+    """
+
+    id = IntegerField()
+    file = IntegerField(source='file_id')
+    name = CharField()
+    government_id = CharField()
+    email = EmailField()
+    debt_amount = DecimalField(max_digits=10, decimal_places=2)
+    debt_due_date = DateField()
+    debt_id = UUIDField()
+    status = CharField()
+
+
+class BillingFilterSerializer(Serializer):
+    """Validação dos filtros da consulta de cobranças.
+    """
+
+    file = IntegerField(required=False, min_value=1)
+    status = ChoiceField(choices=Billing.Status.choices, required=False)
+    due_date_from = DateField(required=False)
+    due_date_to = DateField(required=False)
+
+    def validate(self, attrs):
+        if attrs.get('due_date_from') and attrs.get('due_date_to') and attrs['due_date_from'] > attrs['due_date_to']:
+            raise ValidationError({'due_date_to': 'must not be before due_date_from.'})
+        return attrs
+
+
+class ProcessingJobSerializer(ModelSerializer):
+    """Definição da apresentação do modelo ProcessingJob na api.
     """
     
     class Meta:
-        fields = ['file', 'name', 'government_id', 'email', 'debt_amount', 'debt_due_date', 'debt_id', 'status']
+        model = ProcessingJob
+        fields = ['id', 'file', 'state', 'stage', 'rows_parsed', 'rows_inserted', 'rows_notified', 'rows_rejected',
+                  'rows_duplicated', 'parse_seconds', 'insert_seconds', 'notify_seconds', 'started_at', 'finished_at', 'error',
+                  'error_report', 'checkpoint_line']
+
+
+class FileSummarySerializer(ModelSerializer):
+    """Definição da apresentação do modelo FileSummary na api, com a quantidade e o valor de cada status agrupados.
+    """
+
+    by_status = SerializerMethodField()
+
+    class Meta:
+        model = FileSummary
+        fields = ['file', 'count', 'debt_amount', 'first_due_date', 'last_due_date', 'by_status']
+
+    def get_by_status(self, summary: FileSummary) -> dict:
+        return {status: {'count': getattr(summary, f'{prefix}_count'),
+                         'debt_amount': f'{getattr(summary, f"{prefix}_amount"):.2f}'}
+                for status, prefix in STATUS_FIELDS.items()}
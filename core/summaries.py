@@ -0,0 +1,103 @@
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Min, Q, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from .models import Billing, FileSummary
+
+
+# Manutenção incremental da tabela FileSummary. Cada lote soma os próprios totais na linha do arquivo com
+#   UPDATE ... SET campo = campo + valor, na mesma transação do lote, então processos e threads que gravam lotes do
+#   mesmo arquivo ao mesmo tempo não perdem atualizações e um lote desfeito também desfaz os totais.
+
+# Prefixo dos campos de quantidade e valor de cada status.
+STATUS_FIELDS = {
+    Billing.Status.PENDING: 'pending',
+    Billing.Status.INVOICE_CREATED: 'invoice_created',
+    Billing.Status.NOTIFICATION_SENT: 'notification_sent',
+    Billing.Status.FAILED: 'failed',
+}
+
+
+def add_billings(file_id: int, count: int, amount: Decimal, first_due_date=None, last_due_date=None):
+    """Função para somar ao resumo de um arquivo um lote de cobranças inseridas (com status PENDING).
+
+    Args:
+        file_id (int): Id do arquivo.
+        count (int): Quantidade de cobranças inseridas.
+        amount (Decimal): Soma do debt_amount das cobranças inseridas.
+        first_due_date (date): Menor vencimento do lote.
+        last_due_date (date): Maior vencimento do lote.
+    """
+    if not count:
+        return
+    # O Coalesce cobre o resumo ainda sem cobranças (datas nulas), já que LEAST e GREATEST com NULL variam entre bancos.
+    _update(file_id, count=F('count') + count, debt_amount=F('debt_amount') + amount,
+            pending_count=F('pending_count') + count, pending_amount=F('pending_amount') + amount,
+            first_due_date=Least(Coalesce(F('first_due_date'), Value(first_due_date)), Value(first_due_date)),
+            last_due_date=Greatest(Coalesce(F('last_due_date'), Value(last_due_date)), Value(last_due_date)))
+
+
+def move_billings(changes: dict):
+    """Função para atualizar os resumos com as mudanças de status gravadas pelo envio.
+
+    Args:
+        changes (dict): Dicionário {(file_id, status anterior, status novo): (quantidade, valor)}.
+    """
+    deltas = {}
+    for (file_id, previous, status), (count, amount) in changes.items():
+        if previous == status:
+            continue
+        fields = deltas.setdefault(file_id, {})
+        for prefix, sign in ((STATUS_FIELDS[previous], -1), (STATUS_FIELDS[status], 1)):
+            fields[f'{prefix}_count'] = fields.get(f'{prefix}_count', 0) + sign * count
+            fields[f'{prefix}_amount'] = fields.get(f'{prefix}_amount', 0) + sign * amount
+    for file_id, fields in deltas.items():
+        _update(file_id, **{name: F(name) + delta for name, delta in fields.items() if delta})
+
+
+def _update(file_id: int, **values):
+    with transaction.atomic():
+        if FileSummary.objects.filter(file_id=file_id).update(**values):
+            return
+        # Arquivo sem resumo (novo ou processado antes da tabela existir): o resumo é calculado a partir das
+        #   cobranças, que já incluem as mudanças deste lote, então os incrementos não são aplicados de novo.
+        summary = rebuild_file_summary(file_id, save=False)
+        try:
+            with transaction.atomic():
+                summary.save(force_insert=True)
+        except IntegrityError:
+            # Outro processo criou o resumo ao mesmo tempo, sem ver as mudanças ainda não gravadas deste lote.
+            FileSummary.objects.filter(file_id=file_id).update(**values)
+
+
+def rebuild_file_summary(file_id: int, save: bool = True) -> FileSummary:
+    """Função para recalcular o resumo de um arquivo a partir das cobranças.
+
+    Usada para preencher o resumo de arquivos processados antes da tabela existir ou para corrigir um resumo após
+    alterações feitas diretamente no banco.
+
+    Args:
+        file_id (int): Id do arquivo.
+        save (bool): Grava o resumo recalculado. Sem gravar, o resumo devolvido não é salvo no banco.
+
+    Returns:
+        FileSummary: Resumo recalculado.
+    """
+    # O total usa o alias total_amount porque um agregado não pode ter o nome de um campo do modelo.
+    aggregates = {'count': Count('id'), 'total_amount': Sum('debt_amount'), 'first_due_date': Min('debt_due_date'),
+                  'last_due_date': Max('debt_due_date')}
+    for status, prefix in STATUS_FIELDS.items():
+        aggregates[f'{prefix}_count'] = Count('id', filter=Q(status=status))
+        aggregates[f'{prefix}_amount'] = Sum('debt_amount', filter=Q(status=status))
+    values = Billing.objects.filter(file_id=file_id).aggregate(**aggregates)
+    values['debt_amount'] = values.pop('total_amount')
+    for name in values:
+        if name.endswith('amount') and values[name] is None:
+            values[name] = Decimal('0')
+    if not save:
+        return FileSummary(file_id=file_id, **values)
+    summary, _ = FileSummary.objects.update_or_create(file_id=file_id, defaults=values)
+    return summary
+
@@ -0,0 +1,94 @@
+import os
+import random
+import uuid
+from datetime import date, timedelta
+
+
+# Gerador de arquivos csv de cobranças sintéticos para benchmarks e testes de carga. O módulo não depende do Django
+#   para poder ser usado também fora do projeto (por exemplo, pelo client.py).
+
+CSV_HEADER = 'name,governmentId,email,debtAmount,debtDueDate,debtId\n'
+FIRST_NAMES = ('Ana', 'Bruno', 'Carla', 'Daniel', 'Elijah', 'Fernanda', 'Gabriel', 'Helena', 'Igor', 'Julia',
+               'Lucas', 'Marina', 'Nathan', 'Olivia', 'Pedro', 'Rafaela', 'Samuel', 'Tatiana', 'Vitor', 'Yasmin')
+LAST_NAMES = ('Almeida', 'Barbosa', 'Costa', 'Dias', 'Ferreira', 'Gomes', 'Lima', 'Martins', 'Oliveira', 'Orr',
+              'Pereira', 'Ribeiro', 'Santos', 'Silva', 'Souza')
+DOMAINS = ('example.com', 'example.org', 'example.net')
+# Cada tipo de linha inválida é rejeitado por uma validação diferente do parser.
+INVALID_ROWS = (
+    '{name},{government_id},{government_id}.example.com,{amount},{due_date},{debt_id}',
+    '{name},{government_id},{email},not-a-number,{due_date},{debt_id}',
+    '{name},{government_id},{email},{amount},2024-13-40,{debt_id}',
+    '{name},{government_id},{email},{amount},{due_date},not-a-uuid',
+    '{name},{government_id},{email}',
+)
+# Quantidade de linhas montadas antes de cada escrita no arquivo.
+WRITE_CHUNK_SIZE = 10000
+
+
+def debt_id_for(seed: int, index: int) -> str:
+    """Função para gerar o debtId da linha `index` de forma determinística.
+
+    Args:
+        seed (int): Semente do arquivo.
+        index (int): Posição da linha.
+
+    Returns:
+        str: UUID da linha. Linhas diferentes do mesmo arquivo nunca têm o mesmo debtId.
+    """
+    # A multiplicação por um número ímpar módulo 2**96 é uma permutação: os ids ficam espalhados como UUIDs reais
+    #   (o que importa para o custo de inserção no índice), sem se repetir.
+    scrambled = (index * 0x9E3779B97F4A7C15F39CC061) % (1 << 96)
+    return str(uuid.UUID(int=((seed & 0xFFFFFFFF) << 96) | scrambled, version=4))
+
+
+def generate_billing_csv(path: str, rows: int, duplicate_ratio: float = 0.0, invalid_ratio: float = 0.0,
+                         seed: int = 0) -> dict:
+    """Função para gerar um arquivo csv de cobranças com conteúdo determinístico.
+
+    A mesma semente, quantidade de linhas e proporções geram sempre o mesmo arquivo. Linhas duplicadas repetem o
+    debtId de uma linha anterior e linhas inválidas são rejeitadas pelo parser.
+
+    Args:
+        path (str): Caminho do arquivo a ser criado.
+        rows (int): Quantidade de linhas, sem contar o cabeçalho.
+        duplicate_ratio (float): Proporção de linhas com debtId repetido (0 a 1).
+        invalid_ratio (float): Proporção de linhas inválidas (0 a 1).
+        seed (int): Semente do gerador.
+
+    Returns:
+        dict: Quantidade de linhas geradas, duplicadas, inválidas e o tamanho do arquivo em bytes.
+    """
+    if duplicate_ratio + invalid_ratio > 1:
+        raise ValueError('duplicate_ratio + invalid_ratio must not exceed 1.')
+    rng = random.Random(seed)
+    start = date(2024, 1, 1)
+    duplicates = invalid = 0
+    with open(path, 'w', newline='') as f:
+        f.write(CSV_HEADER)
+        lines = []
+        for index in range(rows):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            government_id = rng.randrange(1000, 100000)
+            values = {
+                'name': f'{first} {last}',
+                'government_id': government_id,
+                'email': f'{first.lower()}{government_id}@{rng.choice(DOMAINS)}',
+                'amount': f'{rng.randrange(100, 1000000) / 100:.2f}',
+                'due_date': (start + timedelta(days=rng.randrange(730))).isoformat(),
+                'debt_id': debt_id_for(seed, index),
+            }
+            draw = rng.random()
+            if draw < invalid_ratio:
+                invalid += 1
+                lines.append(rng.choice(INVALID_ROWS).format(**values))
+            else:
+                if draw < invalid_ratio + duplicate_ratio and index:
+                    duplicates += 1
+                    values['debt_id'] = debt_id_for(seed, rng.randrange(index))
+                lines.append('{name},{government_id},{email},{amount},{due_date},{debt_id}'.format(**values))
+            if len(lines) >= WRITE_CHUNK_SIZE:
+                f.write('\n'.join(lines) + '\n')
+                lines = []
+        if lines:
+            f.write('\n'.join(lines) + '\n')
+    return {'rows': rows, 'duplicates': duplicates, 'invalid': invalid, 'bytes': os.path.getsize(path)}
@@ -1,7 +1,64 @@
-from django.test import TestCase, Client
+import csv
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from logging.handlers import QueueHandler
+from unittest import mock
+from datetime import date
+from decimal import Decimal
 
-from core.models import Billing, File
-from core.utils import CreatePDFBillingClient, DefaultProcessing, SendNotificationBillingClient, create_default_api_response, default_processing, get_unique_file_path, validate_file_extension
+import zstandard
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.db.backends.signals import connection_created
+from psycopg_pool import PoolTimeout
+from django.test.utils import CaptureQueriesContext
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import AsyncClient, TestCase, TransactionTestCase, Client, RequestFactory, override_settings
+
+from core.backends.postgresql.base import checkout, close_pools, get_pool
+from core.dispatch import AsyncBillingDispatcher, BillingDispatcher, RateLimiter
+from core.jobs import claim_job, requeue_job, requeue_stale_jobs, run_job, run_queued_jobs
+from core.dedup import DEBT_IDS, DebtIdCache
+from core.loaders import load_billings
+from core.logs import start_async_logging, stop_async_logging
+from core.metrics import DB_CONNECTIONS_OPENED, DB_POOL_TIMEOUTS, DB_POOL_WAIT_SECONDS, Counter, Histogram, Registry
+from core.parallel import ingest_range, process_csv_content_parallel, split_csv_file
+from core.synthetic import generate_billing_csv
+from core.uploads import StreamingCSVUploadHandler, discard_upload
+from core.readers import ChunkDecompressor, CSVChunkSplitter, MappedCSVFile, open_csv_file
+from core.parsers import BillingRowParser, ParseReport, iter_csv_records, parse_billing_records, read_billing_rows
+from core.models import Billing, File, FileSummary, ProcessingJob
+from core.serializers import FileSummarySerializer
+from core.utils import CreatePDFBillingClient, DefaultProcessing, SendNotificationBillingClient, SimulatedBillingClient, batched, create_default_api_response, default_processing, get_unique_file_path, log_debug, validate_file_extension
+from core.queries import billing_summary
+from core.processing import iter_keyset_pages, process_csv_content, retry_failed_billings, send_notification_and_create_pdf
+
+
+CSV_HEADER = 'name,governmentId,email,debtAmount,debtDueDate,debtId\n'
+
+
+def write_csv(lines: list) -> str:
+    """Cria um arquivo csv temporário com o cabeçalho padrão e as linhas informadas."""
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    with os.fdopen(fd, 'w') as f:
+        f.write(CSV_HEADER)
+        f.writelines(f'{line}\n' for line in lines)
+    return path
+
+
+def billing_lines(count: int, start: int = 0) -> list:
+    """Gera linhas válidas de cobrança com debtIds previsíveis."""
+    return [f'Name {i},{i},user{i}@example.com,{i}.50,2024-01-19,00000000-0000-0000-0000-{i:012d}'
+            for i in range(start, start + count)]
 
 
 class ApiUnitTests(TestCase):
@@ -42,12 +99,20 @@ class ApiUnitTests(TestCase):
         file = File(file="test.txt")
         with self.assertRaises(Exception) as context:
             validate_file_extension(file.file)
-        self.assertTrue("Invalid file extension. Only .csv files are allowed." in str(context.exception))
+        self.assertTrue("Invalid file extension. Only .csv, .csv.gz and .csv.zst files are allowed." in str(context.exception))
         
     def test_validate_file_extension_csv(self):
         file = File(file="test.csv")
         self.assertIsNone(validate_file_extension(file.file))
         
+    def test_compressed_file_extensions(self):
+        for name in ("test.csv.gz", "test.csv.zst"):
+            self.assertIsNone(validate_file_extension(File(file=name).file))
+        with self.assertRaises(Exception):
+            validate_file_extension(File(file="test.gz").file)
+        # a extensão dupla é mantida no nome gravado
+        self.assertTrue(get_unique_file_path("instance", "filename.csv.gz").endswith(".csv.gz"))
+        
     def test_create_default_api_response(self):
         response = create_default_api_response(200, "Test", {"data": "test"})
         self.assertEqual(response, {'status': 200, 'message': 'Test', 'data': {'data': 'test'}})
@@ -67,6 +132,12 @@ class ApiUnitTests(TestCase):
         client = SendNotificationBillingClient()
         self.assertEqual(client.send_notification(self.billing), True)
 
+    def test_batched(self):
+        self.assertEqual(list(batched(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(batched([], 2)), [])
+        with self.assertRaises(ValueError):
+            list(batched(range(5), 0))
+
     
 class ApiIntegrationTests(TestCase):
     
@@ -95,4 +166,949 @@ class ApiIntegrationTests(TestCase):
         self.assertEqual(self.email_client.check_service(), True)
 
     def test_pdf_client_is_working(self):
-        self.assertEqual(self.pdf_client.process(), True)
\ No newline at end of file
+        self.assertEqual(self.pdf_client.process(), True)
+
+
+class ProcessingTests(TestCase):
+
+    def setUp(self) -> None:
+        self.file = File.objects.create(file="test.csv")
+        self.path = write_csv(billing_lines(5))
+
+    def tearDown(self) -> None:
+        os.remove(self.path)
+
+    def test_process_csv_content_in_batches(self):
+        stats = process_csv_content(self.path, self.file.id, batch_size=2)
+        self.assertEqual(stats['rows'], 5)
+        self.assertEqual(stats['batches'], 3)
+        self.assertEqual(Billing.objects.filter(file=self.file).count(), 5)
+
+    def test_process_csv_content_ignores_duplicates(self):
+        process_csv_content(self.path, self.file.id, batch_size=2)
+        stats = process_csv_content(self.path, self.file.id, batch_size=3)
+        self.assertEqual(Billing.objects.count(), 5)
+        self.assertEqual(stats['inserted'], 0)
+        self.assertEqual(stats['skipped'], 5)
+
+    def test_load_billings_counts_duplicates_within_batch(self):
+        row = ('Test', '1', 'email@email.com', '10.00', '2021-01-01', '123e4567-e89b-12d3-a456-426614174000')
+        self.assertEqual(load_billings([row, row], self.file.id), (1, 1))
+        self.assertEqual(load_billings([row], self.file.id), (0, 1))
+        self.assertEqual(load_billings([], self.file.id), (0, 0))
+
+    def test_locked_batch_is_retried(self):
+        calls = []
+
+        def load(rows, file_id):
+            calls.append(len(rows))
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+            return load_billings(rows, file_id)
+        with mock.patch('core.processing.load_billings', side_effect=load), mock.patch('core.processing.time.sleep'):
+            stats = process_csv_content(self.path, self.file.id, batch_size=2)
+        self.assertEqual(calls, [2, 2, 2, 1])
+        self.assertEqual((stats['inserted'], stats['batches']), (5, 3))
+
+    def test_committed_debt_ids_are_dropped_before_the_database(self):
+        self.addCleanup(DEBT_IDS.clear)
+        rows = [tuple(line.split(',')) for line in billing_lines(3)]
+        with self.captureOnCommitCallbacks(execute=True):
+            kept, dropped = DEBT_IDS.filter(rows + rows[:1])
+            self.assertEqual((kept, dropped), (rows, 1))
+            load_billings(kept, self.file.id)
+        # os ids só entram no cache depois do commit e o reenvio faz apenas a consulta que confirma os ids
+        with self.assertNumQueries(1):
+            self.assertEqual(DEBT_IDS.filter(rows), ([], 3))
+
+    def test_debt_ids_deleted_by_another_process_are_inserted_again(self):
+        self.addCleanup(DEBT_IDS.clear)
+        rows = [tuple(line.split(',')) for line in billing_lines(3)]
+        with self.captureOnCommitCallbacks(execute=True):
+            load_billings(DEBT_IDS.filter(rows)[0], self.file.id)
+        # outro processo apaga as cobranças, sem acesso ao cache deste processo
+        Billing.objects.all().delete()
+        self.assertEqual(DEBT_IDS.filter(rows), (rows, 0))
+        self.assertEqual(load_billings(rows, self.file.id), (3, 0))
+
+    def test_warm_up_is_kept_when_the_batch_rolls_back(self):
+        rows = [tuple(line.split(',')) for line in billing_lines(3)]
+        load_billings(rows, self.file.id)
+        cache = DebtIdCache(size=10)
+        with self.assertRaises(ValueError), transaction.atomic():
+            cache.filter(rows)
+            raise ValueError
+        # o cache não é aquecido de novo: o reenvio faz apenas a consulta que confirma os ids
+        with self.assertNumQueries(1):
+            self.assertEqual(cache.filter(rows), ([], 3))
+
+    def test_duplicated_rows_are_recorded_on_the_job(self):
+        process_csv_content(self.path, self.file.id)
+        job = ProcessingJob.objects.create(file=self.file)
+        process_csv_content(self.path, self.file.id, job=job)
+        job.refresh_from_db()
+        self.assertEqual((job.rows_parsed, job.rows_inserted, job.rows_duplicated), (5, 0, 5))
+
+
+    def test_explain_queries_use_billing_indexes(self):
+        process_csv_content(self.path, self.file.id)
+        out = io.StringIO()
+        call_command('explain_queries', file=self.file.id, stdout=out)
+        # nenhuma das consultas percorre a tabela inteira
+        self.assertIn('billing_file_status_idx', out.getvalue())
+        self.assertNotIn('SCAN core_billing', out.getvalue())
+
+class BillingQueryTests(TestCase):
+
+    def setUp(self) -> None:
+        self.file = File.objects.create(file="test.csv")
+        self.other = File.objects.create(file="other.csv")
+        lines = [f'Name {i},{i},user{i}@example.com,{i}.50,2024-01-{i + 1:02d},00000000-0000-0000-0000-{i:012d}'
+                 for i in range(5)]
+        load_billings([tuple(line.split(',')) for line in lines], self.file.id)
+        load_billings([tuple(line.split(',')) for line in billing_lines(2, start=10)], self.other.id)
+
+    def walk(self, url: str) -> list:
+        rows = []
+        while url:
+            data = self.client.get(url).json()['data']
+            rows += data['results']
+            url = data['next']
+        return rows
+
+    def test_billings_are_paginated_by_cursor(self):
+        rows = self.walk(f'/api/billings/?file={self.file.id}&page_size=2')
+        self.assertEqual([row['name'] for row in rows], [f'Name {i}' for i in range(5)])
+        self.assertEqual(rows[1], {
+            'id': rows[1]['id'], 'file': self.file.id, 'name': 'Name 1', 'government_id': '1',
+            'email': 'user1@example.com', 'debt_amount': '1.50', 'debt_due_date': '2024-01-02',
+            'debt_id': '00000000-0000-0000-0000-000000000001', 'status': 'PE'})
+        self.assertEqual(len(self.walk('/api/billings/?page_size=3')), 7)
+
+    def test_billings_filters(self):
+        rows = self.walk(f'/api/files/{self.file.id}/billings/?due_date_from=2024-01-02&due_date_to=2024-01-03')
+        self.assertEqual([row['name'] for row in rows], ['Name 1', 'Name 2'])
+        Billing.objects.filter(name='Name 4').update(status=Billing.Status.FAILED)
+        rows = self.walk('/api/billings/?status=FA')
+        self.assertEqual([row['name'] for row in rows], ['Name 4'])
+        self.assertEqual(self.client.get('/api/billings/?status=XX').status_code, 400)
+        self.assertEqual(self.client.get('/api/billings/?due_date_from=2024-02-01&due_date_to=2024-01-01')
+                         .status_code, 400)
+        self.assertEqual(self.client.get('/api/files/999/billings/').status_code, 404)
+
+    def test_summary_is_maintained_per_batch(self):
+        summary = self.client.get(f'/api/files/{self.file.id}/summary/').json()['data']
+        self.assertEqual(summary['count'], 5)
+        self.assertEqual(summary['debt_amount'], '12.50')
+        self.assertEqual((summary['first_due_date'], summary['last_due_date']), ('2024-01-01', '2024-01-05'))
+        self.assertEqual(summary['by_status']['PE'], {'count': 5, 'debt_amount': '12.50'})
+        # O resumo é uma única linha, sem agregar as cobranças.
+        with self.assertNumQueries(1):
+            billing_summary(self.file.id)
+        failing = uuid.UUID('00000000-0000-0000-0000-000000000004')
+        send_notification_and_create_pdf(self.file.id, dispatcher=BillingDispatcher(
+            pdf_client=FlakyPDFClient({failing}), notification_client=CountingClient(), max_workers=1))
+        summary = self.client.get(f'/api/files/{self.file.id}/summary/').json()['data']
+        self.assertEqual(summary['by_status']['NS'], {'count': 4, 'debt_amount': '8.00'})
+        self.assertEqual(summary['by_status']['FA'], {'count': 1, 'debt_amount': '4.50'})
+        self.assertEqual(summary['by_status']['PE'], {'count': 0, 'debt_amount': '0.00'})
+        self.assertEqual(self.client.get('/api/files/999/summary/').status_code, 404)
+
+    def test_dispatch_and_retry_build_a_missing_summary(self):
+        # arquivo processado antes da tabela de resumos existir
+        FileSummary.objects.all().delete()
+        failing = uuid.UUID('00000000-0000-0000-0000-000000000004')
+        send_notification_and_create_pdf(self.file.id, dispatcher=BillingDispatcher(
+            pdf_client=FlakyPDFClient({failing}), notification_client=CountingClient(), max_workers=1))
+        summary = FileSummary.objects.get(file=self.file)
+        self.assertEqual((summary.count, summary.pending_count, summary.notification_sent_count,
+                          summary.failed_count), (5, 0, 4, 1))
+        FileSummary.objects.all().delete()
+        client = CountingClient()
+        retry_failed_billings(self.file.id, dispatcher=BillingDispatcher(
+            pdf_client=client, notification_client=client, max_workers=1))
+        summary = FileSummary.objects.get(file=self.file)
+        self.assertEqual((summary.notification_sent_count, summary.failed_count), (5, 0))
+        self.assertEqual(summary.notification_sent_amount, Decimal('12.50'))
+
+    @override_settings(BILLING_BATCH_SIZE=2)
+    def test_export_csv(self):
+        response = self.client.get(f'/api/files/{self.file.id}/export/')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'name,governmentId,email,debtAmount,debtDueDate,debtId,status')
+        self.assertEqual(lines[1], 'Name 0,0,user0@example.com,0.50,2024-01-01,00000000-0000-0000-0000-000000000000,PE')
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(self.client.get(f'/api/files/{self.file.id}/export/?format=xml').status_code, 400)
+        self.assertEqual(self.client.get('/api/files/999/export/').status_code, 404)
+
+    def test_export_ndjson_gzip(self):
+        response = self.client.get(f'/api/files/{self.file.id}/export/?format=ndjson', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(json.loads(lines[4]), {
+            'name': 'Name 4', 'governmentId': '4', 'email': 'user4@example.com', 'debtAmount': '4.50',
+            'debtDueDate': '2024-01-05', 'debtId': '00000000-0000-0000-0000-000000000004', 'status': 'PE'})
+
+    async def test_export_under_asgi(self):
+        response = await AsyncClient().get(f'/api/files/{self.file.id}/export/')
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(content.decode().splitlines()), 6)
+
+    def test_rebuild_file_summaries(self):
+        expected = FileSummarySerializer(billing_summary(self.file.id)).data
+        FileSummary.objects.all().delete()
+        # Sem resumo gravado os totais são calculados a partir das cobranças.
+        self.assertEqual(FileSummarySerializer(billing_summary(self.file.id)).data, expected)
+        call_command('rebuild_file_summaries', '--missing', stdout=io.StringIO())
+        self.assertEqual(FileSummary.objects.count(), 2)
+        self.assertEqual(FileSummarySerializer(FileSummary.objects.get(file=self.file)).data, expected)
+
+
+@override_settings(FILE_PROCESSING_EAGER=True)
+class ProcessingJobTests(TestCase):
+
+    def setUp(self) -> None:
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+    def tearDown(self) -> None:
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def upload(self, lines: list, name: str = 'input.csv'):
+        content = (CSV_HEADER + ''.join(f'{line}\n' for line in lines)).encode()
+        return self.client.post('/api/files/', {'file': SimpleUploadedFile(name, content)})
+
+    def test_upload_returns_accepted_job(self):
+        response = self.upload(billing_lines(3))
+        self.assertEqual(response.status_code, 202)
+        data = response.json()['data']
+        self.assertEqual(data['state'], ProcessingJob.State.DONE)
+        self.assertEqual(data['rows_parsed'], 3)
+        self.assertEqual(data['rows_notified'], 3)
+
+    def test_retrieve_job_status(self):
+        file_id = self.upload(billing_lines(2)).json()['data']['file']
+        response = self.client.get(f'/api/files/{file_id}/')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']
+        self.assertEqual(data['state'], ProcessingJob.State.DONE)
+        self.assertEqual(data['rows_inserted'], 2)
+        self.assertIn('notify_seconds', data)
+
+    def test_retrieve_unknown_file(self):
+        self.assertEqual(self.client.get('/api/files/999/').status_code, 404)
+
+    def test_identical_upload_returns_existing_job(self):
+        first = self.upload(billing_lines(2)).json()['data']
+        response = self.upload(billing_lines(2))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['id'], first['id'])
+        self.assertEqual(File.objects.count(), 1)
+        content = (CSV_HEADER + ''.join(f'{line}\n' for line in billing_lines(2))).encode()
+        self.assertEqual(File.objects.get().content_hash, hashlib.sha256(content).hexdigest())
+
+    def test_content_hash_is_computed_during_upload(self):
+        with mock.patch('core.views.compute_content_hash') as fallback:
+            self.assertEqual(self.upload(billing_lines(1)).status_code, 202)
+        fallback.assert_not_called()
+
+    def test_identical_upload_attaches_to_running_job(self):
+        with override_settings(FILE_PROCESSING_EAGER=False), self.captureOnCommitCallbacks():
+            with mock.patch('core.jobs.get_executor'):
+                first = self.upload(billing_lines(2)).json()['data']
+        response = self.upload(billing_lines(2))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['data']['id'], first['id'])
+        self.assertEqual(ProcessingJob.objects.count(), 1)
+
+    def test_failed_upload_is_processed_again(self):
+        first = self.upload(billing_lines(2)).json()['data']
+        ProcessingJob.objects.filter(id=first['id']).update(state=ProcessingJob.State.FAILED)
+        response = self.upload(billing_lines(2))
+        self.assertEqual(response.status_code, 202)
+        self.assertNotEqual(response.json()['data']['id'], first['id'])
+
+    def test_rows_are_loaded_during_upload(self):
+        with override_settings(FILE_PROCESSING_EAGER=False, BILLING_BATCH_SIZE=2), self.captureOnCommitCallbacks():
+            with mock.patch('core.jobs.get_executor'):
+                response = self.upload(billing_lines(5) + ['Bad,1,bad,1.00,2024-01-19,invalid'])
+        self.assertEqual(response.status_code, 202)
+        job = ProcessingJob.objects.get(id=response.json()['data']['id'])
+        # a leitura já aconteceu durante o upload, o job só precisa enviar as notificações
+        self.assertEqual(job.state, ProcessingJob.State.QUEUED)
+        self.assertEqual(job.stage, ProcessingJob.Stage.NOTIFICATION)
+        self.assertEqual((job.rows_parsed, job.rows_inserted, job.rows_rejected), (6, 5, 1))
+        self.assertEqual(Billing.objects.filter(file_id=job.file_id).count(), 5)
+        self.assertTrue(os.path.exists(job.file.file.path))
+
+    @override_settings(FILE_UPLOAD_STREAMING_INGEST=False)
+    def test_upload_without_streaming_ingest(self):
+        response = self.upload(billing_lines(3))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['data']['rows_inserted'], 3)
+
+    def test_compressed_upload(self):
+        content = (CSV_HEADER + ''.join(f'{line}\n' for line in billing_lines(5))).encode()
+        # o mtime do gzip muda o hash do arquivo, então o segundo envio não é tratado como repetido
+        for streaming in (True, False):
+            with override_settings(FILE_UPLOAD_STREAMING_INGEST=streaming, BILLING_BATCH_SIZE=2):
+                response = self.client.post('/api/files/', {
+                    'file': SimpleUploadedFile('input.csv.gz', gzip.compress(content, mtime=streaming))})
+            self.assertEqual(response.status_code, 202)
+            job = ProcessingJob.objects.get(id=response.json()['data']['id'])
+            self.assertEqual((job.state, job.rows_parsed), (ProcessingJob.State.DONE, 5))
+            # o arquivo é gravado comprimido
+            self.assertTrue(job.file.file.name.endswith('.csv.gz'))
+            with open(job.file.file.path, 'rb') as f:
+                self.assertEqual(gzip.decompress(f.read()), content)
+        self.assertEqual(Billing.objects.count(), 5)
+
+    def test_truncated_compressed_upload_fails(self):
+        content = gzip.compress((CSV_HEADER + ''.join(f'{line}\n' for line in billing_lines(5))).encode())
+        response = self.client.post('/api/files/', {'file': SimpleUploadedFile('input.csv.gz', content[:-10])})
+        job = ProcessingJob.objects.get(id=response.json()['data']['id'])
+        self.assertEqual(job.state, ProcessingJob.State.FAILED)
+
+    def test_non_utf8_upload_fails_without_leaving_a_placeholder(self):
+        content = (CSV_HEADER + 'José,1,jose@example.com,1.00,2024-01-19,00000000-0000-0000-0000-000000000001\n')
+        response = self.client.post('/api/files/', {'file': SimpleUploadedFile('input.csv', content.encode('latin-1'))})
+        self.assertEqual(response.status_code, 202)
+        job = ProcessingJob.objects.get(id=response.json()['data']['id'])
+        # a leitura durante o upload é abandonada e o job registra o erro ao ler o arquivo gravado
+        self.assertEqual(job.state, ProcessingJob.State.FAILED)
+        self.assertIn('utf-8', job.error)
+        self.assertNotEqual(job.file.file.name, '')
+        self.assertEqual(ProcessingJob.objects.count(), 1)
+        self.assertFalse(File.objects.filter(file='').exists())
+
+    def test_identical_streaming_upload_discards_new_file(self):
+        first = self.upload(billing_lines(2)).json()['data']
+        self.assertEqual(self.upload(billing_lines(2)).status_code, 200)
+        self.assertEqual(File.objects.count(), 1)
+        self.assertEqual(Billing.objects.filter(file_id=first['file']).count(), 2)
+
+    def test_declared_hash_skips_reading_a_repeated_upload(self):
+        self.upload(billing_lines(3))
+        content = (CSV_HEADER + ''.join(f'{line}\n' for line in billing_lines(3))).encode()
+        with mock.patch('core.uploads.load_batch') as load:
+            response = self.client.post('/api/files/', {'file': SimpleUploadedFile('input.csv', content)},
+                                        HTTP_X_CONTENT_SHA256=hashlib.sha256(content).hexdigest())
+        self.assertEqual(response.status_code, 200)
+        load.assert_not_called()
+        self.assertEqual(File.objects.count(), 1)
+
+    def test_rows_moved_to_an_ingesting_job_are_counted(self):
+        target = File.objects.create(file='target.csv')
+        job = ProcessingJob.objects.create(file=target, state=ProcessingJob.State.RUNNING, rows_parsed=5,
+                                           rows_inserted=3, rows_duplicated=2)
+        load_billings([tuple(line.split(',')) for line in billing_lines(3)], target.id)
+        placeholder = File.objects.create(file='')
+        load_billings([tuple(line.split(',')) for line in billing_lines(2, start=3)], placeholder.id)
+        discard_upload(placeholder, target.id)
+        job.refresh_from_db()
+        self.assertEqual((job.rows_inserted, job.rows_duplicated), (5, 0))
+
+    def test_upload_invalid_extension(self):
+        self.assertEqual(self.upload(billing_lines(1), name='input.txt').status_code, 400)
+
+    def test_metrics_endpoint(self):
+        self.upload(billing_lines(3))
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertRegex(body, r'fileapi_uploads_total\{status="202"\} [1-9]')
+        for stage in ('upload', 'parse', 'insert', 'pdf', 'notification'):
+            self.assertIn(f'fileapi_stage_seconds_count{{stage="{stage}"}}', body)
+        self.assertIn('fileapi_jobs_in_flight 0', body)
+
+    async def test_async_upload_endpoint(self):
+        content = (CSV_HEADER + ''.join(f'{line}\n' for line in billing_lines(3))).encode()
+        response = await AsyncClient().post('/api/async/files/', {'file': SimpleUploadedFile('input.csv', content)})
+        self.assertEqual(response.status_code, 202)
+        data = response.json()['data']
+        self.assertEqual(data['state'], ProcessingJob.State.DONE)
+        self.assertEqual(data['rows_inserted'], 3)
+        self.assertEqual((await AsyncClient().get('/api/async/files/')).status_code, 405)
+
+    @override_settings(FILE_PROCESSING_EAGER=False)
+    def test_queued_jobs_are_claimed_from_database(self):
+        path = os.path.join(self.media_root, 'queued.csv')
+        shutil.move(write_csv(billing_lines(2)), path)
+        job = ProcessingJob.objects.create(file=File.objects.create(file=path))
+        self.assertEqual(run_queued_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.state, ProcessingJob.State.DONE)
+        # um job já processado não pode ser reivindicado novamente
+        self.assertFalse(claim_job(job.id))
+
+
+class CountingClient(CreatePDFBillingClient, SendNotificationBillingClient):
+    """Cliente falso que registra quantas vezes foi chamado."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def create_pdf_file(self, billing) -> bool:
+        self.calls += 1
+        return True
+
+    def send_notification(self, billing) -> bool:
+        self.calls += 1
+        return True
+
+
+class LoggingTests(TestCase):
+
+    def test_async_logging_writes_through_queue(self):
+        stream = io.StringIO()
+        logger = logging.getLogger('async_test')
+        logger.addHandler(logging.StreamHandler(stream))
+        logger.setLevel(logging.INFO)
+        listeners = start_async_logging(['async_test'])
+        self.assertIsInstance(logger.handlers[0], QueueHandler)
+        logger.info('linha %d', 1)
+        stop_async_logging()
+        self.assertEqual(stream.getvalue(), 'linha 1\n')
+        self.assertIsInstance(logger.handlers[0], logging.StreamHandler)
+        logger.handlers.clear()
+        # os loggers do settings voltam a ser assíncronos para os demais testes
+        start_async_logging([name for name in listeners if name != 'async_test'])
+
+    def test_metrics_text_format(self):
+        registry = Registry()
+        counter = registry.register(Counter('test_total', 'Contador.', ('stage',)))
+        histogram = registry.register(Histogram('test_seconds', 'Latência.', buckets=(0.1, 1.0)))
+        counter.inc(2, stage='parse')
+        histogram.observe(0.1)
+        histogram.observe(5)
+        self.assertEqual(registry.render(), '\n'.join([
+            '# HELP test_total Contador.', '# TYPE test_total counter', 'test_total{stage="parse"} 2',
+            '# HELP test_seconds Latência.', '# TYPE test_seconds histogram', 'test_seconds_bucket{le="0.1"} 1',
+            'test_seconds_bucket{le="1.0"} 1', 'test_seconds_bucket{le="+Inf"} 2', 'test_seconds_sum 5.1',
+            'test_seconds_count 2']) + '\n')
+        with self.assertRaises(ValueError):
+            counter.inc(stage='parse', result='valid')
+
+    def test_log_debug_without_exception(self):
+        with self.assertLogs('debug', level='ERROR') as logs:
+            log_debug('mensagem %s', 'simples')
+        self.assertEqual(logs.records[0].getMessage(), 'mensagem simples')
+        self.assertFalse(logs.records[0].exc_info)
+
+    def test_log_debug_with_exception(self):
+        with self.assertLogs('debug', level='ERROR') as logs:
+            try:
+                raise ValueError('falha')
+            except ValueError:
+                log_debug('erro ao processar')
+        self.assertEqual(logs.records[0].exc_info[0], ValueError)
+
+    def test_rows_are_summarized_per_batch(self):
+        with self.assertLogs('processing', level='INFO') as logs:
+            BillingDispatcher(max_workers=1, pdf_batch_size=5, notification_batch_size=5).dispatch(
+                [Billing(debt_id=uuid.uuid4()) for _ in range(10)])
+        self.assertEqual(len([line for line in logs.output if 'Lote de 5 cobranças' in line]), 2)
+        self.assertFalse(any('for billing' in line for line in logs.output))
+
+
+class ConnectionPoolTests(TestCase):
+
+    def test_opened_connections_are_counted(self):
+        before = DB_CONNECTIONS_OPENED.values.get(('default',), 0)
+        connection_created.send(sender=connection.__class__, connection=connection)
+        self.assertEqual(DB_CONNECTIONS_OPENED.values[('default',)], before + 1)
+
+    def test_pool_wait_and_timeout_are_recorded(self):
+        # Nenhum servidor escuta na porta 1: a retirada espera o timeout do pool.
+        pool = get_pool('pool_test', {'host': '127.0.0.1', 'port': 1, 'dbname': 'test', 'connect_timeout': 1},
+                        {'min_size': 0, 'max_size': 1, 'timeout': 0.2})
+        try:
+            with self.assertLogs('psycopg.pool', level='WARNING'), self.assertRaises(PoolTimeout):
+                checkout(pool, 'pool_test')
+        finally:
+            close_pools()
+        self.assertEqual(DB_POOL_TIMEOUTS.values[('pool_test',)], 1)
+        counts, seconds = DB_POOL_WAIT_SECONDS.values[('pool_test',)]
+        self.assertEqual(sum(counts), 1)
+        self.assertGreaterEqual(seconds, 0.2)
+
+
+class ParserTests(TestCase):
+
+    def test_parser_maps_header_once(self):
+        parser = BillingRowParser(['debtId', 'name', 'governmentId', 'email', 'debtAmount', 'debtDueDate'])
+        row = parser.parse(['123e4567-e89b-12d3-a456-426614174000', 'Test', '1', 'a@b.com', '10.5', '2021-01-01'])
+        self.assertEqual(row[0], 'Test')
+        self.assertEqual(row[3], Decimal('10.5'))
+        self.assertEqual(row[4], date(2021, 1, 1))
+        self.assertEqual(row[5], uuid.UUID('123e4567-e89b-12d3-a456-426614174000'))
+
+    def test_parser_missing_columns(self):
+        with self.assertRaises(ValueError):
+            BillingRowParser(['name', 'email'])
+
+    def test_invalid_rows_are_reported_with_line_numbers(self):
+        lines = billing_lines(2)
+        lines.insert(1, 'Bad,1,bad@example.com,abc,2024-01-19,00000000-0000-0000-0000-000000000099')
+        lines.append('Bad,1,bad@example.com,1.00,2024-13-40,00000000-0000-0000-0000-000000000098')
+        lines.append('Bad,1,bad@example.com,1.001,2024-01-19,not-a-uuid')
+        path = write_csv(lines)
+        report = ParseReport()
+        rows = list(read_billing_rows(path, report))
+        os.remove(path)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(report.rows, 5)
+        self.assertEqual(report.rejected, 3)
+        self.assertEqual([error.line for error in report.errors], [3, 5, 6])
+        self.assertIn('debtAmount', report.errors[0].message)
+        self.assertGreater(report.rows_per_second, 0)
+
+    def test_invalid_rows_do_not_stop_the_file(self):
+        file = File.objects.create(file="test.csv")
+        path = write_csv(billing_lines(3) + ['Bad,1,bad@example.com,1.00,2024-01-19,'])
+        stats = process_csv_content(path, file.id, batch_size=2)
+        os.remove(path)
+        self.assertEqual(stats['inserted'], 3)
+        self.assertEqual(stats['rejected'], 1)
+        self.assertEqual(stats['errors'][0]['line'], 5)
+        self.assertEqual(Billing.objects.count(), 3)
+
+
+class BenchmarkTests(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_synthetic_file_is_deterministic(self):
+        paths = [os.path.join(self.directory, f'{i}.csv') for i in range(2)]
+        results = [generate_billing_csv(path, 1000, duplicate_ratio=0.1, invalid_ratio=0.05, seed=7)
+                   for path in paths]
+        self.assertEqual(results[0], results[1])
+        with open(paths[0], 'rb') as first, open(paths[1], 'rb') as second:
+            self.assertEqual(first.read(), second.read())
+        report = ParseReport()
+        rows = list(read_billing_rows(paths[0], report))
+        self.assertEqual(report.rejected, results[0]['invalid'])
+        self.assertEqual(len(rows), 1000 - results[0]['invalid'])
+
+    def test_benchmark_command(self):
+        output = os.path.join(self.directory, 'results.json')
+        call_command('benchmark', rows=[200], compression=['none', 'zstd'], output=output, stdout=io.StringIO(),
+                     stderr=io.StringIO())
+        with open(output) as f:
+            results = json.load(f)
+        raw, compressed = results['files']
+        self.assertLess(compressed['input']['bytes'], raw['input']['bytes'])
+        self.assertEqual(compressed['stages']['parse']['valid'], raw['stages']['parse']['valid'])
+        stages = raw['stages']
+        self.assertEqual(set(stages), {'parse', 'insert', 'dispatch', 'full'})
+        self.assertEqual(stages['insert']['inserted'] + stages['insert']['skipped'] + stages['insert']['rejected'],
+                         200)
+        self.assertTrue(stages['full']['within_target'])
+        self.assertGreater(stages['full']['peak_rss_kb']['self'], 0)
+        # as cobranças gravadas pelo benchmark são removidas
+        self.assertFalse(Billing.objects.exists())
+
+class MappedReaderTests(TestCase):
+
+    def setUp(self) -> None:
+        fd, self.path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'\xef\xbb\xbfa,b\r\n1,2\r\n"x\ny",3\n\n"q""uote",4\n5,6')
+
+    def tearDown(self) -> None:
+        os.remove(self.path)
+
+    def test_records(self):
+        with MappedCSVFile(self.path) as reader:
+            records = list(reader.records())
+        self.assertEqual(records, [(1, ['a', 'b']), (2, ['1', '2']), (4, ['x\ny', '3']), (5, []),
+                                   (6, ['q"uote', '4']), (7, ['5', '6'])])
+
+    def test_resume_from_offset(self):
+        with MappedCSVFile(self.path) as reader:
+            records = reader.records()
+            next(records)
+            next(records)
+            offset, line = reader.offset, reader.line
+        with MappedCSVFile(self.path) as reader:
+            self.assertEqual(next(reader.records(offset, first_line=line)), (4, ['x\ny', '3']))
+
+    def test_quoted_records_share_a_csv_reader(self):
+        with mock.patch('core.readers.csv.reader', wraps=csv.reader) as reader_class, \
+                MappedCSVFile(self.path) as reader:
+            records = list(reader.records())
+        # os registros com aspas e os que vêm depois deles no mesmo bloco passam por um único csv.reader
+        self.assertEqual(reader_class.call_count, 1)
+        self.assertEqual(records[2:], [(4, ['x\ny', '3']), (5, []), (6, ['q"uote', '4']), (7, ['5', '6'])])
+        # blocos pequenos terminam sempre em um limite de registro
+        with mock.patch('core.readers.READ_BLOCK_SIZE', 4), MappedCSVFile(self.path) as reader:
+            self.assertEqual(list(reader.records()), records)
+
+    def test_index(self):
+        with MappedCSVFile(self.path) as reader:
+            offsets = reader.index()
+            self.assertEqual(len(offsets), 6)
+            self.assertEqual(next(reader.records(offsets[4], first_line=5)), (6, ['q"uote', '4']))
+
+    def test_empty_file(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        with MappedCSVFile(path) as reader:
+            self.assertEqual(list(reader.records()), [])
+        os.remove(path)
+
+    def test_compressed_records(self):
+        with open(self.path, 'rb') as f:
+            content = f.read()
+        with MappedCSVFile(self.path) as reader:
+            expected = list(reader.records())
+        for suffix, data in (('.csv.gz', gzip.compress(content)),
+                             ('.csv.zst', zstandard.ZstdCompressor().compress(content))):
+            fd, path = tempfile.mkstemp(suffix=suffix)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            self.addCleanup(os.remove, path)
+            # blocos pequenos para que registros com aspas fiquem divididos entre blocos
+            with mock.patch('core.readers.READ_BLOCK_SIZE', 4), open_csv_file(path) as reader:
+                self.assertEqual(list(reader.records()), expected)
+                records = reader.records(0, first_line=0)
+                next(records)
+                next(records)
+                offset, line = reader.offset, reader.line
+                self.assertEqual(next(reader.records(offset, first_line=line)), (4, ['x\ny', '3']))
+
+
+class ChunkSplitterTests(TestCase):
+
+    def test_records_split_across_chunks(self):
+        splitter = CSVChunkSplitter()
+        self.assertEqual(splitter.feed(b'\xef\xbb'), '')
+        self.assertEqual(splitter.feed(b'\xbfa,b\n1,"x'), 'a,b\n')
+        self.assertEqual(splitter.feed(b'\ny",2\n3,4'), '1,"x\ny",2\n')
+        self.assertEqual(splitter.close(), '3,4')
+
+    def test_decompress_chunks(self):
+        for compression, data in (('gzip', gzip.compress(b'a,b\n') + gzip.compress(b'1,2\n')),
+                                  ('zstd', zstandard.ZstdCompressor().compress(b'a,b\n1,2\n'))):
+            decompressor = ChunkDecompressor(compression)
+            # os arquivos podem ter vários membros gzip, e um pedaço pode terminar no meio de um deles
+            content = b''.join(decompressor.decompress(data[i:i + 3]) for i in range(0, len(data), 3))
+            self.assertEqual(content, b'a,b\n1,2\n')
+            self.assertTrue(decompressor.complete)
+
+
+class ParallelParsingTests(TestCase):
+
+    def setUp(self) -> None:
+        self.file = File.objects.create(file="test.csv")
+        lines = billing_lines(20)
+        # nomes entre aspas com quebras de linha não podem ser usados como limite de faixa
+        for i in range(0, 20, 3):
+            lines[i] = f'"Name\n{i}, Jr",{i},user{i}@example.com,1.00,2024-01-19,00000000-0000-0000-0000-{i:012d}'
+        lines.append('Bad,1,bad@example.com,abc,2024-01-19,00000000-0000-0000-0000-000000000099')
+        self.path = write_csv(lines)
+
+    def tearDown(self) -> None:
+        os.remove(self.path)
+
+    def test_split_csv_file_respects_quoted_newlines(self):
+        report = ParseReport()
+        expected = list(read_billing_rows(self.path, report))
+        for parts in (2, 3, 7, 50):
+            header, ranges = split_csv_file(self.path, parts)
+            self.assertEqual(header[0], 'name')
+            self.assertEqual(ranges[-1][1], os.path.getsize(self.path))
+            rows = []
+            with open(self.path, 'rb') as f:
+                for start, end, first_line in ranges:
+                    f.seek(start)
+                    chunk = f.read(end - start).decode()
+                    rows += list(parse_billing_records(iter_csv_records(io.StringIO(chunk, newline=''), first_line),
+                                                       ParseReport(), header=header))
+            self.assertEqual(rows, expected)
+
+    def test_ingest_ranges(self):
+        header, ranges = split_csv_file(self.path, 4)
+        self.assertGreater(len(ranges), 1)
+        results = [ingest_range(self.path, header, start, end, first_line, self.file.id, 5)
+                   for start, end, first_line in ranges]
+        self.assertEqual(sum(result['inserted'] for result in results), 20)
+        errors = [error for result in results for error in result['errors']]
+        # a linha inválida é a última: cabeçalho + 20 registros, sete deles com uma quebra de linha extra
+        self.assertEqual(errors, [{'line': 29, 'message': "invalid debtAmount 'abc'"}])
+
+    def test_single_worker_falls_back_to_serial(self):
+        stats = process_csv_content_parallel(self.path, self.file.id, workers=1)
+        self.assertEqual(stats['inserted'], 20)
+        self.assertEqual(stats['rejected'], 1)
+
+
+
+class ParallelProcessTests(TransactionTestCase):
+    """Executa a ingestão paralela pelos processos criados com spawn, que só enxergam dados já gravados."""
+
+    def setUp(self) -> None:
+        self.file = File.objects.create(file="test.csv")
+        lines = billing_lines(40)
+        for i in range(0, 40, 3):
+            lines[i] = f'"Name\n{i}, Jr",{i},user{i}@example.com,1.00,2024-01-19,00000000-0000-0000-0000-{i:012d}'
+        # uma linha inválida em cada metade do arquivo, para cada processo relatar um erro
+        lines[10] = 'Bad,10,bad@example.com,abc,2024-01-19,00000000-0000-0000-0000-000000000010'
+        lines[35] = 'Bad,35,bad@example.com,xyz,2024-01-19,00000000-0000-0000-0000-000000000035'
+        self.path = write_csv(lines)
+
+    def tearDown(self) -> None:
+        os.remove(self.path)
+
+    def test_workers_insert_ranges_and_merge_errors(self):
+        stats = process_csv_content_parallel(self.path, self.file.id, workers=2, batch_size=5)
+        self.assertEqual((stats['rows'], stats['inserted'], stats['rejected']), (40, 38, 2))
+        self.assertEqual(Billing.objects.filter(file=self.file).count(), 38)
+        # o número da linha conta o cabeçalho e as quebras de linha dos nomes entre aspas antes do registro
+        self.assertEqual(stats['errors'], [{'line': 16, 'message': "invalid debtAmount 'abc'"},
+                                           {'line': 49, 'message': "invalid debtAmount 'xyz'"}])
+
+
+@override_settings(FILE_PROCESSING_EAGER=True)
+class ResumeTests(TestCase):
+
+    def setUp(self) -> None:
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root, BILLING_BATCH_SIZE=2)
+        self.settings_override.enable()
+        path = os.path.join(self.media_root, 'resume.csv')
+        shutil.move(write_csv(billing_lines(5) + ['Bad,1,bad@example.com,x,2024-01-19,zz']), path)
+        self.job = ProcessingJob.objects.create(file=File.objects.create(file=path))
+
+    def tearDown(self) -> None:
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def crash_on_second_batch(self):
+        calls = []
+
+        def load(rows, file_id):
+            calls.append(len(rows))
+            if len(calls) == 2:
+                raise RuntimeError('worker died')
+            return load_billings(rows, file_id)
+        return mock.patch('core.processing.load_billings', side_effect=load)
+
+    def test_resume_from_checkpoint(self):
+        with self.crash_on_second_batch():
+            run_job(self.job.id)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.state, ProcessingJob.State.FAILED)
+        self.assertEqual(self.job.checkpoint_line, 3)
+        self.assertEqual(Billing.objects.count(), 2)
+        self.assertTrue(requeue_job(self.job.id))
+        with mock.patch('core.processing.load_billings', side_effect=load_billings) as load:
+            run_job(self.job.id)
+        # apenas as três linhas depois do checkpoint são lidas e inseridas novamente
+        self.assertEqual(sum(len(call.args[0]) for call in load.call_args_list), 3)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.state, ProcessingJob.State.DONE)
+        self.assertEqual(self.job.rows_parsed, 6)
+        self.assertEqual(self.job.rows_inserted, 5)
+        self.assertEqual(self.job.rows_rejected, 1)
+        self.assertEqual(self.job.rows_notified, 5)
+
+    def test_running_job_is_not_requeued_until_stale(self):
+        claim_job(self.job.id)
+        self.assertFalse(requeue_job(self.job.id))
+        self.assertTrue(requeue_job(self.job.id, stale_after=-1))
+
+    def test_interrupted_upload_is_discarded(self):
+        handler = StreamingCSVUploadHandler(RequestFactory().post('/api/files/'))
+        handler.new_file('file', 'input.csv', 'text/csv', None)
+        content = (CSV_HEADER + ''.join(f'{line}\n' for line in billing_lines(5))).encode()
+        handler.receive_data_chunk(content, 0)
+        self.assertEqual(Billing.objects.filter(file=handler.record).count(), 4)
+        handler.upload_interrupted()
+        # o File provisório, o job e as cobranças já inseridas são removidos
+        self.assertEqual(File.objects.count(), 1)
+        self.assertEqual(ProcessingJob.objects.count(), 1)
+        self.assertEqual(Billing.objects.count(), 0)
+
+    def test_upload_placeholder_is_never_requeued(self):
+        # job provisório de um upload cujo processo morreu antes do fim
+        placeholder = File.objects.create(file='')
+        job = ProcessingJob.objects.create(file=placeholder, state=ProcessingJob.State.RUNNING)
+        self.assertFalse(requeue_job(job.id, stale_after=-1))
+        self.assertNotIn(job.id, requeue_stale_jobs(stale_after=-1))
+
+    def test_resume_endpoint(self):
+        with self.crash_on_second_batch():
+            run_job(self.job.id)
+        response = self.client.post(f'/api/files/{self.job.file_id}/resume/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['data']['state'], ProcessingJob.State.DONE)
+        # um job concluído não pode ser retomado
+        self.assertEqual(self.client.post(f'/api/files/{self.job.file_id}/resume/').status_code, 409)
+
+
+class DispatchTests(TestCase):
+
+    def test_dispatcher_reuses_clients(self):
+        client = CountingClient()
+        dispatcher = BillingDispatcher(max_workers=4, pdf_client=client, notification_client=client)
+        stats = dispatcher.dispatch(range(10))
+        self.assertEqual(client.calls, 20)
+        self.assertEqual(stats['rows'], 10)
+        self.assertEqual(stats['notified'], 10)
+        self.assertGreater(stats['rows_per_second'], 0)
+
+    def test_batch_calls(self):
+        client = SimulatedBillingClient()
+        dispatcher = BillingDispatcher(max_workers=2, pdf_client=client, notification_client=client,
+                                       pdf_batch_size=10, notification_batch_size=10)
+        results = list(dispatcher.map(range(25)))
+        # 3 chamadas de pdf e 3 de notificação em vez de 25 de cada
+        self.assertEqual(client.calls, 6)
+        self.assertEqual(sorted(result.billing for result in results), list(range(25)))
+        self.assertTrue(all(result.notified for result in results))
+
+    def test_batch_calls_are_faster_with_per_call_latency(self):
+        elapsed = []
+        for batch_size in (1, 20):
+            client = SimulatedBillingClient(call_latency=0.005, item_cost=0.0001)
+            dispatcher = BillingDispatcher(max_workers=1, pdf_client=client, notification_client=client,
+                                           pdf_batch_size=batch_size, notification_batch_size=batch_size)
+            elapsed.append(dispatcher.dispatch(range(20))['seconds'])
+        self.assertLess(elapsed[1] * 4, elapsed[0])
+
+    def test_async_dispatcher(self):
+        file = File.objects.create(file="test.csv")
+        path = write_csv(billing_lines(30))
+        process_csv_content(path, file.id)
+        os.remove(path)
+        client = SimulatedBillingClient(call_latency=0.05)
+        dispatcher = AsyncBillingDispatcher(max_workers=10, pdf_client=client, notification_client=client,
+                                            pdf_batch_size=3, notification_batch_size=3)
+        stats = send_notification_and_create_pdf(file.id, dispatcher=dispatcher)
+        self.assertEqual(stats['notified'], 30)
+        self.assertEqual(client.calls, 20)
+        # 10 lotes simultâneos no mesmo event loop: bem menos que 20 chamadas de 50ms em sequência
+        self.assertLess(stats['seconds'], 0.5)
+        self.assertEqual(Billing.objects.filter(status=Billing.Status.NOTIFICATION_SENT).count(), 30)
+
+    def test_async_dispatcher_with_sync_client(self):
+        client = CountingClient()
+        stats = async_to_sync(AsyncBillingDispatcher(pdf_client=client, notification_client=client).adispatch)(
+            range(10))
+        self.assertEqual(stats['notified'], 10)
+        self.assertEqual(client.calls, 20)
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(rate=100)
+        et1 = time.monotonic()
+        for _ in range(6):
+            limiter.acquire()
+        # o primeiro token está disponível de imediato, os outros cinco aguardam 10ms cada
+        self.assertGreaterEqual(time.monotonic() - et1, 0.04)
+
+    def test_send_notification_and_create_pdf(self):
+        file = File.objects.create(file="test.csv")
+        path = write_csv(billing_lines(3))
+        process_csv_content(path, file.id)
+        os.remove(path)
+        stats = send_notification_and_create_pdf(file.id, dispatcher=BillingDispatcher(max_workers=2))
+        self.assertEqual(stats['notified'], 3)
+        self.assertEqual(Billing.objects.filter(status=Billing.Status.NOTIFICATION_SENT).count(), 3)
+
+    def test_failed_rows_are_tracked_and_retried(self):
+        file = File.objects.create(file="test.csv")
+        path = write_csv(billing_lines(4))
+        process_csv_content(path, file.id)
+        os.remove(path)
+        failing_ids = set(Billing.objects.order_by('id').values_list('debt_id', flat=True)[:2])
+        pdf_client = FlakyPDFClient(failing_ids)
+        stats = send_notification_and_create_pdf(file.id, dispatcher=BillingDispatcher(pdf_client=pdf_client))
+        self.assertEqual(stats['failed'], 2)
+        self.assertEqual(Billing.objects.filter(status=Billing.Status.FAILED).count(), 2)
+        self.assertEqual(Billing.objects.filter(status=Billing.Status.NOTIFICATION_SENT).count(), 2)
+        # o reenvio processa apenas as linhas com falha
+        client = CountingClient()
+        stats = retry_failed_billings(file.id, dispatcher=BillingDispatcher(pdf_client=client,
+                                                                            notification_client=client))
+        self.assertEqual(stats['rows'], 2)
+        self.assertEqual(client.calls, 4)
+        self.assertEqual(Billing.objects.filter(status=Billing.Status.NOTIFICATION_SENT).count(), 4)
+
+    def test_failed_notification_keeps_created_pdf(self):
+        file = File.objects.create(file="test.csv")
+        path = write_csv(billing_lines(4))
+        process_csv_content(path, file.id)
+        os.remove(path)
+        failing_ids = set(Billing.objects.order_by('id').values_list('debt_id', flat=True)[:2])
+        dispatcher = BillingDispatcher(pdf_client=CountingClient(),
+                                       notification_client=FlakyNotificationClient(failing_ids))
+        send_notification_and_create_pdf(file.id, dispatcher=dispatcher)
+        self.assertEqual(Billing.objects.filter(status=Billing.Status.INVOICE_CREATED).count(), 2)
+        self.assertEqual(FileSummary.objects.get(file=file).invoice_created_count, 2)
+        # o reenvio manda apenas as notificações, sem criar os pdfs de novo
+        pdf_client, notification_client = CountingClient(), CountingClient()
+        stats = retry_failed_billings(file.id, dispatcher=BillingDispatcher(pdf_client=pdf_client,
+                                                                            notification_client=notification_client))
+        self.assertEqual(stats['rows'], 2)
+        self.assertEqual((pdf_client.calls, notification_client.calls), (0, 2))
+        self.assertEqual(Billing.objects.filter(status=Billing.Status.NOTIFICATION_SENT).count(), 4)
+
+
+    def test_keyset_pages(self):
+        file = File.objects.create(file="test.csv")
+        path = write_csv(billing_lines(5))
+        process_csv_content(path, file.id)
+        os.remove(path)
+        pending = Billing.objects.filter(file=file, status=Billing.Status.PENDING).values_list('id', named=True)
+        seen = []
+        for row in iter_keyset_pages(pending, 2):
+            # mudar o status durante a leitura não faz a próxima página pular linhas
+            Billing.objects.filter(id=row.id).update(status=Billing.Status.NOTIFICATION_SENT)
+            seen.append(row.id)
+        self.assertEqual(seen, sorted(Billing.objects.values_list('id', flat=True)))
+
+    def test_dispatch_reads_only_needed_columns(self):
+        file = File.objects.create(file="test.csv")
+        path = write_csv(billing_lines(3))
+        process_csv_content(path, file.id)
+        os.remove(path)
+        client = CountingClient()
+        with override_settings(BILLING_BATCH_SIZE=2), CaptureQueriesContext(connection) as queries:
+            send_notification_and_create_pdf(file.id, dispatcher=BillingDispatcher(pdf_client=client,
+                                                                                   notification_client=client))
+        self.assertEqual(client.calls, 6)
+        # duas páginas de 2 linhas, sem as colunas que os clientes não usam
+        selects = [query['sql'] for query in queries if query['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 2)
+        self.assertNotIn('created_at', selects[0])
+
+class FlakyPDFClient(CreatePDFBillingClient):
+    """Cliente falso que falha para os debtIds informados."""
+
+    def __init__(self, failing_ids: set):
+        self.failing_ids = failing_ids
+
+    def create_pdf_file(self, billing) -> bool:
+        return billing.debt_id not in self.failing_ids
+
+
+class FlakyNotificationClient(SendNotificationBillingClient):
+    """Cliente falso de notificação que falha para os debtIds informados."""
+
+    def __init__(self, failing_ids: set):
+        self.failing_ids = failing_ids
+
+    def send_notification(self, billing) -> bool:
+        return billing.debt_id not in self.failing_ids
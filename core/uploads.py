@@ -0,0 +1,197 @@
+import hashlib
+import io
+import time
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, TemporaryFileUploadHandler
+from django.utils import timezone
+
+from .models import Billing, File, ProcessingJob
+from .parsers import ParseReport, iter_csv_records, parse_billing_records
+from .processing import load_batch, new_ingestion_stats, reconcile_ingestion_counts, save_ingestion_progress
+from .readers import ChunkDecompressor, CSVChunkSplitter, compression_of, csv_extension
+from .summaries import rebuild_file_summary
+from .utils import log_error, log_info
+
+
+def find_existing_job(content_hash: str) -> ProcessingJob:
+    """Função para encontrar o job de um arquivo idêntico já processado ou em processamento.
+
+    Args:
+        content_hash (str): sha256 do conteúdo do arquivo.
+
+    Returns:
+        ProcessingJob: Job mais recente com o mesmo hash que não falhou, ou None.
+    """
+    if not content_hash:
+        return None
+    return ProcessingJob.objects.filter(file__content_hash=content_hash).exclude(
+        state=ProcessingJob.State.FAILED).order_by('-id').first()
+
+
+def discard_upload(file: File, target_file_id: int = None):
+    """Função para descartar o File criado durante um upload que não será processado.
+
+    As cobranças já inseridas durante o upload são movidas para o arquivo idêntico `target_file_id`, quando existir.
+
+    Args:
+        file (File): Arquivo a ser descartado. Se for None nada é feito.
+        target_file_id (int): ID do arquivo idêntico já existente. Opcional.
+    """
+    if file is None:
+        return
+    rows = Billing.objects.filter(file=file)
+    if target_file_id is not None:
+        rows.update(file_id=target_file_id)
+        rebuild_file_summary(target_file_id)
+        # Se o job do arquivo idêntico ainda estava lendo o csv, ele contou como duplicadas as linhas que este upload
+        #   inseriu primeiro. As contagens são refeitas a partir das cobranças agora ligadas a ele.
+        job = ProcessingJob.objects.filter(file_id=target_file_id).first()
+        if job is not None:
+            reconcile_ingestion_counts(job)
+    else:
+        rows.delete()
+    file.delete()
+
+
+class ContentHashUploadHandler(FileUploadHandler):
+    """Upload handler que calcula o sha256 de cada arquivo enquanto ele é recebido.
+
+    Deve ser o primeiro handler da lista, pois apenas repassa os chunks para os handlers seguintes (que gravam o
+    arquivo). O hash de cada campo fica em `request.upload_content_hashes`.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not hasattr(self.request, 'upload_content_hashes'):
+            self.request.upload_content_hashes = {}
+        self.request.upload_content_hashes[self.field_name] = self.hasher.hexdigest()
+        # Retornar None deixa o próximo handler devolver o arquivo.
+        return None
+
+
+class StreamingCSVUploadHandler(TemporaryFileUploadHandler):
+    """Upload handler que grava o arquivo em disco e, ao mesmo tempo, faz o parse e insere as cobranças no banco.
+
+    Os registros completos de cada chunk recebido são validados e inseridos em lotes, então a leitura da rede, a
+    escrita em disco e a inserção no banco acontecem juntas e o arquivo não precisa ser lido de novo depois do
+    upload. Arquivos .csv.gz e .csv.zst são gravados comprimidos e descomprimidos chunk a chunk antes do parse. O
+    File e o job são criados no início do upload e ficam em `self.record` e `self.job`. Se algo falhar durante o
+    parse, o handler continua apenas gravando o arquivo e `self.failed` indica que a leitura deve ser refeita pelo
+    pipeline normal.
+
+    O hash do conteúdo só é conhecido no fim do upload, então um arquivo repetido é lido e inserido (com todas as
+    linhas descartadas como duplicadas) antes de a resposta apontar para o job existente. Quando o cliente informa o
+    sha256 do arquivo no cabeçalho `X-Content-SHA256` e ele pertence a um arquivo já recebido, o upload não é lido;
+    o hash calculado no fim do upload continua sendo o que decide se o arquivo é repetido.
+    """
+
+    field_name_to_stream = 'file'
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.record = None
+        self.job = None
+        self.failed = False
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        if field_name != self.field_name_to_stream or csv_extension(file_name) is None or self.record is not None:
+            return
+        if find_existing_job(self.request.headers.get('X-Content-SHA256', '').lower()) is not None:
+            log_info('Upload de um arquivo já recebido (%s), o csv não será lido', file_name)
+            return
+        compression = compression_of(file_name)
+        self.decompressor = ChunkDecompressor(compression) if compression else None
+        self.record = File.objects.create(file='')
+        self.job = ProcessingJob.objects.create(file=self.record, state=ProcessingJob.State.RUNNING,
+                                                stage=ProcessingJob.Stage.INGESTION, started_at=timezone.now())
+        self.splitter = CSVChunkSplitter()
+        self.report = ParseReport()
+        self.stats = new_ingestion_stats()
+        self.header = None
+        self.lines = 0
+        self.pending = []
+
+    def receive_data_chunk(self, raw_data, start):
+        super().receive_data_chunk(raw_data, start)
+        if self.streaming:
+            self._ingest(self._decompress(raw_data))
+        return None
+
+    def file_complete(self, file_size):
+        if self.streaming and self.decompressor is not None and not self.decompressor.complete:
+            # Arquivo comprimido truncado: a leitura é refeita pelo job, que registra o erro.
+            log_error('Arquivo %d comprimido incompleto', self.record.id)
+            self.failed = True
+        if self.streaming:
+            text = self._close()
+            if self.streaming:
+                self._ingest(text, final=True)
+        if self.job is not None and not self.failed:
+            save_ingestion_progress(self.job, self.stats)
+            log_info('Arquivo %d lido durante o upload: %d linhas, %d inseridas, %d rejeitadas', self.record.id,
+                     self.stats['rows'], self.stats['inserted'], self.stats['rejected'])
+        return super().file_complete(file_size)
+
+    def upload_interrupted(self):
+        # O File provisório não tem arquivo em disco e não pode ser reprocessado, então ele, o job e as cobranças já
+        #   inseridas são descartados.
+        if self.record is not None:
+            log_info('Upload do arquivo %d interrompido, descartando %d linhas inseridas', self.record.id,
+                     self.stats['inserted'])
+            discard_upload(self.record)
+            self.record = self.job = None
+        super().upload_interrupted()
+
+    @property
+    def streaming(self) -> bool:
+        return self.job is not None and not self.failed and self.field_name == self.field_name_to_stream
+
+    def _decompress(self, raw_data: bytes) -> str:
+        # Erros de descompressão e de decodificação (arquivo que não está em utf-8) só interrompem a leitura durante
+        #   o upload; o arquivo continua sendo gravado e o job registra o erro ao lê-lo de novo.
+        try:
+            if self.decompressor is not None:
+                raw_data = self.decompressor.decompress(raw_data)
+            return self.splitter.feed(raw_data)
+        except Exception as e:
+            log_error('Erro ao decodificar o arquivo %d durante o upload: %s', self.record.id, e)
+            self.failed = True
+            return ''
+
+    def _close(self) -> str:
+        try:
+            return self.splitter.close()
+        except Exception as e:
+            log_error('Erro ao decodificar o arquivo %d durante o upload: %s', self.record.id, e)
+            self.failed = True
+            return ''
+
+    def _ingest(self, text: str, final: bool = False):
+        et1 = time.time()
+        try:
+            records = iter_csv_records(io.StringIO(text, newline=''), self.lines)
+            self.lines += text.count('\n')
+            if self.header is None:
+                first = next(records, None)
+                if first is None:
+                    return
+                self.header = first[1]
+            self.pending.extend(parse_billing_records(records, self.report, header=self.header))
+            while len(self.pending) >= settings.BILLING_BATCH_SIZE or (final and self.pending):
+                batch = self.pending[:settings.BILLING_BATCH_SIZE]
+                del self.pending[:settings.BILLING_BATCH_SIZE]
+                load_batch(batch, self.record.id, self.stats, self.report, self.job, parse_seconds=time.time() - et1)
+                et1 = time.time()
+            self.stats['parse_seconds'] += time.time() - et1
+        except Exception as e:
+            log_error('Erro ao ler o arquivo %d durante o upload: %s', self.record.id, e)
+            self.failed = True
@@ -1,11 +1,15 @@
 from rest_framework import routers
 from django.urls import path, include
-from .views import FileViewSet
+from .views import BillingViewSet, FileViewSet, export_file, metrics, upload_file
 
 
 router = routers.DefaultRouter()
 router.register(r'files', FileViewSet, basename='files')
+router.register(r'billings', BillingViewSet, basename='billings')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('metrics/', metrics, name='metrics'),
+    path('async/files/', upload_file, name='async-upload'),
+    path('files/<int:file_id>/export/', export_file, name='export'),
 ]
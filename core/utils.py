@@ -1,12 +1,22 @@
+import asyncio
 import os
 import csv
-from typing import Generator
+import hashlib
+import io
+from itertools import islice
+from typing import Generator, Iterable
 import uuid
 import logging
+import sys
+import threading
+import time
 
+from django.conf import settings
 from django.db import models
 from django.core.exceptions import ValidationError
 
+from .readers import csv_extension, open_csv_stream
+
 
 def get_unique_file_path(instance, filename):
     """Função para definir o caminho único do arquivo usando uuid.
@@ -19,8 +29,9 @@ def get_unique_file_path(instance, filename):
         str: Caminho do arquivo.
     """
     # ref: https://stackoverflow.com/questions/2673647/enforce-unique-upload-file-names-using-django
-    ext = filename.split('.')[-1]
-    filename = f'{uuid.uuid4()}.{ext}'
+    # Extensões duplas (.csv.gz) são mantidas, pois a leitura descobre a compressão pelo nome.
+    ext = csv_extension(filename) or f'.{filename.split(".")[-1]}'
+    filename = f'{uuid.uuid4()}{ext}'
     return os.path.join('files', filename)
 
 
@@ -31,12 +42,28 @@ def validate_file_extension(value):
         value (File): Arquivo a ser validado.
     
     Raises:
-        ValidationError: Caso a extensão do arquivo não seja .csv.
+        ValidationError: Caso a extensão do arquivo não seja .csv, .csv.gz ou .csv.zst.
     """
-    if not value.name.endswith('.csv'):
-        raise ValidationError('Invalid file extension. Only .csv files are allowed.')
+    if csv_extension(value.name) is None:
+        raise ValidationError('Invalid file extension. Only .csv, .csv.gz and .csv.zst files are allowed.')
+    
+    
+def compute_content_hash(file) -> str:
+    """Função para calcular o sha256 do conteúdo de um arquivo, lendo em chunks.
     
+    Args:
+        file (UploadedFile): Arquivo a ser lido.
     
+    Returns:
+        str: Hash em hexadecimal.
+    """
+    hasher = hashlib.sha256()
+    for chunk in file.chunks():
+        hasher.update(chunk)
+    file.seek(0)
+    return hasher.hexdigest()
+
+
 def create_default_api_response(status: int, message: str, data: dict = None):
     """Função para criar uma resposta padrão para a API.
     
@@ -55,50 +82,78 @@ def create_default_api_response(status: int, message: str, data: dict = None):
     }
     
     
-# Métodos para logar em cada um dos loggers criados no settings.py
-def log_debug(message: str):
+# Métodos para logar em cada um dos loggers criados no settings.py. Os loggers são obtidos uma única vez e as
+#   mensagens usam formatação % preguiçosa: os argumentos só são formatados se o nível estiver habilitado.
+_debug_logger = logging.getLogger('debug')
+_error_logger = logging.getLogger('django')
+_processing_logger = logging.getLogger('processing')
+
+
+def log_debug(message: str, *args):
     """Função para logar mensagens de debug.
 
     Args:
-        message (str): Mensagem a ser logada.
+        message (str): Mensagem a ser logada, com marcadores % para os argumentos.
+        *args: Argumentos da mensagem.
     """
-    logger = logging.getLogger('debug')
-    logger.exception(message)    
+    # O logger 'debug' não tem configuração própria, então a mensagem é registrada como erro para não ser descartada
+    #   pelo nível padrão (WARNING). O traceback só é incluído quando a função é chamada durante o tratamento de uma
+    #   exceção.
+    _debug_logger.error(message, *args, exc_info=sys.exc_info()[0] is not None)
 
 
-def log_error(message: str):
+def log_error(message: str, *args):
     """Função para logar mensagens de erro.
 
     Args:
-        message (str): Mensagem a ser logada.
+        message (str): Mensagem a ser logada, com marcadores % para os argumentos.
+        *args: Argumentos da mensagem.
     """
-    logger = logging.getLogger('django')
-    logger.error(message)
+    _error_logger.error(message, *args)
     
     
-def log_info(message: str):
+def log_info(message: str, *args):
     """Função para logar mensagens de informação.
     
     Args:
-        message (str): Mensagem a ser logada.
+        message (str): Mensagem a ser logada, com marcadores % para os argumentos.
+        *args: Argumentos da mensagem.
     """
-    logger = logging.getLogger('processing')
-    logger.info(message)
+    _processing_logger.info(message, *args)
 
 
 def read_csv_file(file) -> Generator:
     """Função para ler um arquivo csv e retornar uma lista de dicionários.
     
+    Arquivos .csv.gz e .csv.zst são descomprimidos durante a leitura.
+    
     Args:
         file (File): Arquivo csv a ser lido.
     
     Returns:
         list: generator de dicionários com os dados do arquivo.
     """
-    with open(file, 'r') as f:
+    with io.TextIOWrapper(open_csv_stream(file), encoding='utf-8', newline='') as f:
         data = csv.DictReader(f)
         for row in data:
             yield row
+
+
+def batched(iterable: Iterable, size: int) -> Generator:
+    """Função para agrupar os itens de um iterável em lotes de tamanho fixo.
+    
+    Args:
+        iterable (Iterable): Iterável a ser agrupado. Pode ser um generator.
+        size (int): Tamanho máximo de cada lote.
+    
+    Returns:
+        Generator: generator de listas com no máximo `size` itens cada.
+    """
+    if size < 1:
+        raise ValueError('Batch size must be greater than zero.')
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
             
             
 def default_processing() -> bool:
@@ -136,10 +191,22 @@ class CreatePDFBillingClient(DefaultProcessing):
             bool: Resultado do processamento.
         """
         if self.process():
-            log_info(f'Creating pdf file for billing {billing.debt_id}')
+            if settings.PROCESSING_LOG_PER_ROW:
+                log_info('Creating pdf file for billing %s', billing.debt_id)
             return True
-        log_info(f'Error creating pdf file for billing {billing.debt_id}')
+        log_info('Error creating pdf file for billing %s', billing.debt_id)
         return False
+
+    def create_pdf_files(self, billings: list) -> list:
+        """Função para criar os arquivos pdf de um lote de cobranças em uma única chamada ao serviço.
+
+        Args:
+            billings (list): Cobranças do lote.
+
+        Returns:
+            list: Resultado de cada cobrança, na mesma ordem do lote.
+        """
+        return [self.create_pdf_file(billing) for billing in billings]
     
     
 class SendNotificationBillingClient(DefaultProcessing):
@@ -156,10 +223,67 @@ class SendNotificationBillingClient(DefaultProcessing):
             bool: Resultado do processamento.
         """
         if self.process():
-            log_info(f'Sending notification for billing {billing.debt_id}')
+            if settings.PROCESSING_LOG_PER_ROW:
+                log_info('Sending notification for billing %s', billing.debt_id)
             return True
-        log_info(f'Error sending notification for billing {billing.debt_id}')
+        log_info('Error sending notification for billing %s', billing.debt_id)
         return False
+
+    def send_notifications(self, billings: list) -> list:
+        """Função para enviar as notificações de um lote de cobranças em uma única chamada ao serviço.
+
+        Args:
+            billings (list): Cobranças do lote.
+
+        Returns:
+            list: Resultado de cada cobrança, na mesma ordem do lote.
+        """
+        return [self.send_notification(billing) for billing in billings]
+
+
+class SimulatedBillingClient(CreatePDFBillingClient, SendNotificationBillingClient):
+    """Cliente local que simula a latência dos serviços de pdf e notificação, sem acesso à rede.
+
+    Cada chamada custa `call_latency` segundos mais `item_cost` segundos por cobrança, o que permite medir o ganho das
+    chamadas em lote em testes e benchmarks. A quantidade de chamadas fica em `calls`.
+    """
+
+    def __init__(self, call_latency: float = 0.0, item_cost: float = 0.0):
+        self.call_latency = call_latency
+        self.item_cost = item_cost
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def call(self, items: int) -> list:
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.call_latency + self.item_cost * items)
+        return [True] * items
+
+    def create_pdf_file(self, billing) -> bool:
+        return self.call(1)[0]
+
+    def send_notification(self, billing) -> bool:
+        return self.call(1)[0]
+
+    def create_pdf_files(self, billings: list) -> list:
+        return self.call(len(billings))
+
+    def send_notifications(self, billings: list) -> list:
+        return self.call(len(billings))
+
+    # Versões assíncronas, usadas pelo AsyncBillingDispatcher sem ocupar uma thread durante a espera.
+    async def acall(self, items: int) -> list:
+        with self.lock:
+            self.calls += 1
+        await asyncio.sleep(self.call_latency + self.item_cost * items)
+        return [True] * items
+
+    async def acreate_pdf_files(self, billings: list) -> list:
+        return await self.acall(len(billings))
+
+    async def asend_notifications(self, billings: list) -> list:
+        return await self.acall(len(billings))
             
 
 class BaseModel(models.Model):
@@ -1,68 +1,135 @@
+import re
 import time
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 
-from .models import File, Billing
-from core.utils import CreatePDFBillingClient, SendNotificationBillingClient, create_default_api_response, log_debug, log_error, log_info, read_csv_file
-from .serializers import FileSerializer, BillingSerializer
-            
+from .models import File, ProcessingJob
+from core.exports import EXPORT_FORMATS, aiterate, export_billings, gzip_chunks
+from core.jobs import enqueue_job, requeue_job
+from core.metrics import REGISTRY, STAGE_SECONDS, UPLOADS
+from core.queries import billing_summary, filter_billings
+from core.uploads import (ContentHashUploadHandler, StreamingCSVUploadHandler, discard_upload,
+                          find_existing_job)
+from core.utils import compute_content_hash, create_default_api_response
+from .serializers import (BillingFilterSerializer, BillingSerializer, FileSerializer, FileSummarySerializer,
+                          ProcessingJobSerializer)
+
+
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
+
+def receive_upload(request, read_data) -> tuple:
+    """Função para receber um arquivo, registrá-lo e agendar o processamento.
+
+    É usada tanto pela viewset síncrona quanto pela view assíncrona. O hash do arquivo é calculado enquanto o upload é
+    recebido e, com FILE_UPLOAD_STREAMING_INGEST, o csv também é lido e inserido no banco durante o upload, no lugar
+    dos handlers padrão do Django.
 
-def process_csv_content(file, file_id: int) -> list:
-    """Função para processar o conteúdo de um arquivo csv.
-    
     Args:
-        file (File): Arquivo csv a ser processado.
-        file (int): Id do arquivo para registro.
-    
+        request (HttpRequest): Requisição do Django, antes da leitura do corpo.
+        read_data (Callable): Função que faz a leitura do corpo e retorna os dados com o campo `file`.
+
     Returns:
-        list: Lista com os objetos criados durante a leitura.
+        tuple: Status HTTP, mensagem e dados da resposta.
     """
     et1 = time.time()
-    bills = [Billing(file_id=file_id,
-                     name=row.get('name'),
-                     government_id=row.get('governmentId'),
-                     email=row.get('email'),
-                     debt_amount=row.get('debtAmount'),
-                     debt_due_date=row.get('debtDueDate'),
-                     debt_id=row.get('debtId')) for row in read_csv_file(file)]
-    et2 = time.time()
-    log_info(f'Processamento do arquivo: {et2 - et1}')
-    Billing.objects.bulk_create(bills, ignore_conflicts=True)
-    log_info(f'Inserção no banco: {time.time() - et2}')
-    
+    streaming = StreamingCSVUploadHandler(request) if settings.FILE_UPLOAD_STREAMING_INGEST else None
+    request.upload_handlers = [ContentHashUploadHandler(request)] + (
+        [streaming] if streaming else request.upload_handlers)
+    status, message, data = _register_upload(request, read_data(), streaming)
+    UPLOADS.inc(status=status)
+    STAGE_SECONDS.observe(time.time() - et1, stage='upload')
+    return status, message, data
 
-def send_notification(billing: Billing):
-    """Função para enviar uma notificação para o usuário.
-    
-    Args:
-        billing (Billing): Cobrança a ser notificada.
+
+def _register_upload(request, data, streaming: StreamingCSVUploadHandler) -> tuple:
+    placeholder = streaming.record if streaming else None
+    serializer = FileSerializer(placeholder, data=data)
+    if not serializer.is_valid():
+        discard_upload(placeholder)
+        return 400, 'file received with error', serializer.errors
+    uploaded = serializer.validated_data['file']
+    content_hash = getattr(request, 'upload_content_hashes', {}).get('file') or compute_content_hash(uploaded)
+    # Um arquivo idêntico já processado (ou em processamento) devolve o job existente.
+    existing = find_existing_job(content_hash)
+    if existing is not None:
+        discard_upload(placeholder, existing.file_id)
+        if existing.state == ProcessingJob.State.DONE:
+            return 200, 'file already processed', ProcessingJobSerializer(existing).data
+        return 202, 'file already queued for processing', ProcessingJobSerializer(existing).data
+    file = serializer.save(content_hash=content_hash)
+    if placeholder is not None:
+        # A leitura e a inserção já aconteceram durante o upload. Se elas falharam, o job refaz a leitura a partir do
+        #   arquivo gravado.
+        job = streaming.job
+        job.state = ProcessingJob.State.QUEUED
+        job.stage = '' if streaming.failed else ProcessingJob.Stage.NOTIFICATION
+        job.save(update_fields=['state', 'stage', 'updated_at'])
+    else:
+        job = ProcessingJob.objects.create(file=file)
+    # O processamento acontece fora da requisição. O cliente acompanha o progresso pelo endpoint de detalhe.
+    enqueue_job(job)
+    job.refresh_from_db()
+    return 202, 'file queued for processing', ProcessingJobSerializer(job).data
+
+
+class BillingCursorPagination(CursorPagination):
+    """Paginação das cobranças por cursor (keyset) na chave primária.
+
+    Cada página é uma consulta `id > último id da página anterior ... LIMIT`, então o custo é o mesmo na primeira e
+    na milésima página, ao contrário da paginação por offset. O tamanho da página pode ser escolhido com `page_size`.
     """
-    client = SendNotificationBillingClient()
-    return client.send_notification(billing)
 
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+
+    def __init__(self):
+        self.page_size = settings.BILLING_PAGE_SIZE
+        self.max_page_size = settings.BILLING_MAX_PAGE_SIZE
+
+
+def list_billings(request, view, file_id: int = None) -> Response:
+    """Função para responder uma página de cobranças com os filtros da query string.
 
-def create_pdf_file(billing: Billing):
-    """Função para criar um arquivo pdf com os dados da cobrança.
-    
     Args:
-        billing (Billing): Cobrança a ser notificada.
+        request (Request): Requisição do Rest Framework.
+        view (ViewSet): View que atende a requisição, usada pela paginação.
+        file_id (int): Id do arquivo, quando a consulta é feita a partir do arquivo. Opcional.
+
+    Returns:
+        Response: Página de cobranças e os links da página seguinte e anterior.
     """
-    client = CreatePDFBillingClient()
-    return client.create_pdf_file(billing)
+    filters = BillingFilterSerializer(data=request.query_params)
+    if not filters.is_valid():
+        return Response(create_default_api_response(400, 'invalid filters', filters.errors), status=400)
+    params = filters.validated_data
+    queryset = filter_billings(file_id or params.get('file'), params.get('status'), params.get('due_date_from'),
+                               params.get('due_date_to'))
+    paginator = BillingCursorPagination()
+    page = paginator.paginate_queryset(queryset, request, view=view)
+    return Response(create_default_api_response(200, 'billings', {
+        'next': paginator.get_next_link(),
+        'previous': paginator.get_previous_link(),
+        'results': BillingSerializer(page, many=True).data,
+    }))
 
 
-def send_notification_and_create_pdf(file_id: int):
-    """Função para enviar uma notificação e criar um arquivo pdf com os dados da cobrança.
-    
-    Args:
-        file_id (int): ID do arquivo criado.
+class BillingViewSet(ViewSet):
+    """Definição da viewset de leitura das cobranças.
+
+    Filtros: `file`, `status`, `due_date_from` e `due_date_to` (datas inclusivas, no formato AAAA-MM-DD).
     """
-    objs = Billing.objects.filter(file_id=file_id)
-    for billing in objs:
-        create_pdf_file(billing)
-        send_notification(billing)
-    objs.update(status=Billing.Status.NOTIFICATION_SENT)
+
+    def list(self, request):
+        return list_billings(request, self)
 
 
 # As views poderiam ser feitas via method_based porém achei melhor usar o Rest Framework para facilitar a implementação.
@@ -71,15 +138,94 @@ class FileViewSet(ViewSet):
     """
     
     serializer_class = FileSerializer
+    lookup_value_regex = r'\d+'
     
     def list(self, request):
         return Response({'detail': 'Method not allowed'}, status=405)
     
     def create(self, request):
-        serializer = FileSerializer(data=request.data)
-        if serializer.is_valid():
-            file = serializer.save()
-            process_csv_content(file.file.path, file.id)
-            send_notification_and_create_pdf(file.id)
-            return Response(create_default_api_response(201, 'file received', serializer.data), status=201)
-        return Response(create_default_api_response(400, 'file received with error', serializer.errors), status=400)
\ No newline at end of file
+        status, message, data = receive_upload(request._request, lambda: request.data)
+        return Response(create_default_api_response(status, message, data), status=status)
+
+    def retrieve(self, request, pk=None):
+        job = ProcessingJob.objects.filter(file_id=pk).first()
+        if job is None:
+            return Response(create_default_api_response(404, 'file not found'), status=404)
+        return Response(create_default_api_response(200, 'file status', ProcessingJobSerializer(job).data))
+
+    @action(detail=True, methods=['get'])
+    def billings(self, request, pk=None):
+        if not File.objects.filter(id=pk).exists():
+            return Response(create_default_api_response(404, 'file not found'), status=404)
+        return list_billings(request, self, int(pk))
+
+    @action(detail=True, methods=['get'])
+    def summary(self, request, pk=None):
+        summary = billing_summary(int(pk))
+        if summary is None:
+            return Response(create_default_api_response(404, 'file not found'), status=404)
+        return Response(create_default_api_response(200, 'file summary', FileSummarySerializer(summary).data))
+
+    @action(detail=True, methods=['post'])
+    def resume(self, request, pk=None):
+        job = ProcessingJob.objects.filter(file_id=pk).first()
+        if job is None:
+            return Response(create_default_api_response(404, 'file not found'), status=404)
+        # Apenas jobs com falha ou interrompidos podem ser retomados. O processamento continua do checkpoint.
+        if not requeue_job(job.id):
+            return Response(create_default_api_response(409, 'file is not resumable',
+                                                        ProcessingJobSerializer(job).data), status=409)
+        enqueue_job(job)
+        job.refresh_from_db()
+        return Response(create_default_api_response(202, 'file queued for processing',
+                                                    ProcessingJobSerializer(job).data), status=202)
+
+
+def metrics(request):
+    """View que expõe as métricas do processamento no formato texto do Prometheus.
+    """
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def export_file(request, file_id: int):
+    """View que exporta as cobranças de um arquivo, com o status, em csv (padrão) ou ndjson (`?format=ndjson`).
+
+    O conteúdo é gerado e enviado em blocos. Quando o cliente aceita gzip (Accept-Encoding) os blocos são comprimidos
+    à medida que são gerados e a resposta vai com Content-Encoding: gzip.
+    """
+    if request.method != 'GET':
+        return JsonResponse(create_default_api_response(405, 'method not allowed'), status=405)
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse(create_default_api_response(400, 'invalid format', {'format': list(EXPORT_FORMATS)}),
+                            status=400)
+    if not File.objects.filter(id=file_id).exists():
+        return JsonResponse(create_default_api_response(404, 'file not found'), status=404)
+    chunks = export_billings(file_id, export_format)
+    response = StreamingHttpResponse(content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="billings-{file_id}.{export_format}"'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if ACCEPTS_GZIP.search(request.headers.get('Accept-Encoding', '')):
+        chunks = gzip_chunks(chunks)
+        response['Content-Encoding'] = 'gzip'
+    # Em ASGI os blocos precisam ser entregues por um iterador assíncrono para não serem acumulados em memória.
+    response.streaming_content = aiterate(chunks) if isinstance(request, ASGIRequest) else chunks
+    return response
+
+
+async def upload_file(request):
+    """View assíncrona de upload, para servidores ASGI.
+
+    O servidor recebe o corpo da requisição sem ocupar uma thread, então uploads lentos não prendem os workers. Depois
+    do corpo recebido, o parse do multipart e o registro do arquivo (que usam o ORM) rodam em uma thread via
+    sync_to_async, e o processamento segue agendado na fila como na viewset.
+    """
+    if request.method != 'POST':
+        return JsonResponse(create_default_api_response(405, 'method not allowed'), status=405)
+    status, message, data = await sync_to_async(receive_upload)(request, lambda: request.FILES)
+    return JsonResponse(create_default_api_response(status, message, data), status=status)
+
+
+# O decorator csrf_exempt só aceita views assíncronas a partir do Django 5.0. O atributo tem o mesmo efeito, e a API
+#   também não exige CSRF na viewset (DRF sem autenticação por sessão).
+upload_file.csrf_exempt = True
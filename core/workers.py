@@ -0,0 +1,18 @@
+import django
+from django.conf import settings
+
+
+# Este módulo não importa os models: ele é carregado pelos processos da ingestão paralela antes do django.setup.
+
+
+def setup_worker(database_name: str) -> None:
+    """Função executada ao iniciar cada processo, antes de receber as faixas.
+
+    Os processos são criados com spawn e carregam as configurações do zero, então o nome do banco usado pelo processo
+    pai (que nos testes é o banco de teste) é repassado antes do django.setup.
+
+    Args:
+        database_name (str): Nome do banco `default` do processo pai.
+    """
+    settings.DATABASES['default']['NAME'] = database_name
+    django.setup()
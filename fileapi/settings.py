@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -75,14 +76,36 @@ WSGI_APPLICATION = 'fileapi.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# As conexões são persistentes (CONN_MAX_AGE, em segundos) e validadas antes de serem reutilizadas. Com DB_POOL o banco
+#   passa a ser o PostgreSQL com um pool de conexões do psycopg por processo (core/backends/postgresql), compartilhado
+#   pelas requisições e pelos workers do processamento. O pool é o indicado para o servidor ASGI, em que cada requisição
+#   roda em uma thread nova e conexões persistentes não são reutilizadas. DB_POOL_MAX_SIZE deve cobrir
+#   FILE_PROCESSING_WORKERS, DISPATCH_MAX_WORKERS e os uploads simultâneos; o tempo de espera por uma conexão livre é
+#   exposto em /api/metrics/ (fileapi_db_pool_wait_seconds).
+DB_POOL = os.environ.get('DB_POOL', 'false').lower() == 'true'
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'core.backends.postgresql' if DB_POOL else 'core.backends.sqlite3',
         'NAME': 'postgres',
         'USER': 'postgres',
         'PASSWORD': 'postgres',
         'HOST': 'db',
-        'PORT': '5432'
+        'PORT': '5432',
+        # Com o pool a conexão volta para ele ao fim de cada requisição, então não é mantida pelo Django.
+        'CONN_MAX_AGE': 0 if DB_POOL else int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'POOL': {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 20)),
+            # Tempo máximo de espera por uma conexão livre, em segundos.
+            'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+            # Conexões ociosas por mais tempo que isso são fechadas, até restar min_size.
+            'max_idle': float(os.environ.get('DB_POOL_MAX_IDLE', 600)),
+        },
+        # O banco de teste do SQLite fica em arquivo (e não em memória) para ser visto pelos processos da ingestão
+        #   paralela.
+        'TEST': {} if DB_POOL else {'NAME': str(BASE_DIR / 'test_postgres.sqlite3')},
     }
 }
 
@@ -134,9 +157,57 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media/'
 
 
+# Configuração do processamento de arquivos. O arquivo é lido e inserido no banco em lotes para que o consumo de
+#   memória não cresça junto com o tamanho do arquivo e para que cada transação seja curta.
+BILLING_BATCH_SIZE = int(os.environ.get('BILLING_BATCH_SIZE', 5000))
+# Com 'copy' os lotes são inseridos via COPY quando o banco é PostgreSQL. Com 'orm', ou em outros bancos, é usado o
+#   bulk_create do Django.
+BILLING_LOADER = os.environ.get('BILLING_LOADER', 'copy')
+# Com essa opção o csv é lido e inserido no banco enquanto o upload é recebido, em vez de ser lido depois de gravado.
+FILE_UPLOAD_STREAMING_INGEST = os.environ.get('FILE_UPLOAD_STREAMING_INGEST', 'true').lower() == 'true'
+# Quantidade de debt_ids já gravados mantidos em memória por processo (cache LRU). Linhas com esses ids são descartadas
+#   como duplicadas antes de irem ao banco. 0 desativa o cache; a restrição unique de debt_id continua valendo.
+BILLING_DEDUP_CACHE_SIZE = int(os.environ.get('BILLING_DEDUP_CACHE_SIZE', 200000))
+# Quantidade máxima de linhas rejeitadas guardadas no relatório de erros de cada arquivo.
+BILLING_MAX_REPORTED_ERRORS = int(os.environ.get('BILLING_MAX_REPORTED_ERRORS', 1000))
+# Quantidade de processos usados para ler e inserir um arquivo. Com mais de um processo o arquivo é dividido em faixas
+#   de bytes e cada processo cuida de uma faixa. Arquivos comprimidos são sempre lidos por um único processo.
+BILLING_PARSE_WORKERS = int(os.environ.get('BILLING_PARSE_WORKERS', 1))
+
+# O upload apenas registra o arquivo e um job na fila do banco. As etapas de leitura, inserção e notificação são
+#   executadas por um pool local de workers. Com FILE_PROCESSING_EAGER o job roda dentro da própria requisição.
+FILE_PROCESSING_WORKERS = int(os.environ.get('FILE_PROCESSING_WORKERS', 2))
+FILE_PROCESSING_EAGER = os.environ.get('FILE_PROCESSING_EAGER', 'false').lower() == 'true'
+# Um job em execução sem nenhum progresso por esse tempo (em segundos) é considerado interrompido e pode ser retomado.
+FILE_PROCESSING_STALE_SECONDS = int(os.environ.get('FILE_PROCESSING_STALE_SECONDS', 600))
+
+# Quantidade de cobranças por página na api de leitura, e o máximo que pode ser pedido com `page_size`.
+BILLING_PAGE_SIZE = int(os.environ.get('BILLING_PAGE_SIZE', 100))
+BILLING_MAX_PAGE_SIZE = int(os.environ.get('BILLING_MAX_PAGE_SIZE', 1000))
+
+# Criação dos pdfs e envio das notificações. As chamadas são feitas em paralelo por um pool de threads e podem ser
+#   limitadas por serviço, em chamadas por segundo. Um limite vazio desativa a limitação.
+# 'threads' usa um pool de threads; 'asyncio' usa um event loop, indicado para clientes com APIs assíncronas e muitas
+#   chamadas simultâneas. Em ambos, DISPATCH_MAX_WORKERS é a quantidade de lotes em andamento.
+DISPATCH_BACKEND = os.environ.get('DISPATCH_BACKEND', 'threads')
+DISPATCH_MAX_WORKERS = int(os.environ.get('DISPATCH_MAX_WORKERS', 8))
+DISPATCH_PDF_RATE_LIMIT = float(os.environ.get('DISPATCH_PDF_RATE_LIMIT') or 0) or None
+DISPATCH_NOTIFICATION_RATE_LIMIT = float(os.environ.get('DISPATCH_NOTIFICATION_RATE_LIMIT') or 0) or None
+# Quantidade máxima de cobranças enviadas em cada chamada aos serviços. Com os limites acima, cada chamada em lote
+#   conta como uma única chamada.
+DISPATCH_PDF_BATCH_SIZE = int(os.environ.get('DISPATCH_PDF_BATCH_SIZE', 50))
+DISPATCH_NOTIFICATION_BATCH_SIZE = int(os.environ.get('DISPATCH_NOTIFICATION_BATCH_SIZE', 50))
+
+
 # Configuração de logs para auxiliar no debug da aplicação e processamento de arquivos. Vou utilizar p do Django para
 #   facilitar a visualização dos logs. A intenção é utilizar dois arquivos. Um para logs de debug e outro para logs de
 #   processamento de arquivos.
+# Com LOGGING_ASYNC os loggers abaixo escrevem através de uma fila, e a escrita em disco acontece em uma thread
+#   separada. Com PROCESSING_LOG_PER_ROW o processamento registra uma mensagem por cobrança; caso contrário apenas um
+#   resumo por lote (falhas continuam sendo registradas por cobrança).
+LOGGING_ASYNC = os.environ.get('LOGGING_ASYNC', 'true').lower() == 'true'
+PROCESSING_LOG_PER_ROW = os.environ.get('PROCESSING_LOG_PER_ROW', 'false').lower() == 'true'
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,